@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Archivio dell'HTML scaricato, per rianalizzare le pagine senza rete
+
+Con HTML_ARCHIVE_DIR impostata ogni pagina arrivata allo scraper (risultati e dettaglio,
+anche quelle servite dalla cache HTTP) viene aggiunta a segmenti in sola aggiunta,
+segmento-00001.warc.gz, segmento-00002.warc.gz, ... : ogni pagina è un record WARC
+"resource" compresso come membro gzip a sé, quindi i segmenti si leggono anche con i
+normali strumenti WARC e un record si decomprime da solo partendo dal suo offset.
+L'indice SQLite della cartella (indice.sqlite) tiene per ogni acquisizione url, fase,
+giorno, segmento, offset e lunghezza. Una pagina identica all'ultima acquisizione dello
+stesso URL non viene riscritta: la nuova riga dell'indice punta al record esistente.
+
+La riproduzione rianalizza l'archivio con le stesse funzioni di parsing del crawl
+(analizza_annuncio / analizza_pagina_risultati) su tutti i processori e scrive uno
+snapshot per ogni giorno acquisito, ad esempio dopo una correzione del parser.
+
+Uso: python archivio_html.py riproduci <cartella> [formato] [--fase risultati] [--dal AAAA-MM-GG] [--al AAAA-MM-GG]
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+SEGMENTO_MAX_MB = 256  # Oltre questa dimensione si apre un nuovo segmento
+RECORD_PER_COMMIT = 200  # Acquisizioni scritte nell'indice alla volta
+PAGINE_PER_BLOCCO = 200  # Pagine analizzate da un processo alla volta durante la riproduzione
+FASI = ("dettaglio", "risultati")
+
+
+def _nome_segmento(numero):
+    return f"segmento-{numero:05d}.warc.gz"
+
+
+def _record_warc(url, html, adesso):
+    corpo = html.encode("utf-8")
+    intestazione = (
+        "WARC/1.1\r\n"
+        "WARC-Type: resource\r\n"
+        f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+        f"WARC-Date: {adesso.strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+        f"WARC-Target-URI: {url}\r\n"
+        "Content-Type: text/html; charset=utf-8\r\n"
+        f"Content-Length: {len(corpo)}\r\n"
+        "\r\n"
+    ).encode("utf-8")
+    return gzip.compress(intestazione + corpo + b"\r\n\r\n", compresslevel=6)
+
+
+def leggi_record(file_segmento, offset, lunghezza):
+    """HTML del record WARC che inizia a offset nel segmento già aperto"""
+    file_segmento.seek(offset)
+    record = gzip.decompress(file_segmento.read(lunghezza))
+    _, corpo = record.split(b"\r\n\r\n", 1)
+    return corpo[:-4].decode("utf-8")
+
+
+class ArchivioHtml:
+    """Acquisizione dell'HTML in segmenti WARC compressi con l'indice degli offset"""
+
+    def __init__(self, cartella, segmento_max_mb=SEGMENTO_MAX_MB):
+        os.makedirs(cartella, exist_ok=True)
+        self.cartella = cartella
+        self.segmento_max = segmento_max_mb * 1024 * 1024
+        self.conn = sqlite3.connect(os.path.join(cartella, "indice.sqlite"))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pagine ("
+            "id INTEGER PRIMARY KEY, url TEXT NOT NULL, fase TEXT NOT NULL, data TEXT NOT NULL, "
+            "segmento TEXT NOT NULL, offset INTEGER NOT NULL, lunghezza INTEGER NOT NULL, impronta TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_pagine_url ON pagine (url, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_pagine_fase_data ON pagine (fase, data)")
+        self.conn.commit()
+        self.statistiche = {"pagine": 0, "scritte": 0, "byte": 0}
+        self.in_sospeso = 0
+
+        # Si riprende dall'ultimo segmento: i record già scritti non vengono mai toccati
+        segmenti = sorted(nome for nome in os.listdir(cartella) if nome.startswith("segmento-"))
+        self.numero = int(segmenti[-1][len("segmento-"):-len(".warc.gz")]) if segmenti else 1
+        self._apri_segmento()
+
+    def _apri_segmento(self):
+        self.segmento = _nome_segmento(self.numero)
+        self.file = open(os.path.join(self.cartella, self.segmento), "ab")
+        self.offset = self.file.tell()
+
+    def registra(self, url, fase, html):
+        """Aggiunge una pagina all'archivio; se è uguale all'ultima acquisizione dell'URL si riusa quel record"""
+        self.statistiche["pagine"] += 1
+        adesso = datetime.now(timezone.utc)
+        impronta = hashlib.blake2b(html.encode("utf-8"), digest_size=16).hexdigest()
+        ultima = self.conn.execute(
+            "SELECT segmento, offset, lunghezza, impronta FROM pagine WHERE url = ? ORDER BY id DESC LIMIT 1", (url,)
+        ).fetchone()
+        if ultima is not None and ultima[3] == impronta:
+            segmento, offset, lunghezza = ultima[:3]
+        else:
+            if self.offset >= self.segmento_max:
+                self.file.close()
+                self.numero += 1
+                self._apri_segmento()
+            record = _record_warc(url, html, adesso)
+            self.file.write(record)
+            segmento, offset, lunghezza = self.segmento, self.offset, len(record)
+            self.offset += lunghezza
+            self.statistiche["scritte"] += 1
+            self.statistiche["byte"] += lunghezza
+
+        self.conn.execute(
+            "INSERT INTO pagine (url, fase, data, segmento, offset, lunghezza, impronta) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (url, fase, adesso.astimezone().strftime("%Y-%m-%d"), segmento, offset, lunghezza, impronta),
+        )
+        self.in_sospeso += 1
+        if self.in_sospeso >= RECORD_PER_COMMIT:
+            self._salva()
+
+    def _salva(self):
+        # Prima i record su disco, poi l'indice: una riga dell'indice punta sempre a byte scritti
+        self.file.flush()
+        self.conn.commit()
+        self.in_sospeso = 0
+
+    def log_statistiche(self):
+        s = self.statistiche
+        logger.info(
+            f"   - Archivio HTML: {s['pagine']} pagine acquisite, {s['scritte']} nuove "
+            f"({round(s['byte'] / 1024 / 1024, 1)} MB compressi in {self.segmento})"
+        )
+
+    def chiudi(self):
+        self._salva()
+        self.file.close()
+        self.conn.close()
+
+
+def archivio_da_env():
+    """Crea l'archivio dalla variabile d'ambiente HTML_ARCHIVE_DIR (vuoto = disattivato)"""
+    cartella = os.getenv('HTML_ARCHIVE_DIR', '')
+    if not cartella:
+        return None
+    archivio = ArchivioHtml(cartella, segmento_max_mb=int(os.getenv('HTML_ARCHIVE_SEGMENT_MB', str(SEGMENTO_MAX_MB))))
+    logger.info(f"📼 Archivio HTML attivo in {cartella} (segmento {archivio.segmento})")
+    return archivio
+
+
+# -----------------------
+# Riproduzione
+# -----------------------
+def _analizza_blocco(cartella, fase, parser, voci):
+    """Rianalizza un blocco di pagine (url, segmento, offset, lunghezza); None per le pagine non analizzabili"""
+    # Import qui: il crawl importa questo modulo, la riproduzione usa il suo parsing
+    from scraper_completo import analizza_annuncio, analizza_pagina_risultati
+    risultati = []
+    aperti = {}
+    try:
+        for url, segmento, offset, lunghezza in voci:
+            if segmento not in aperti:
+                aperti[segmento] = open(os.path.join(cartella, segmento), "rb")
+            try:
+                html = leggi_record(aperti[segmento], offset, lunghezza)
+                if fase == "dettaglio":
+                    risultati.append([analizza_annuncio(html, url, parser)])
+                else:
+                    risultati.append(analizza_pagina_risultati(html, parser, True)[0])
+            except Exception as e:
+                logger.warning(f"❌ Pagina non analizzabile {url} ({segmento}@{offset}): {e}")
+                risultati.append(None)
+    finally:
+        for file_segmento in aperti.values():
+            file_segmento.close()
+    return risultati
+
+
+def riproduci(cartella, formato="csv", fase="dettaglio", dal=None, al=None, processi=None, parser=None, prefisso="riprodotto"):
+    """
+    Rianalizza le pagine della fase acquisite tra dal e al (giorni AAAA-MM-GG, inclusi) e
+    scrive uno snapshot per giorno; ritorna i percorsi scritti. Ogni record dell'archivio
+    viene analizzato una volta sola anche se è condiviso da più giorni, i blocchi seguono
+    l'ordine dei segmenti per leggere il disco in sequenza.
+    """
+    # Import qui: pandas e il parsing servono solo alla riproduzione
+    from normalizza_annunci import normalizza_annunci
+    from record_annunci import Annuncio, BloccoAnnunci
+    from scraper_completo import HTML_PARSER
+    from unisci_shard import scrivi_snapshot
+
+    if fase not in FASI:
+        raise ValueError(f"❌ Fase non valida: {fase} (attese: {', '.join(FASI)})")
+    conn = sqlite3.connect(os.path.join(cartella, "indice.sqlite"))
+    try:
+        righe = conn.execute(
+            "SELECT url, segmento, offset, lunghezza, data FROM pagine "
+            "WHERE fase = ? AND data >= ? AND data <= ? ORDER BY segmento, offset",
+            (fase, dal or "0000-00-00", al or "9999-99-99"),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    # Record dell'archivio -> giorni in cui è stato acquisito
+    giorni_record = defaultdict(set)
+    for url, segmento, offset, lunghezza, giorno in righe:
+        giorni_record[(url, segmento, offset, lunghezza)].add(giorno)
+    voci = list(giorni_record)
+    blocchi = [voci[i:i + PAGINE_PER_BLOCCO] for i in range(0, len(voci), PAGINE_PER_BLOCCO)]
+    logger.info(f"📼 Riproduzione di {len(righe)} acquisizioni ({len(voci)} pagine distinte, fase {fase})")
+
+    annunci_per_giorno = defaultdict(dict)
+    errori = 0
+    analizza = partial(_analizza_blocco, cartella, fase, parser or HTML_PARSER)
+    with ProcessPoolExecutor(max_workers=processi or os.cpu_count()) as pool:
+        for blocco, risultati in zip(blocchi, pool.map(analizza, blocchi)):
+            for voce, annunci in zip(blocco, risultati):
+                if annunci is None:
+                    errori += 1
+                    continue
+                for giorno in giorni_record[voce]:
+                    for dati in annunci:
+                        annunci_per_giorno[giorno][dati["url"]] = Annuncio.da_analisi(dati, giorno)
+
+    percorsi = []
+    for giorno in sorted(annunci_per_giorno):
+        blocco = BloccoAnnunci()
+        for annuncio in annunci_per_giorno[giorno].values():
+            blocco.aggiungi(annuncio)
+        # Nome con la data nel formato degli snapshot del crawl (letto da archivio_snapshot.py)
+        percorso = f"{prefisso}_{giorno.replace('-', '')}_000000_{len(blocco)}_annunci_{fase}.{formato}"
+        scrivi_snapshot(normalizza_annunci(blocco.dataframe()), percorso, datetime.strptime(giorno, "%Y-%m-%d").date())
+        logger.info(f"✅ {giorno}: {len(blocco)} annunci in {percorso}")
+        percorsi.append(percorso)
+    if errori:
+        logger.warning(f"⚠️ {errori} pagine non analizzabili")
+    return percorsi
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    argomenti = sys.argv[1:]
+    opzioni = {}
+    for nome in ("--fase", "--dal", "--al"):
+        if nome in argomenti:
+            indice = argomenti.index(nome)
+            opzioni[nome[2:]] = argomenti[indice + 1]
+            del argomenti[indice:indice + 2]
+    if len(argomenti) < 2 or argomenti[0] != "riproduci":
+        print(__doc__)
+        sys.exit(1)
+    riproduci(argomenti[1], argomenti[2] if len(argomenti) > 2 else "csv", **opzioni)
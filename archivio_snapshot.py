@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+Archivio storico interrogabile degli snapshot degli annunci (SQLite)
+
+Gli snapshot (CSV delle release, file sotto scraping-data/ su GCS, output locali) vengono
+importati una volta sola in un database con indici su _id, data di scraping e prezzo, così
+"storico del prezzo dell'annuncio X" o "mediana del €/m² per settimana" non richiedono di
+riscaricare e rileggere tutti i file:
+- storico: un periodo (dal, al) per annuncio con gli stessi valori numerici; un giorno
+  appena importato è un periodo di un giorno
+- compattazione: a mese concluso le osservazioni uguali dello stesso annuncio in snapshot
+  consecutivi diventano un solo periodo; un annuncio assente da uno snapshot (crawl
+  parziale, annuncio nascosto per qualche giorno) chiude il periodo. I periodi non
+  attraversano mai l'inizio di un mese, quindi una ricerca per intervallo di date legge
+  solo i periodi iniziati dal mese di partenza
+- annunci: titolo, indirizzo, url e tag dell'ultima visita, una riga per annuncio
+
+Uso:
+    python archivio_snapshot.py importa <snapshot> [<snapshot> ...]
+    python archivio_snapshot.py importa-gcs <bucket> [<prefisso>]
+    python archivio_snapshot.py compatta [YYYY-MM]
+    python archivio_snapshot.py storico <_id>
+    python archivio_snapshot.py settimane <dal> <al>
+"""
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import date, datetime
+
+import pandas as pd
+
+from normalizza_annunci import normalizza_annunci
+from record_annunci import lista_tags
+from unisci_shard import leggi_snapshot
+
+logger = logging.getLogger(__name__)
+
+ARCHIVIO_DB = "archivio_annunci.sqlite"
+# Valori seguiti nel tempo: un cambiamento di uno di questi apre un nuovo periodo
+CAMPI_STORICO = ["prezzo_eur", "superficie_m2", "prezzo_m2", "num_locali", "num_bagni", "classe_ener", "attivo"]
+CAMPI_ANNUNCIO = ["url", "titolo", "indirizzo", "tags"]
+DATA_NEL_NOME = re.compile(r"_(\d{4})(\d{2})(\d{2})_\d{6}_")  # trovacasa_milano_YYYYMMDD_HHMMSS_..._annunci_completi
+
+
+def apri_archivio(percorso=ARCHIVIO_DB):
+    """Apre (creandolo se serve) il database dell'archivio storico"""
+    conn = sqlite3.connect(percorso)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS snapshot_importati (
+            nome TEXT PRIMARY KEY,
+            data_scraping TEXT NOT NULL,
+            righe INTEGER NOT NULL,
+            data_importazione TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS annunci (
+            _id TEXT PRIMARY KEY,
+            url TEXT,
+            titolo TEXT,
+            indirizzo TEXT,
+            tags TEXT,
+            data_ultima_visita TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS storico (
+            _id TEXT NOT NULL,
+            dal TEXT NOT NULL,
+            al TEXT NOT NULL,
+            prezzo_eur REAL,
+            superficie_m2 REAL,
+            prezzo_m2 REAL,
+            num_locali INTEGER,
+            num_bagni INTEGER,
+            classe_ener TEXT,
+            attivo INTEGER NOT NULL,
+            PRIMARY KEY (_id, dal)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_storico_dal ON storico(dal);
+        CREATE INDEX IF NOT EXISTS idx_storico_prezzo ON storico(prezzo_eur);
+        CREATE TABLE IF NOT EXISTS meta (
+            chiave TEXT PRIMARY KEY,
+            valore TEXT
+        );
+    """)
+    conn.commit()
+    return conn
+
+
+def _meta(conn, chiave, valore=None):
+    if valore is not None:
+        conn.execute("INSERT OR REPLACE INTO meta (chiave, valore) VALUES (?, ?)", (chiave, valore))
+        return valore
+    riga = conn.execute("SELECT valore FROM meta WHERE chiave = ?", (chiave,)).fetchone()
+    return riga[0] if riga else None
+
+
+def _data_snapshot(df, nome):
+    """Giorno di scraping: colonna data_scraping (Parquet/Arrow) oppure timestamp nel nome del file"""
+    if "data_scraping" in df.columns and df["data_scraping"].notna().any():
+        return str(df["data_scraping"].dropna().iloc[0])[:10]
+    trovata = DATA_NEL_NOME.search(os.path.basename(nome))
+    if trovata is None:
+        raise ValueError(f"❌ Data di scraping non ricavabile per {nome}: indicarla con data_scraping")
+    return "-".join(trovata.groups())
+
+
+def _tags(valore):
+    # Nell'archivio i tag sono una lista JSON
+    return json.dumps(lista_tags(valore), ensure_ascii=False)
+
+
+def _righe(df, colonne):
+    """Tuple di valori Python per sqlite3 (NaN/NA diventano NULL)"""
+    valori = df[colonne].astype(object)
+    return list(valori.where(df[colonne].notna(), None).itertuples(index=False, name=None))
+
+
+def importa_snapshot(conn, snapshot, nome=None, data_scraping=None):
+    """
+    Importa uno snapshot (percorso o DataFrame, con nome) nell'archivio; ritorna le righe
+    importate, 0 se lo snapshot era già stato importato o cade in un mese già compattato
+    """
+    nome = nome or os.path.basename(snapshot)
+    if conn.execute("SELECT 1 FROM snapshot_importati WHERE nome = ?", (nome,)).fetchone():
+        logger.info(f"🗄️ {nome} già importato nell'archivio")
+        return 0
+    df = leggi_snapshot(snapshot) if isinstance(snapshot, str) else snapshot
+    giorno = data_scraping or (_data_snapshot(df, nome) if len(df) else date.today().isoformat())
+    compattato = _meta(conn, "compattato_fino_a")
+    if compattato and giorno < compattato:
+        logger.warning(f"⚠️ {nome} ({giorno}) cade in un mese già compattato, non importato")
+        return 0
+
+    righe = 0
+    if len(df):
+        df = normalizza_annunci(df)
+        # Come in diff_snapshot.py: un record senza codice (es. dalla modalità veloce) si riconosce dall'URL
+        chiave = df["_id"].where(df["_id"].notna() & (df["_id"] != ""), df["url"]) if "_id" in df.columns else df["url"]
+        df = df.assign(_id=chiave.astype(str), dal=giorno, al=giorno).drop_duplicates("_id", keep="last")
+        attivo = df["attivo"] if "attivo" in df.columns else pd.Series(True, index=df.index)
+        df["attivo"] = ~attivo.astype(str).str.lower().isin(["false", "0"])
+        df["classe_ener"] = df["classe_ener"].where(df["classe_ener"] != "N/A") if "classe_ener" in df.columns else None
+        df["tags"] = df["tags"].map(_tags) if "tags" in df.columns else "[]"
+        for colonna in CAMPI_ANNUNCIO:
+            if colonna not in df.columns:
+                df[colonna] = None
+
+        conn.executemany(
+            f"INSERT OR REPLACE INTO storico (_id, dal, al, {', '.join(CAMPI_STORICO)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' * len(CAMPI_STORICO))})",
+            _righe(df, ["_id", "dal", "al"] + CAMPI_STORICO),
+        )
+        # Testi dell'annuncio: vince l'ultima visita, anche se gli snapshot arrivano in disordine
+        conn.executemany(
+            "INSERT INTO annunci (_id, url, titolo, indirizzo, tags, data_ultima_visita) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(_id) DO UPDATE SET url = excluded.url, titolo = excluded.titolo, indirizzo = excluded.indirizzo, "
+            "tags = excluded.tags, data_ultima_visita = excluded.data_ultima_visita "
+            "WHERE excluded.data_ultima_visita >= annunci.data_ultima_visita",
+            _righe(df, ["_id"] + CAMPI_ANNUNCIO + ["dal"]),
+        )
+        righe = len(df)
+    conn.execute(
+        "INSERT INTO snapshot_importati (nome, data_scraping, righe, data_importazione) VALUES (?, ?, ?, ?)",
+        (nome, giorno, righe, datetime.now().isoformat(timespec="seconds")),
+    )
+    conn.commit()
+    logger.info(f"🗄️ Importato {nome} ({giorno}): {righe} annunci")
+    return righe
+
+
+def importa_gcs(conn, bucket, prefisso="scraping-data"):
+    """Importa gli snapshot sotto prefisso non ancora nell'archivio, in ordine di nome (cioè di timestamp)"""
+    importati = {riga[0] for riga in conn.execute("SELECT nome FROM snapshot_importati")}
+    blobs = sorted(
+        (blob for blob in bucket.list_blobs(prefix=prefisso)
+         if "_annunci_completi." in blob.name and "_EMPTY" not in blob.name
+         and os.path.basename(blob.name) not in importati),
+        key=lambda blob: os.path.basename(blob.name),
+    )
+    righe = 0
+    with tempfile.TemporaryDirectory() as cartella:
+        for blob in blobs:
+            percorso = os.path.join(cartella, os.path.basename(blob.name))
+            # CSV/JSONL caricati con Content-Encoding gzip vengono decompressi dal client
+            blob.download_to_filename(percorso)
+            righe += importa_snapshot(conn, percorso)
+            os.remove(percorso)
+    logger.info(f"🗄️ Da gs://{bucket.name}/{prefisso}: {len(blobs)} snapshot nuovi, {righe} righe importate")
+    return righe
+
+
+def _inizio_mese(giorno):
+    return giorno[:7] + "-01"
+
+
+def compatta_archivio(conn, fino_al_mese=None):
+    """
+    Unisce in un solo periodo le osservazioni uguali di ogni annuncio in snapshot
+    consecutivi (nessuno snapshot importato tra le due date), per i mesi precedenti a
+    fino_al_mese (YYYY-MM, predefinito: il mese corrente). I mesi compattati restano
+    chiusi: snapshot di quei giorni non vengono più importati.
+    Ritorna (righe prima, periodi dopo)
+    """
+    limite = (fino_al_mese or date.today().strftime("%Y-%m")) + "-01"
+    inizio = _meta(conn, "compattato_fino_a") or ""
+    if limite <= inizio:
+        logger.info(f"🗜️ Archivio già compattato fino a {inizio}")
+        return 0, 0
+
+    df = pd.read_sql_query(
+        "SELECT * FROM storico WHERE dal >= ? AND dal < ? ORDER BY _id, dal", conn, params=(inizio, limite),
+    )
+    if df.empty:
+        _meta(conn, "compattato_fino_a", limite)
+        conn.commit()
+        return 0, 0
+
+    # Posizione di ogni giorno tra gli snapshot importati: gli snapshot non sono quotidiani,
+    # quindi "consecutivo" vuol dire lo snapshot successivo, non il giorno successivo
+    date_snapshot = {riga[0] for riga in conn.execute("SELECT data_scraping FROM snapshot_importati")}
+    posizione = {giorno: i for i, giorno in enumerate(sorted(date_snapshot | set(df["dal"]) | set(df["al"])))}
+    consecutivo = df["dal"].map(posizione) == df["al"].map(posizione).shift() + 1
+
+    # Un periodo nuovo a ogni cambio di annuncio, di mese o di uno dei valori seguiti, e
+    # dopo uno snapshot in cui l'annuncio non c'era
+    valori = df[CAMPI_STORICO].astype(str)
+    mese = df["dal"].str[:7]
+    nuovo = (
+        (df["_id"] != df["_id"].shift()) | (mese != mese.shift()) | (valori != valori.shift()).any(axis=1) | ~consecutivo
+    )
+    periodi = df[nuovo].copy()
+    periodi["al"] = df.groupby(nuovo.cumsum())["al"].max().to_numpy()
+
+    conn.execute("DELETE FROM storico WHERE dal >= ? AND dal < ?", (inizio, limite))
+    conn.executemany(
+        f"INSERT INTO storico (_id, dal, al, {', '.join(CAMPI_STORICO)}) VALUES (?, ?, ?, {', '.join('?' * len(CAMPI_STORICO))})",
+        _righe(periodi, ["_id", "dal", "al"] + CAMPI_STORICO),
+    )
+    _meta(conn, "compattato_fino_a", limite)
+    conn.commit()
+    # Restituisce al file lo spazio delle righe cancellate
+    conn.execute("VACUUM")
+    logger.info(f"🗜️ Archivio compattato fino a {limite}: {len(df)} righe giornaliere -> {len(periodi)} periodi")
+    return len(df), len(periodi)
+
+
+def storico_annuncio(conn, id_annuncio):
+    """Periodi di un annuncio (per _id, o per url se non ha codice) in ordine di data"""
+    return pd.read_sql_query(
+        "SELECT * FROM storico WHERE _id = ? ORDER BY dal", conn, params=(id_annuncio,),
+    )
+
+
+def storico_intervallo(conn, dal, al, prezzo_min=None, prezzo_max=None):
+    """
+    Periodi che si sovrappongono all'intervallo [dal, al] (date YYYY-MM-DD), con un filtro
+    facoltativo sul prezzo; legge solo i periodi iniziati dal mese di dal in poi (indice su dal)
+    """
+    condizioni = ["dal >= ?", "dal <= ?", "al >= ?"]
+    parametri = [_inizio_mese(dal), al, dal]
+    if prezzo_min is not None:
+        condizioni.append("prezzo_eur >= ?")
+        parametri.append(prezzo_min)
+    if prezzo_max is not None:
+        condizioni.append("prezzo_eur <= ?")
+        parametri.append(prezzo_max)
+    return pd.read_sql_query(
+        f"SELECT * FROM storico WHERE {' AND '.join(condizioni)} ORDER BY dal, _id", conn, params=parametri,
+    )
+
+
+def prezzo_m2_settimanale(conn, dal, al):
+    """Mediana del €/m² degli annunci attivi per settimana (dal lunedì) tra dal e al"""
+    df = storico_intervallo(conn, dal, al)
+    df = df[(df["attivo"] == 1) & df["prezzo_m2"].notna()]
+    if df.empty:
+        return pd.DataFrame(columns=["settimana", "prezzo_m2_mediano", "annunci"])
+
+    # Ogni periodo conta una volta, con il suo ultimo valore, per ogni settimana che tocca
+    inizio = pd.to_datetime(df["dal"].clip(lower=dal))
+    fine = pd.to_datetime(df["al"].clip(upper=al))
+    prima = inizio - pd.to_timedelta(inizio.dt.weekday, unit="D")
+    ultima = fine - pd.to_timedelta(fine.dt.weekday, unit="D")
+    settimane = ((ultima - prima).dt.days // 7 + 1).to_numpy()
+    espanso = df.loc[df.index.repeat(settimane), ["_id", "dal", "prezzo_m2"]]
+    scostamento = espanso.groupby(level=0).cumcount().to_numpy()
+    espanso["settimana"] = prima.loc[espanso.index].to_numpy() + pd.to_timedelta(scostamento * 7, unit="D")
+    espanso = espanso.sort_values("dal").drop_duplicates(["_id", "settimana"], keep="last")
+
+    risultato = espanso.groupby("settimana")["prezzo_m2"].agg(prezzo_m2_mediano="median", annunci="size").reset_index()
+    risultato["settimana"] = risultato["settimana"].dt.strftime("%Y-%m-%d")
+    return risultato
+
+
+def importa_dopo_scraping(percorso_archivio, snapshot, data_scraping):
+    """Import incrementale a fine scraping_completo (ARCHIVE_DB): lo snapshot appena salvato"""
+    conn = apri_archivio(percorso_archivio)
+    try:
+        return importa_snapshot(conn, snapshot, data_scraping=data_scraping)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    comando, argomenti = sys.argv[1], sys.argv[2:]
+    conn = apri_archivio(os.getenv("ARCHIVE_DB", ARCHIVIO_DB))
+    try:
+        if comando == "importa" and argomenti:
+            for percorso in argomenti:
+                importa_snapshot(conn, percorso)
+        elif comando == "importa-gcs" and argomenti:
+            # Import qui: google-cloud-storage serve solo per leggere dal bucket
+            from google.cloud import storage
+            importa_gcs(conn, storage.Client().bucket(argomenti[0]), *argomenti[1:2])
+        elif comando == "compatta":
+            compatta_archivio(conn, *argomenti[:1])
+        elif comando == "storico" and argomenti:
+            print(storico_annuncio(conn, argomenti[0]).to_string(index=False))
+        elif comando == "settimane" and len(argomenti) == 2:
+            print(prezzo_m2_settimanale(conn, *argomenti).to_string(index=False))
+        else:
+            sys.exit(__doc__)
+    finally:
+        conn.close()
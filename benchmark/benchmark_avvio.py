@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark del tempo di avvio degli entry point, con python -X importtime.
+
+Per ogni script (importato senza eseguire il blocco __main__) riporta il tempo
+cumulativo di import, mediana di più esecuzioni in processi nuovi, e i pacchetti
+più pesanti caricati. Con --confronta REV misura anche la stessa versione dei file
+a una revisione git (es. il commit precedente), per vedere l'effetto degli import
+lazy su pandas e google-cloud-storage.
+
+Uso: python benchmark/benchmark_avvio.py [--ripetizioni 7] [--confronta HEAD~1]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+RADICE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINT = ("scraper_improved", "scraper_completo", "scraper_completo_gcs")
+
+
+def tempi_import(cartella, modulo):
+    """Esegue l'import in un processo nuovo e ritorna {modulo importato: µs cumulativi}"""
+    uscita = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=cartella, capture_output=True, text=True, check=True,
+    )
+    tempi = {}
+    for riga in uscita.stderr.splitlines():
+        if not riga.startswith("import time:") or "cumulative" in riga:
+            continue
+        _, cumulativo, nome = riga.split("|")
+        tempi.setdefault(nome.strip(), int(cumulativo))
+    return tempi
+
+
+def misura(cartella, modulo, ripetizioni):
+    esecuzioni = [tempi_import(cartella, modulo) for _ in range(ripetizioni)]
+    totale = statistics.median(e[modulo] for e in esecuzioni) / 1000
+    # Pacchetti di primo livello più pesanti (dall'ultima esecuzione)
+    pesanti = sorted(
+        ((nome, micro / 1000) for nome, micro in esecuzioni[-1].items() if "." not in nome and nome != modulo),
+        key=lambda voce: -voce[1],
+    )[:5]
+    return totale, pesanti
+
+
+def estrai_revisione(revisione, destinazione):
+    archivio = os.path.join(destinazione, "sorgenti.tar")
+    subprocess.run(["git", "archive", "--format=tar", "-o", archivio, revisione], cwd=RADICE, check=True)
+    with tarfile.open(archivio) as tar:
+        tar.extractall(destinazione)
+    return destinazione
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tempo di avvio degli entry point")
+    parser.add_argument("--ripetizioni", type=int, default=7)
+    parser.add_argument("--confronta", metavar="REV", help="revisione git da misurare per confronto")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporanea:
+        versioni = [("attuale", RADICE)]
+        if args.confronta:
+            versioni.insert(0, (args.confronta, estrai_revisione(args.confronta, temporanea)))
+
+        print(f"{'entry point':<22} {'versione':<12} {'import ms':>10}  pacchetti più pesanti (ms cumulativi)")
+        for modulo in ENTRY_POINT:
+            for nome, cartella in versioni:
+                totale, pesanti = misura(cartella, modulo, args.ripetizioni)
+                elenco = ", ".join(f"{pacchetto} {ms:.0f}" for pacchetto, ms in pesanti)
+                print(f"{modulo:<22} {nome:<12} {totale:>10.1f}  {elenco}")
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark dell'estrazione dei campi dalla pagina di dettaglio.
+
+Confronta, sulle pagine salvate in benchmark/fixtures, la vecchia estrazione
+(una scansione di tutti i dl.row per ogni etichetta) con l'estrattore a passata
+singola estrai_dettaglio, per ciascun backend di parsing.
+
+Uso: python benchmark/benchmark_estrazione.py [ripetizioni]
+"""
+
+import os
+import sys
+import time
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scraper_completo import estrai_dettaglio, campi_da_termini, CAMPI_DETTAGLIO
+
+CARTELLA_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PARSERS = ["html.parser", "lxml"]
+
+
+def estrazione_precedente(soup):
+    """Estrazione com'era in estrai_annuncio prima dell'estrattore a passata singola"""
+    prezzo = soup.select_one(".price")
+    titolo = soup.select_one(".immobile__title.headingOne")
+    indirizzo = soup.select_one(".indirizzo")
+    tag_elements = soup.select(".immobileDetails__tagLabel")
+
+    def get_value(label):
+        for dl in soup.select("dl.row"):
+            dt = dl.find("dt", class_="term")
+            if dt and label in dt.text:
+                dd = dl.find("dd", class_="description")
+                if dd:
+                    return dd.text.strip()
+        return None
+
+    campi = {colonna: get_value(etichetta) for etichetta, colonna in CAMPI_DETTAGLIO.items()}
+    campi["prezzo"] = prezzo.get_text(strip=True) if prezzo else None
+    campi["titolo"] = titolo.get_text(strip=True) if titolo else None
+    campi["indirizzo"] = indirizzo.get_text(strip=True) if indirizzo else None
+    campi["tags"] = [tag.get_text(strip=True) for tag in tag_elements]
+    return campi
+
+
+def estrazione_passata_singola(soup):
+    dettaglio = estrai_dettaglio(soup)
+    campi = campi_da_termini(dettaglio["termini"])
+    campi.update({k: dettaglio[k] for k in ("prezzo", "titolo", "indirizzo", "tags")})
+    return campi
+
+
+def cronometra(funzione, argomento, ripetizioni):
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        funzione(argomento)
+    return (time.perf_counter() - inizio) / ripetizioni * 1000
+
+
+def main(ripetizioni=200):
+    fixtures = sorted(f for f in os.listdir(CARTELLA_FIXTURES) if f.startswith("dettaglio_"))
+    print(f"{'fixture':<28} {'parser':<12} {'parse ms':>9} {'prima ms':>9} {'dopo ms':>9} {'speedup':>8}")
+    for nome in fixtures:
+        with open(os.path.join(CARTELLA_FIXTURES, nome), encoding="utf-8") as f:
+            html = f.read()
+        for parser in PARSERS:
+            soup = BeautifulSoup(html, parser)
+
+            # Le due estrazioni devono restituire gli stessi campi
+            assert estrazione_precedente(soup) == estrazione_passata_singola(soup), nome
+
+            t_parse = cronometra(lambda h: BeautifulSoup(h, parser), html, max(ripetizioni // 10, 1))
+            t_prima = cronometra(estrazione_precedente, soup, ripetizioni)
+            t_dopo = cronometra(estrazione_passata_singola, soup, ripetizioni)
+            print(f"{nome:<28} {parser:<12} {t_parse:>9.3f} {t_prima:>9.3f} {t_dopo:>9.3f} {t_prima / t_dopo:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark della memoria occupata dagli annunci accumulati in estrai_annunci_in_pipeline.
+
+Confronta la vecchia rappresentazione (un dict da 14 chiavi per annuncio con la lista
+dei tag, raccolti in una lista e convertiti con pd.DataFrame(lista)) con quella di
+record_annunci.py (Annuncio con __slots__ e tag internati, accumulati per colonna in un
+BloccoAnnunci). I record sono ricavati dalle pagine in benchmark/fixtures e ricostruiti
+da JSON uno per uno, come arrivano dal pool di parsing (stringhe nuove per ogni annuncio).
+Riporta i byte per annuncio accumulato (tracemalloc) e il picco di memoria e il tempo
+della conversione in DataFrame.
+
+Uso: python benchmark/benchmark_memoria.py [--annunci 10000 100000]
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd
+
+from record_annunci import Annuncio, BloccoAnnunci
+from scraper_completo import analizza_annuncio
+
+CARTELLA_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+OGGI = "2026-01-01"
+
+
+def record_analizzati(n):
+    """n risultati di analizza_annuncio serializzati in JSON, ognuno con codice e URL propri"""
+    modelli = []
+    for nome in sorted(os.listdir(CARTELLA_FIXTURES)):
+        with open(os.path.join(CARTELLA_FIXTURES, nome), encoding="utf-8") as f:
+            modelli.append(analizza_annuncio(f.read(), "", "html.parser"))
+    testi = []
+    for i in range(n):
+        record = dict(modelli[i % len(modelli)], _id=f"A{i}", url=f"https://www.trovacasa.it/immobile/{i}")
+        testi.append(json.dumps(record, ensure_ascii=False))
+    return testi
+
+
+def accumula_dict(testi):
+    risultati = []
+    for testo in testi:
+        dati = json.loads(testo)
+        dati.update({"attivo": True, "data_comparsa": OGGI, "data_aggiornamento": None, "data_scomparsa": None})
+        risultati.append(dati)
+    return risultati
+
+
+def accumula_compatto(testi):
+    risultati = BloccoAnnunci()
+    for testo in testi:
+        risultati.aggiungi(Annuncio.da_analisi(json.loads(testo), OGGI))
+    return risultati
+
+
+def misura(testi, accumula, converti):
+    gc.collect()
+    tracemalloc.start()
+    risultati = accumula(testi)
+    accumulati = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    inizio = time.perf_counter()
+    df = converti(risultati)
+    durata = time.perf_counter() - inizio
+    picco = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert len(df) == len(testi)
+    return accumulati / len(testi), picco / 1024 / 1024, durata
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memoria degli annunci accumulati")
+    parser.add_argument("--annunci", type=int, nargs="+", default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'annunci':>8} {'rappresentazione':<18} {'byte/annuncio':>14} {'picco DataFrame MB':>19} {'DataFrame sec':>14}")
+    for n in args.annunci:
+        testi = record_analizzati(n)
+        for nome, accumula, converti in (
+            ("lista di dict", accumula_dict, pd.DataFrame),
+            ("BloccoAnnunci", accumula_compatto, BloccoAnnunci.dataframe),
+        ):
+            per_annuncio, picco, durata = misura(testi, accumula, converti)
+            print(f"{n:>8} {nome:<18} {per_annuncio:>14.0f} {picco:>19.1f} {durata:>14.3f}")
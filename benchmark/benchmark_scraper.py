@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark end-to-end offline degli scraper, contro il finto TrovaCasa di
+benchmark/mock_trovacasa.py.
+
+Esegue get_urls, get_annunci e scraping_completo, ognuno in un processo nuovo (così
+il picco di memoria è quello del singolo scenario), e riporta pagine/sec, annunci/sec,
+tempo di parsing per pagina e picco di RSS. Latenza ed errori del server, parser,
+processi di parsing, lavoratori e limiti di ritmo sono configurabili, per confrontare
+le impostazioni in modo riproducibile e accorgersi delle regressioni; con --json i
+risultati vengono salvati per il confronto tra versioni.
+
+I limiti di ritmo per host partono già al massimo (--rate, --concorrenza) così si misura
+lo scraper e non la rampa AIMD; con --rate 10 --concorrenza 16 si riproducono i limiti
+usati contro il sito vero.
+
+Uso: python benchmark/benchmark_scraper.py [--pagine 20] [--latenza-ms 30] [--errori 0.01] ...
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(CARTELLA))
+sys.path.insert(0, CARTELLA)
+
+from mock_trovacasa import avvia_mock, pagina_risultati
+
+SCENARI = ("get_urls", "get_annunci", "scraping_completo")
+
+
+def configura_scraper(url_base, opzioni):
+    """Importa scraper_completo nel processo dello scenario e lo punta al finto sito"""
+    import controllo_ritmo
+    import scraper_completo as sc
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # Il processo nasce con spawn, ma il pool di parsing deve ereditare gli URL modificati qui sotto
+    multiprocessing.set_start_method("fork", force=True)
+    sc.base_url = url_base
+    sc.start_url = url_base + "/case-in-vendita/milano"
+    sc.HTML_PARSER = opzioni["parser"]
+    sc.PARSER_WORKERS = opzioni["parser_workers"]
+    sc.DETAIL_WORKERS = opzioni["detail_workers"]
+    controllo_ritmo.RICHIESTE_AL_SECONDO_INIZIALI = controllo_ritmo.RICHIESTE_AL_SECONDO_MAX = opzioni["rate"]
+    controllo_ritmo.CONCORRENZA_INIZIALE = controllo_ritmo.CONCORRENZA_MAX = opzioni["concorrenza"]
+    return sc
+
+
+def esegui_scenario(scenario, url_base, opzioni, urls_annunci):
+    """Eseguito in un processo nuovo: ritorna durata, annunci ottenuti e picchi di RSS"""
+    sc = configura_scraper(url_base, opzioni)
+
+    async def get_annunci():
+        import pandas as pd
+        with sc.pool_parsing():
+            return await sc.get_annunci(pd.DataFrame({"url": urls_annunci}))
+
+    async def get_urls():
+        with sc.pool_parsing():
+            return await sc.get_urls(pagine_concorrenti=opzioni["pagine_concorrenti"])
+
+    coroutine = {
+        "get_urls": get_urls,
+        "get_annunci": get_annunci,
+        "scraping_completo": lambda: sc.scraping_completo(pagine_concorrenti=opzioni["pagine_concorrenti"]),
+    }[scenario]
+
+    inizio = time.perf_counter()
+    risultato = asyncio.run(coroutine())
+    durata = time.perf_counter() - inizio
+    # ru_maxrss è in KiB su Linux; i figli sono i processi del pool di parsing (già terminati)
+    return {
+        "durata": durata,
+        "annunci": len(risultato),
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_pool_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def _scenario_in_processo(uscita, *argomenti_scenario):
+    uscita.put(esegui_scenario(*argomenti_scenario))
+
+
+def tempi_parsing(server, parser, ripetizioni=50):
+    """Millisecondi di parsing per una pagina dei risultati e per un dettaglio, senza rete"""
+    import scraper_completo as sc
+
+    risultati_html = pagina_risultati(2, server.pagine, server.annunci_per_pagina)
+    dettagli_html = server.modelli
+
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        sc.analizza_pagina_risultati(risultati_html, parser)
+    t_risultati = (time.perf_counter() - inizio) / ripetizioni * 1000
+
+    inizio = time.perf_counter()
+    for _ in range(ripetizioni):
+        for html in dettagli_html:
+            sc.analizza_annuncio(html, "http://127.0.0.1/immobile/0-0", parser)
+    t_dettaglio = (time.perf_counter() - inizio) / (ripetizioni * len(dettagli_html)) * 1000
+    return t_risultati, t_dettaglio
+
+
+def argomenti():
+    p = argparse.ArgumentParser(description="Benchmark offline degli scraper TrovaCasa")
+    p.add_argument("--pagine", type=int, default=20, help="pagine dei risultati del finto sito")
+    p.add_argument("--annunci-per-pagina", type=int, default=25)
+    p.add_argument("--latenza-ms", type=float, default=20, help="latenza di ogni risposta del server")
+    p.add_argument("--errori", type=float, default=0.0, help="frazione di risposte 500")
+    p.add_argument("--rallentamenti", type=float, default=0.0, help="frazione di risposte 429 (Retry-After: 1)")
+    p.add_argument("--parser", default=os.getenv('HTML_PARSER', 'html.parser'), help="html.parser oppure lxml")
+    p.add_argument("--parser-workers", type=int, default=os.cpu_count() or 1, help="processi di parsing (0 = nel loop)")
+    p.add_argument("--detail-workers", type=int, default=16, help="lavoratori dell'estrazione dei dettagli")
+    p.add_argument("--pagine-concorrenti", type=int, default=4)
+    p.add_argument("--rate", type=float, default=1000.0, help="richieste al secondo per host")
+    p.add_argument("--concorrenza", type=int, default=32, help="richieste contemporanee per host")
+    p.add_argument("--scenari", nargs="+", choices=SCENARI, default=list(SCENARI))
+    p.add_argument("--json", help="salva i risultati in questo file")
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = argomenti()
+    opzioni = {
+        "parser": args.parser, "parser_workers": args.parser_workers, "detail_workers": args.detail_workers,
+        "pagine_concorrenti": args.pagine_concorrenti, "rate": args.rate, "concorrenza": args.concorrenza,
+    }
+    server = avvia_mock(
+        pagine=args.pagine, annunci_per_pagina=args.annunci_per_pagina, latenza_ms=args.latenza_ms,
+        errori=args.errori, rallentamenti=args.rallentamenti,
+    )
+    urls_annunci = [f"{server.url}/immobile/{n}-{i}" for n in range(1, args.pagine + 1) for i in range(args.annunci_per_pagina)]
+
+    t_risultati, t_dettaglio = tempi_parsing(server, args.parser)
+    print(f"Finto sito: {args.pagine} pagine x {args.annunci_per_pagina} annunci, latenza {args.latenza_ms} ms, "
+          f"errori {args.errori:.1%}, 429 {args.rallentamenti:.1%}")
+    print(f"Impostazioni: {json.dumps(opzioni)}")
+    print(f"Parsing ({args.parser}): {t_risultati:.2f} ms per pagina dei risultati, {t_dettaglio:.2f} ms per dettaglio\n")
+    print(f"{'scenario':<18} {'sec':>7} {'pagine':>7} {'pagine/s':>9} {'annunci':>8} {'annunci/s':>10} "
+          f"{'errori':>7} {'RSS MB':>7} {'pool MB':>8}")
+
+    # spawn: ogni scenario parte da un processo pulito, senza il thread del server
+    contesto = multiprocessing.get_context("spawn")
+    misure = {"parametri": vars(args), "parsing_ms": {"risultati": t_risultati, "dettaglio": t_dettaglio}, "scenari": {}}
+    for scenario in args.scenari:
+        server.richieste.clear()
+        # Processo non demone: deve poter avviare il suo pool di parsing
+        uscita = contesto.Queue()
+        processo = contesto.Process(target=_scenario_in_processo, args=(uscita, scenario, server.url, opzioni, urls_annunci))
+        processo.start()
+        misura = uscita.get()
+        processo.join()
+        richieste = dict(server.richieste)
+        pagine = richieste.get("risultati", 0) + richieste.get("dettaglio", 0)
+        errori = sum(v for k, v in richieste.items() if k.endswith(("_500", "_429")))
+        misura.update({"pagine": pagine, "errori": errori, "richieste": richieste})
+        misure["scenari"][scenario] = misura
+        print(f"{scenario:<18} {misura['durata']:>7.2f} {pagine:>7d} {pagine / misura['durata']:>9.1f} "
+              f"{misura['annunci']:>8d} {misura['annunci'] / misura['durata']:>10.1f} {errori:>7d} "
+              f"{misura['rss_mb']:>7.1f} {misura['rss_pool_mb']:>8.1f}")
+
+    server.ferma()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(misure, f, indent=2)
+        print(f"\nRisultati salvati in {args.json}")
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark offline dell'upload su GCS, contro il finto GCS di benchmark/fake_gcs.py.
+
+Confronta su uno snapshot sintetico:
+- upload precedente: CSV su disco, upload_from_filename, blob.patch() per i metadati
+- upload diretto dal DataFrame (gzip in streaming, metadati nella richiesta iniziale)
+- upload del file dello scrittore in streaming in parti parallele + compose
+e verifica che il contenuto su "GCS" coincida con il CSV atteso.
+
+Uso: python benchmark/benchmark_upload_gcs.py [annunci]
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(CARTELLA))
+sys.path.insert(0, CARTELLA)
+
+from fake_gcs import avvia_fake_gcs
+
+server = avvia_fake_gcs()
+os.environ["STORAGE_EMULATOR_HOST"] = server.url
+
+from google.cloud import storage  # noqa: E402  (dopo STORAGE_EMULATOR_HOST)
+import caricamento_gcs  # noqa: E402
+from caricamento_gcs import carica_annunci, carica_file  # noqa: E402
+
+
+def snapshot_sintetico(annunci):
+    return pd.DataFrame({
+        "_id": [f"TC{i:07d}" for i in range(annunci)],
+        "url": [f"https://www.trovacasa.it/immobile/{i}" for i in range(annunci)],
+        "prezzo": [f"€ {100 + i % 900}.000" for i in range(annunci)],
+        "titolo": [f"Trilocale in vendita numero {i}" for i in range(annunci)],
+        "indirizzo": [f"Via Roma {i % 300}, Milano" for i in range(annunci)],
+        "superficie_m2": [str(40 + i % 160) for i in range(annunci)],
+        "num_locali": [1 + i % 5 for i in range(annunci)],
+        "num_bagni": [1 + i % 3 for i in range(annunci)],
+        "classe_ener": ["ABCDEFG"[i % 7] for i in range(annunci)],
+        "tags": [["Balcone", "Ascensore"] if i % 2 else ["Box"] for i in range(annunci)],
+    })
+
+
+def upload_precedente(bucket, df, gcs_path, cartella):
+    filename = os.path.join(cartella, "snapshot.csv")
+    df.to_csv(filename, index=False, sep=';', encoding='utf-8')
+    blob = bucket.blob(gcs_path)
+    blob.upload_from_filename(filename)
+    blob.metadata = {'created_by': 'github-actions-scraper', 'upload_date': datetime.now().isoformat(), 'source': 'trovacasa.it'}
+    blob.patch()
+    os.remove(filename)
+
+
+def contenuto(gcs_path):
+    oggetto = server.oggetti[("bucket-test", gcs_path)]
+    dati = oggetto["dati"]
+    if oggetto["risorsa"].get("contentEncoding") == "gzip":
+        dati = gzip.decompress(dati)
+    return dati, oggetto
+
+
+def misura(nome, funzione, gcs_path, atteso):
+    server.richieste.clear()
+    inizio = time.perf_counter()
+    funzione()
+    durata = time.perf_counter() - inizio
+    dati, oggetto = contenuto(gcs_path)
+    richieste = dict(server.richieste)
+    print(
+        f"{nome:<38} {durata * 1000:8.1f} ms  {len(oggetto['dati']) / 1024:9.1f} KiB caricati  "
+        f"{sum(richieste.values()):3d} richieste {richieste}  "
+        f"metadati={'sì' if oggetto['risorsa'].get('metadata') else 'no'}  contenuto {'ok' if dati == atteso else 'DIVERSO'}"
+    )
+
+
+if __name__ == "__main__":
+    annunci = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bucket = storage.Client().bucket("bucket-test")
+    df = snapshot_sintetico(annunci)
+    atteso = df.to_csv(index=False, sep=';').encode("utf-8")
+    print(f"Snapshot sintetico: {annunci} annunci, {len(atteso) / 1024 / 1024:.1f} MB di CSV\n")
+
+    with tempfile.TemporaryDirectory() as cartella:
+        misura("CSV su disco + upload + patch", lambda: upload_precedente(bucket, df, "precedente.csv", cartella), "precedente.csv", atteso)
+        misura("stream gzip dal DataFrame", lambda: carica_annunci(bucket, "stream.csv", "csv", df_result=df), "stream.csv", atteso)
+
+        # File dello scrittore in streaming: soglia abbassata per forzare le parti parallele
+        percorso = os.path.join(cartella, "in_corso.csv")
+        with open(percorso, "wb") as f:
+            f.write(atteso)
+        caricamento_gcs.SOGLIA_PARTI_MB = 1
+        misura("file in streaming, 8 parti + compose", lambda: carica_file(bucket, percorso, "parti.csv", "text/csv"), "parti.csv", atteso)
+    server.ferma()
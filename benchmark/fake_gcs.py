@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Finto Google Cloud Storage locale, per provare gli upload senza rete né credenziali.
+
+Implementa solo la parte dell'API JSON usata dagli scraper: upload multipart e
+resumable a blocchi, compose, patch dei metadati e delete. Gli oggetti restano in
+memoria e ogni richiesta viene contata, così si vede quanti round trip costa un upload.
+La libreria google-cloud-storage lo usa al posto di GCS con STORAGE_EMULATOR_HOST:
+
+    server = avvia_fake_gcs()
+    os.environ["STORAGE_EMULATOR_HOST"] = server.url
+"""
+
+import json
+import re
+import sys
+import threading
+import uuid
+from collections import Counter
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+
+class _Gestore(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    def _corpo(self):
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _rispondi(self, status, risorsa=None, intestazioni=None):
+        corpo = json.dumps(risorsa).encode() if risorsa is not None else b""
+        self.send_response(status)
+        for nome, valore in (intestazioni or {}).items():
+            self.send_header(nome, valore)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def _conta(self, tipo):
+        with self.fake.lock:
+            self.fake.richieste[tipo] += 1
+
+    def do_POST(self):
+        parti = urlsplit(self.path)
+        query = parse_qs(parti.query)
+        corpo = self._corpo()
+
+        composizione = re.fullmatch(r"/storage/v1/b/([^/]+)/o/(.+)/compose", parti.path)
+        if composizione:
+            self._conta("compose")
+            bucket, nome = composizione.group(1), unquote(composizione.group(2))
+            richiesta = json.loads(corpo)
+            dati = b"".join(self.fake.oggetti[(bucket, s["name"])]["dati"] for s in richiesta["sourceObjects"])
+            destinazione = richiesta.get("destination", {})
+            return self._rispondi(200, self.fake.salva(bucket, nome, dati, destinazione))
+
+        caricamento = re.fullmatch(r"/upload/storage/v1/b/([^/]+)/o", parti.path)
+        if caricamento and query.get("uploadType") == ["resumable"]:
+            self._conta("resumable_init")
+            risorsa = json.loads(corpo or b"{}")
+            sessione = uuid.uuid4().hex
+            with self.fake.lock:
+                self.fake.sessioni[sessione] = {"bucket": caricamento.group(1), "risorsa": risorsa, "dati": bytearray()}
+            posizione = f"{self.fake.url}/upload/storage/v1/b/{caricamento.group(1)}/o?uploadType=resumable&upload_id={sessione}"
+            return self._rispondi(200, {}, {"Location": posizione})
+
+        if caricamento and query.get("uploadType") == ["multipart"]:
+            self._conta("multipart")
+            messaggio = BytesParser().parsebytes(
+                b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + corpo
+            )
+            metadati, media = [parte.get_payload(decode=True) for parte in messaggio.get_payload()]
+            risorsa = json.loads(metadati)
+            return self._rispondi(200, self.fake.salva(caricamento.group(1), risorsa["name"], media, risorsa))
+
+        self._rispondi(404, {"error": parti.path})
+
+    def do_PUT(self):
+        query = parse_qs(urlsplit(self.path).query)
+        sessione = self.fake.sessioni[query["upload_id"][0]]
+        corpo = self._corpo()
+        self._conta("resumable_chunk")
+        sessione["dati"] += corpo
+
+        # "bytes 0-1023/*" = altri blocchi in arrivo, "bytes 0-1023/1024" o "bytes */1024" = ultimo
+        totale = self.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+        if totale == "*":
+            return self._rispondi(308, None, {"Range": f"bytes=0-{len(sessione['dati']) - 1}"})
+        risorsa = self.fake.salva(sessione["bucket"], sessione["risorsa"]["name"], bytes(sessione["dati"]), sessione["risorsa"])
+        self._rispondi(200, risorsa)
+
+    def do_PATCH(self):
+        self._conta("patch")
+        oggetto = re.fullmatch(r"/storage/v1/b/([^/]+)/o/(.+)", urlsplit(self.path).path)
+        chiave = (oggetto.group(1), unquote(oggetto.group(2)))
+        modifiche = json.loads(self._corpo())
+        with self.fake.lock:
+            self.fake.oggetti[chiave]["risorsa"].update(modifiche)
+        self._rispondi(200, self.fake.oggetti[chiave]["risorsa"])
+
+    def do_DELETE(self):
+        self._conta("delete")
+        oggetto = re.fullmatch(r"/storage/v1/b/([^/]+)/o/(.+)", urlsplit(self.path).path)
+        with self.fake.lock:
+            self.fake.oggetti.pop((oggetto.group(1), unquote(oggetto.group(2))), None)
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class FakeGcs:
+    def __init__(self, porta=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", porta), _Gestore)
+        self.server.fake = self
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.lock = threading.Lock()
+        self.oggetti = {}
+        self.sessioni = {}
+        self.richieste = Counter()
+
+    def salva(self, bucket, nome, dati, risorsa):
+        risorsa = {k: v for k, v in risorsa.items() if k not in ("bucket", "size", "generation")}
+        risorsa.update({"kind": "storage#object", "bucket": bucket, "name": nome, "size": str(len(dati)), "generation": "1"})
+        with self.lock:
+            self.oggetti[(bucket, nome)] = {"dati": dati, "risorsa": risorsa}
+        return risorsa
+
+    def avvia(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def ferma(self):
+        self.server.shutdown()
+
+
+def avvia_fake_gcs(porta=0):
+    return FakeGcs(porta).avvia()
+
+
+if __name__ == "__main__":
+    server = FakeGcs(int(sys.argv[1]) if len(sys.argv) > 1 else 4443)
+    print(f"Finto GCS su {server.url} (STORAGE_EMULATOR_HOST={server.url})")
+    server.server.serve_forever()
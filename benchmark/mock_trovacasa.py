@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Finto TrovaCasa locale, per misurare gli scraper senza toccare trovacasa.it.
+
+Serve pagine dei risultati sintetiche (link a.card__title.js_link_immobile, pager con
+link numerati e a.pager__link.next) e pagine di dettaglio ricavate dalle fixture di
+benchmark/fixtures (dl.row, .price, .immobileDetails__tagLabel) con un codice annuncio
+diverso per ogni annuncio. Latenza, frazione di errori 5xx / 429 e numero di pagine
+sono configurabili; ogni risposta viene contata per tipo.
+
+    server = avvia_mock(pagine=50, latenza_ms=40, errori=0.01)
+    scraper_completo.base_url = server.url  # e start_url = server.url_ricerca
+
+Uso da riga di comando: python benchmark/mock_trovacasa.py [porta]
+"""
+
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+CARTELLA_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+PERCORSO_RICERCA = "/case-in-vendita/milano"
+CODICE_ANNUNCIO = re.compile(r'(Codice annuncio</dt>\s*<dd class="description[^"]*">)([^<]*)(</dd>)')
+
+
+def _modelli_dettaglio():
+    modelli = []
+    for nome in sorted(os.listdir(CARTELLA_FIXTURES)):
+        if nome.startswith("dettaglio_"):
+            with open(os.path.join(CARTELLA_FIXTURES, nome), encoding="utf-8") as f:
+                modelli.append(f.read())
+    return modelli
+
+
+def pagina_risultati(numero, pagine, annunci_per_pagina):
+    schede = []
+    for i in range(annunci_per_pagina):
+        codice = f"{numero}-{i}"
+        schede.append(
+            f'<div class="card"><div class="card__image"><img src="/img/{codice}.jpg" alt="Foto {codice}"></div>'
+            f'<div class="card__body"><a class="card__title js_link_immobile" href="/immobile/{codice}">'
+            f'Trilocale in vendita, annuncio {codice}</a>'
+            f'<div class="card__price">€ {150 + (numero * 7 + i) % 600}.000</div>'
+            f'<p class="card__address">Milano, via Esempio {numero * 10 + i}</p>'
+            f'<ul class="card__features"><li>{2 + i % 4} locali</li><li>{45 + i * 3} m²</li><li>{1 + i % 2} bagni</li></ul>'
+            f'<p class="card__description">Appartamento luminoso in zona servita, ottime condizioni, numero {codice}.</p>'
+            f'</div></div>'
+        )
+    # Pager come sul sito: prime pagine, ultima pagina e pulsante "next"
+    numeri = sorted(n for n in {1, 2, 3, max(1, numero - 1), numero, min(pagine, numero + 1), pagine} if n <= pagine)
+    pager = "".join(f'<a class="pager__link" href="{PERCORSO_RICERCA}?page={n}">{n}</a>' for n in numeri)
+    if numero < pagine:
+        pager += f'<a class="pager__link next" href="{PERCORSO_RICERCA}?page={numero + 1}">&gt;</a>'
+    return (
+        "<!DOCTYPE html><html><head><title>Case in vendita a Milano</title></head><body>"
+        f"<main><section class=\"results\">{''.join(schede)}</section><nav class=\"pager\">{pager}</nav></main>"
+        "</body></html>"
+    )
+
+
+class MockTrovaCasa:
+    def __init__(self, pagine=20, annunci_per_pagina=25, latenza_ms=0, errori=0.0, rallentamenti=0.0, porta=0, seme=0):
+        self.pagine = pagine
+        self.annunci_per_pagina = annunci_per_pagina
+        self.latenza = latenza_ms / 1000
+        self.errori = errori
+        self.rallentamenti = rallentamenti
+        self.porta = porta
+        self.casuale = random.Random(seme)
+        self.modelli = _modelli_dettaglio()
+        self.richieste = Counter()
+        self.pronto = threading.Event()
+        self.loop = None
+        self.runner = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.porta}"
+
+    @property
+    def url_ricerca(self):
+        return self.url + PERCORSO_RICERCA
+
+    @property
+    def annunci(self):
+        return self.pagine * self.annunci_per_pagina
+
+    async def _rispondi(self, tipo, testo):
+        if self.latenza:
+            await asyncio.sleep(self.latenza)
+        sorteggio = self.casuale.random()
+        if sorteggio < self.errori:
+            self.richieste[f"{tipo}_500"] += 1
+            return web.Response(status=500)
+        if sorteggio < self.errori + self.rallentamenti:
+            self.richieste[f"{tipo}_429"] += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        self.richieste[tipo] += 1
+        return web.Response(text=testo, content_type="text/html")
+
+    async def risultati(self, request):
+        numero = int(request.query.get("page", 1))
+        if not 1 <= numero <= self.pagine:
+            return web.Response(status=404)
+        return await self._rispondi("risultati", pagina_risultati(numero, self.pagine, self.annunci_per_pagina))
+
+    async def dettaglio(self, request):
+        codice = request.match_info["codice"]
+        modello = self.modelli[zlib.crc32(codice.encode()) % len(self.modelli)]
+        html = CODICE_ANNUNCIO.sub(lambda m: f"{m.group(1)}TC-{codice}{m.group(3)}", modello, count=1)
+        return await self._rispondi("dettaglio", html)
+
+    def applicazione(self):
+        app = web.Application()
+        app.router.add_get(PERCORSO_RICERCA, self.risultati)
+        app.router.add_get("/immobile/{codice}", self.dettaglio)
+        return app
+
+    async def _avvia(self):
+        self.runner = web.AppRunner(self.applicazione(), access_log=None)
+        await self.runner.setup()
+        sito = web.TCPSite(self.runner, "127.0.0.1", self.porta)
+        await sito.start()
+        self.porta = sito._server.sockets[0].getsockname()[1]
+
+    def _esegui(self):
+        self.loop = asyncio.new_event_loop()
+        self.loop.run_until_complete(self._avvia())
+        self.pronto.set()
+        self.loop.run_forever()
+
+    def avvia(self):
+        """Avvia il server in un thread con il suo loop, lasciando libero quello dello scraper"""
+        threading.Thread(target=self._esegui, daemon=True).start()
+        self.pronto.wait()
+        return self
+
+    def ferma(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def avvia_mock(**parametri):
+    return MockTrovaCasa(**parametri).avvia()
+
+
+if __name__ == "__main__":
+    server = MockTrovaCasa(porta=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    web.run_app(server.applicazione(), host="127.0.0.1", port=server.porta)
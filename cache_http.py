@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Cache HTTP su disco condivisa dagli scraper
+
+- corpi delle risposte salvati per contenuto (sha256, compressi gzip): URL con lo
+  stesso HTML condividono lo stesso file
+- indice SQLite con ETag / Last-Modified per la rivalidazione condizionale
+  (If-None-Match / If-Modified-Since)
+- risultati del parsing memorizzati per contenuto: una copia fresca o confermata
+  da un 304 non viene né riscaricata né rianalizzata
+- dimensione massima con eliminazione delle voci usate meno di recente (LRU); la
+  dimensione è contata nell'indice, quindi la cartella può essere condivisa da più
+  processi (vedi crawl_partizionato.py)
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "cache_http"
+CACHE_MAX_MB = 500
+CACHE_TTL = 3600  # Secondi in cui una risposta è considerata fresca senza rivalidarla
+GRAZIA_ELIMINAZIONE = 600  # Secondi prima di cancellare il file di un corpo eliminato dalla LRU
+
+
+class CacheHttp:
+    """Cache delle risposte HTTP su disco con rivalidazione ETag / Last-Modified"""
+
+    def __init__(self, cartella=CACHE_DIR, max_mb=CACHE_MAX_MB, ttl=CACHE_TTL):
+        self.cartella = cartella
+        self.max_byte = max_mb * 1024 * 1024
+        self.ttl = ttl
+        self.statistiche = {"hit": 0, "rivalidati": 0, "miss": 0, "eliminati": 0}
+
+        os.makedirs(os.path.join(cartella, "corpi"), exist_ok=True)
+        # Più processi possono usare la stessa cartella: si attende il lock invece di fallire
+        self.conn = sqlite3.connect(os.path.join(cartella, "indice.sqlite"), timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS risposte (
+                url TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                salvato_il REAL NOT NULL,
+                ultimo_accesso REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_risposte_accesso ON risposte(ultimo_accesso);
+            CREATE TABLE IF NOT EXISTS corpi (
+                hash TEXT PRIMARY KEY,
+                dimensione INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS analisi (
+                chiave TEXT PRIMARY KEY,
+                hash TEXT NOT NULL,
+                risultato TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_analisi_hash ON analisi(hash);
+            CREATE TABLE IF NOT EXISTS totale (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                dimensione INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS da_cancellare (
+                hash TEXT PRIMARY KEY,
+                eliminato_il REAL NOT NULL
+            );
+        """)
+        # Cache create prima del conteggio nell'indice: si parte dalla somma dei corpi
+        self.conn.execute("INSERT OR IGNORE INTO totale (id, dimensione) SELECT 0, COALESCE(SUM(dimensione), 0) FROM corpi")
+        self.conn.commit()
+
+    @property
+    def dimensione_totale(self):
+        """Byte dei corpi in cache, comuni a tutti i processi che usano la cartella"""
+        return self.conn.execute("SELECT dimensione FROM totale").fetchone()[0]
+
+    def _percorso(self, hash_corpo):
+        return os.path.join(self.cartella, "corpi", hash_corpo[:2], hash_corpo + ".html.gz")
+
+    def cerca(self, url):
+        """
+        Ritorna (voce, fresca): voce è un dict con hash, etag e last_modified oppure None
+        se l'URL non è in cache; fresca indica che si può usare senza rivalidarla
+        """
+        riga = self.conn.execute(
+            "SELECT hash, etag, last_modified, salvato_il FROM risposte WHERE url = ?", (url,)
+        ).fetchone()
+        if riga is None or not os.path.exists(self._percorso(riga[0])):
+            return None, False
+        voce = {"hash": riga[0], "etag": riga[1], "last_modified": riga[2]}
+        return voce, time.time() - riga[3] < self.ttl
+
+    def intestazioni_condizionali(self, voce):
+        """Intestazioni per la richiesta condizionale di una voce già in cache"""
+        condizionali = {}
+        if voce and voce["etag"]:
+            condizionali["If-None-Match"] = voce["etag"]
+        if voce and voce["last_modified"]:
+            condizionali["If-Modified-Since"] = voce["last_modified"]
+        return condizionali
+
+    def leggi(self, voce):
+        with gzip.open(self._percorso(voce["hash"]), "rt", encoding="utf-8") as f:
+            return f.read()
+
+    def usa(self, url, voce, rivalidata=False):
+        """Registra l'uso di una voce: hit se fresca, rivalidata se confermata da un 304"""
+        adesso = time.time()
+        if rivalidata:
+            self.statistiche["rivalidati"] += 1
+            self.conn.execute("UPDATE risposte SET salvato_il = ?, ultimo_accesso = ? WHERE url = ?", (adesso, adesso, url))
+        else:
+            self.statistiche["hit"] += 1
+            self.conn.execute("UPDATE risposte SET ultimo_accesso = ? WHERE url = ?", (adesso, url))
+        self.conn.commit()
+
+    def salva(self, url, html, etag=None, last_modified=None):
+        """Salva una risposta 200 appena scaricata e ritorna l'hash del contenuto"""
+        self.statistiche["miss"] += 1
+        corpo = html.encode("utf-8")
+        hash_corpo = hashlib.sha256(corpo).hexdigest()
+        percorso = self._percorso(hash_corpo)
+        if not os.path.exists(percorso):
+            os.makedirs(os.path.dirname(percorso), exist_ok=True)
+            # Scrittura atomica: un file a metà non deve mai essere letto come valido
+            # (il .tmp è per processo: un altro può scrivere lo stesso corpo insieme)
+            provvisorio = f"{percorso}.{os.getpid()}.tmp"
+            with open(provvisorio, "wb") as f:
+                f.write(gzip.compress(corpo))
+            os.replace(provvisorio, percorso)
+
+        # Il corpo si conta una volta sola, anche se più processi lo salvano insieme; un
+        # file eliminato dalla LRU ma non ancora cancellato torna valido
+        if self.conn.execute(
+            "INSERT OR IGNORE INTO corpi (hash, dimensione) VALUES (?, ?)", (hash_corpo, os.path.getsize(percorso))
+        ).rowcount:
+            self.conn.execute("UPDATE totale SET dimensione = dimensione + (SELECT dimensione FROM corpi WHERE hash = ?)", (hash_corpo,))
+            self.conn.execute("DELETE FROM da_cancellare WHERE hash = ?", (hash_corpo,))
+
+        adesso = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO risposte (url, hash, etag, last_modified, salvato_il, ultimo_accesso) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (url, hash_corpo, etag, last_modified, adesso, adesso),
+        )
+        self.conn.commit()
+
+        if self.dimensione_totale > self.max_byte:
+            self._elimina_lru()
+        return hash_corpo
+
+    def risultato_analisi(self, chiave):
+        riga = self.conn.execute("SELECT risultato FROM analisi WHERE chiave = ?", (chiave,)).fetchone()
+        return json.loads(riga[0]) if riga else None
+
+    def salva_analisi(self, chiave, hash_corpo, risultato):
+        # Se il corpo è già stato eliminato dalla LRU il risultato non serve più
+        self.conn.execute(
+            "INSERT OR REPLACE INTO analisi (chiave, hash, risultato) "
+            "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM corpi WHERE hash = ?)",
+            (chiave, hash_corpo, json.dumps(risultato, ensure_ascii=False), hash_corpo),
+        )
+        self.conn.commit()
+
+    def _elimina_lru(self):
+        """
+        Elimina le voci usate meno di recente finché la cache torna sotto il 90% del limite.
+        Con la cartella condivisa l'eliminazione avviene in una transazione esclusiva sul
+        conteggio dell'indice (un solo processo alla volta, e solo se la cache è ancora
+        oltre il limite). I file dei corpi eliminati si cancellano dopo GRAZIA_ELIMINAZIONE
+        secondi: un altro processo può averli appena trovati nell'indice e stare per leggerli.
+        """
+        obiettivo = self.max_byte * 0.9
+        adesso = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        dimensione = self.dimensione_totale
+        if dimensione > self.max_byte:
+            for url, hash_corpo in self.conn.execute(
+                "SELECT url, hash FROM risposte ORDER BY ultimo_accesso"
+            ).fetchall():
+                if dimensione <= obiettivo:
+                    break
+                self.conn.execute("DELETE FROM risposte WHERE url = ?", (url,))
+                self.statistiche["eliminati"] += 1
+                # Il corpo si elimina solo se nessun altro URL lo usa
+                if self.conn.execute("SELECT 1 FROM risposte WHERE hash = ?", (hash_corpo,)).fetchone():
+                    continue
+                riga = self.conn.execute("SELECT dimensione FROM corpi WHERE hash = ?", (hash_corpo,)).fetchone()
+                self.conn.execute("DELETE FROM corpi WHERE hash = ?", (hash_corpo,))
+                self.conn.execute("DELETE FROM analisi WHERE hash = ?", (hash_corpo,))
+                self.conn.execute("INSERT OR REPLACE INTO da_cancellare (hash, eliminato_il) VALUES (?, ?)", (hash_corpo, adesso))
+                if riga:
+                    dimensione -= riga[0]
+            self.conn.execute("UPDATE totale SET dimensione = ?", (dimensione,))
+
+        scaduti = [riga[0] for riga in self.conn.execute(
+            "SELECT hash FROM da_cancellare WHERE eliminato_il < ? AND hash NOT IN (SELECT hash FROM corpi)",
+            (adesso - GRAZIA_ELIMINAZIONE,),
+        )]
+        self.conn.executemany("DELETE FROM da_cancellare WHERE hash = ?", [(hash_corpo,) for hash_corpo in scaduti])
+        self.conn.commit()
+        for hash_corpo in scaduti:
+            try:
+                os.remove(self._percorso(hash_corpo))
+            except FileNotFoundError:
+                pass
+
+    def log_statistiche(self):
+        s = self.statistiche
+        richieste = s["hit"] + s["rivalidati"] + s["miss"]
+        percentuale = round(100 * (s["hit"] + s["rivalidati"]) / richieste, 1) if richieste else 0
+        logger.info(f"   - Cache HTTP: {s['hit']} hit, {s['rivalidati']} rivalidati (304), {s['miss']} miss ({percentuale}% evitati)")
+        logger.info(f"   - Cache HTTP: {round(self.dimensione_totale / 1024 / 1024, 1)} MB su disco, {s['eliminati']} voci eliminate")
+
+    def chiudi(self):
+        self.conn.close()
+
+
+def cache_da_env():
+    """Crea la cache dalle variabili d'ambiente HTTP_CACHE_DIR / HTTP_CACHE_MB / HTTP_CACHE_TTL (vuoto = disattivata)"""
+    cartella = os.getenv('HTTP_CACHE_DIR', '')
+    if not cartella:
+        return None
+    cache = CacheHttp(
+        cartella,
+        max_mb=int(os.getenv('HTTP_CACHE_MB', str(CACHE_MAX_MB))),
+        ttl=int(os.getenv('HTTP_CACHE_TTL', str(CACHE_TTL))),
+    )
+    logger.info(f"🗄️ Cache HTTP attiva in {cartella} ({round(cache.dimensione_totale / 1024 / 1024, 1)} MB)")
+    return cache
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Upload degli annunci su Google Cloud Storage senza file temporanei
+
+- i dati vanno direttamente in un upload resumable a blocchi (BlobWriter): niente CSV
+  scritto su disco solo per essere caricato e poi cancellato
+- i metadati viaggiano nella richiesta iniziale dell'upload, senza un blob.patch() dopo
+- CSV/JSONL vengono compressi gzip al volo (Content-Encoding: gzip, GCS li decomprime
+  in download); Parquet/Arrow sono già compressi internamente
+- i file grandi vengono caricati in parti parallele riunite alla fine con compose, anche
+  quando l'output dello scrittore in streaming viene normalizzato al volo
+"""
+
+import gzip
+import io
+import logging
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+
+from output_streaming import RIGHE_PER_BLOCCO, scrivi_blocchi
+
+logger = logging.getLogger(__name__)
+
+DIMENSIONE_BLOCCO = 8 * 1024 * 1024  # Blocchi dell'upload resumable (multipli di 256 KiB)
+SOGLIA_PARTI_MB = 64  # Oltre questa dimensione il file viene caricato in parti parallele
+PARTI_PARALLELE = 8  # compose accetta al massimo 32 oggetti sorgente
+TIPI_CONTENUTO = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+
+def metadati_upload():
+    return {
+        'created_by': 'github-actions-scraper',
+        'upload_date': datetime.now().isoformat(),
+        'source': 'trovacasa.it'
+    }
+
+
+def nuovo_blob(bucket, gcs_path, content_type, comprimi=False):
+    """Blob con metadati, tipo e codifica già impostati: partono con la prima richiesta"""
+    blob = bucket.blob(gcs_path, chunk_size=DIMENSIONE_BLOCCO)
+    blob.metadata = metadati_upload()
+    blob.content_type = content_type
+    if comprimi:
+        blob.content_encoding = "gzip"
+    return blob
+
+
+@contextmanager
+def scrittura_gcs(bucket, gcs_path, content_type, comprimi=False):
+    """File binario in scrittura il cui contenuto va direttamente nell'upload resumable"""
+    blob = nuovo_blob(bucket, gcs_path, content_type, comprimi)
+    with blob.open("wb", ignore_flush=True) as writer:
+        if comprimi:
+            with gzip.GzipFile(fileobj=writer, mode="wb", compresslevel=6) as compresso:
+                yield compresso
+        else:
+            yield writer
+
+
+def _carica_intervallo(bucket, percorso, gcs_path, content_type, comprimi, inizio, fine):
+    with open(percorso, "rb") as f, scrittura_gcs(bucket, gcs_path, content_type, comprimi) as destinazione:
+        f.seek(inizio)
+        rimanenti = fine - inizio
+        while rimanenti > 0:
+            blocco = f.read(min(DIMENSIONE_BLOCCO, rimanenti))
+            if not blocco:
+                break
+            destinazione.write(blocco)
+            rimanenti -= len(blocco)
+    return bucket.blob(gcs_path)
+
+
+def carica_file(bucket, percorso, gcs_path, content_type, comprimi=True, parti=PARTI_PARALLELE):
+    """
+    Carica un file locale (es. l'output in corso dello scrittore in streaming). Sopra
+    SOGLIA_PARTI_MB lo divide in parti caricate in parallelo e riunite con compose:
+    i byte concatenati ricompongono il file, e più membri gzip formano un gzip valido.
+    """
+    dimensione = os.path.getsize(percorso)
+    if dimensione <= SOGLIA_PARTI_MB * 1024 * 1024 or parti <= 1:
+        _carica_intervallo(bucket, percorso, gcs_path, content_type, comprimi, 0, dimensione)
+        return f"gs://{bucket.name}/{gcs_path}"
+
+    parti = min(parti, 32)
+    passo = -(-dimensione // parti)
+    intervalli = [(i, i * passo, min(dimensione, (i + 1) * passo)) for i in range(parti)]
+    logger.info(f"☁️ Upload di {round(dimensione / 1024 / 1024, 1)} MB in {parti} parti parallele")
+    with ThreadPoolExecutor(max_workers=parti) as executor:
+        sorgenti = list(executor.map(
+            lambda intervallo: _carica_intervallo(
+                bucket, percorso, f"{gcs_path}.parte-{intervallo[0]:02d}", content_type, comprimi, intervallo[1], intervallo[2]
+            ),
+            intervalli,
+        ))
+
+    # Il blob finale nasce dalla compose con i suoi metadati: nessuna richiesta in più
+    destinazione = nuovo_blob(bucket, gcs_path, content_type, comprimi)
+    destinazione.compose(sorgenti)
+    for sorgente in sorgenti:
+        sorgente.delete()
+    return f"gs://{bucket.name}/{gcs_path}"
+
+
+def _carica_parte(bucket, gcs_path, content_type, coda):
+    """Upload di una parte con i byte ricevuti da coda (None chiude la parte): la compressione avviene qui"""
+    with scrittura_gcs(bucket, gcs_path, content_type, comprimi=True) as destinazione:
+        while (dati := coda.get()) is not None:
+            destinazione.write(dati)
+    return bucket.blob(gcs_path)
+
+
+class _UscitaAParti(io.TextIOBase):
+    """
+    Testo scritto da scrivi_blocchi smistato nella parte corrente: ogni parte è un upload
+    in un suo thread, quindi normalizzazione, compressione e upload di parti diverse
+    procedono insieme
+    """
+
+    def __init__(self, executor, bucket, gcs_path, content_type):
+        self.executor = executor
+        self.bucket = bucket
+        self.gcs_path = gcs_path
+        self.content_type = content_type
+        self.parti = []  # (coda, future) in ordine
+        self.chiusa = True
+
+    def nuova_parte(self):
+        self.chiudi_parte()
+        coda = queue.Queue(maxsize=4)
+        parte = f"{self.gcs_path}.parte-{len(self.parti):02d}"
+        self.parti.append((coda, self.executor.submit(_carica_parte, self.bucket, parte, self.content_type, coda)))
+        self.chiusa = False
+
+    def chiudi_parte(self):
+        if not self.chiusa:
+            self._metti(None)
+            self.chiusa = True
+
+    def _metti(self, dati):
+        coda, futuro = self.parti[-1]
+        while True:
+            try:
+                coda.put(dati, timeout=1)
+                return
+            except queue.Full:
+                # Un upload fallito non svuota più la sua coda: si propaga l'errore
+                if futuro.done():
+                    futuro.result()
+
+    def writable(self):
+        return True
+
+    def write(self, testo):
+        self._metti(testo.encode("utf-8"))
+        return len(testo)
+
+
+def carica_blocchi_a_parti(bucket, gcs_path, content_type, scrittore, parti=PARTI_PARALLELE):
+    """
+    Carica l'output dello scrittore in streaming normalizzato a blocchi (vedi
+    ScrittoreAnnunci.blocchi) in parti parallele riunite con compose, senza file locali:
+    ogni parte è un membro gzip con un gruppo di blocchi consecutivi, l'intestazione CSV
+    sta solo nella prima
+    """
+    parti = min(parti, 32)
+    annunci = scrittore.statistiche["annunci"]
+    righe = max(1, min(RIGHE_PER_BLOCCO, -(-annunci // parti)))
+    blocchi = -(-annunci // righe)
+    blocchi_per_parte = -(-blocchi // parti)
+    logger.info(f"☁️ Upload in streaming di {annunci} annunci in {parti} parti parallele")
+
+    with ThreadPoolExecutor(max_workers=parti) as executor:
+        uscita = _UscitaAParti(executor, bucket, gcs_path, content_type)
+
+        def blocchi_divisi():
+            for numero, blocco in enumerate(scrittore.blocchi(righe)):
+                if numero % blocchi_per_parte == 0:
+                    uscita.nuova_parte()
+                yield blocco
+
+        try:
+            scrivi_blocchi(blocchi_divisi(), uscita, scrittore.formato)
+        finally:
+            uscita.chiudi_parte()
+        sorgenti = [futuro.result() for _, futuro in uscita.parti]
+
+    destinazione = nuovo_blob(bucket, gcs_path, content_type, comprimi=True)
+    destinazione.compose(sorgenti)
+    for sorgente in sorgenti:
+        sorgente.delete()
+    return f"gs://{bucket.name}/{gcs_path}"
+
+
+def carica_annunci(bucket, gcs_path, formato="csv", df_result=None, scrittore=None, compressione=None, data_scraping=None):
+    """
+    Carica gli annunci su gcs_path nel formato richiesto, dallo scrittore in streaming
+    (vedi output_streaming.py) oppure dal DataFrame in memoria. Ritorna l'URL gs://
+    """
+    content_type = TIPI_CONTENUTO.get(formato, "application/octet-stream")
+    colonnare = formato in ("parquet", "arrow")
+
+    if colonnare:
+        # Import qui: pyarrow serve solo per l'output colonnare
+        from output_colonnare import scrivi_colonnare, COMPRESSIONE
+        blocchi = scrittore.blocchi() if scrittore is not None else [df_result]
+        with scrittura_gcs(bucket, gcs_path, content_type) as destinazione:
+            scrivi_colonnare(blocchi, destinazione, formato, compressione or COMPRESSIONE, data_scraping)
+    elif scrittore is not None and os.path.getsize(scrittore.percorso) > SOGLIA_PARTI_MB * 1024 * 1024:
+        carica_blocchi_a_parti(bucket, gcs_path, content_type, scrittore)
+    else:
+        with scrittura_gcs(bucket, gcs_path, content_type, comprimi=True) as destinazione:
+            testo = io.TextIOWrapper(destinazione, encoding="utf-8", newline="")
+            if scrittore is not None:
+                # Blocchi normalizzati dell'output parziale scritti direttamente nell'upload
+                scrivi_blocchi(scrittore.blocchi(), testo, scrittore.formato)
+            else:
+                df_result.to_csv(testo, index=False, sep=';')
+            testo.flush()
+            testo.detach()
+
+    if scrittore is not None:
+        # Il contenuto è su GCS: i file parziali e il checkpoint non servono più
+        scrittore.rimuovi()
+    logger.info(f"✅ File caricato su GCS: gs://{bucket.name}/{gcs_path}")
+    return f"gs://{bucket.name}/{gcs_path}"
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Controllo adattivo del ritmo delle richieste, per host
+
+Sostituisce il semaforo fisso e le pause a tempo: ogni host ha
+- un token bucket che limita le richieste al secondo
+- un limite di richieste contemporanee gestito in AIMD (aumento additivo finché
+  latenza e status sono buoni, dimezzamento su 429/503/timeout)
+- il rispetto dell'intestazione Retry-After, che blocca l'host per il tempo indicato
+
+Con più processi sullo stesso host (vedi crawl_partizionato.py) si può aggiungere un
+token bucket condiviso, tenuto in un file sotto lock: limita le richieste al secondo di
+tutti i processi insieme e propaga a tutti il blocco di un 429/503.
+"""
+
+import asyncio
+import fcntl
+import logging
+import os
+import struct
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+CONCORRENZA_INIZIALE = 4
+CONCORRENZA_MIN = 1
+CONCORRENZA_MAX = 16
+RICHIESTE_AL_SECONDO_INIZIALI = 2.0
+RICHIESTE_AL_SECONDO_MIN = 0.2
+RICHIESTE_AL_SECONDO_MAX = 10.0
+PAUSA_SENZA_RETRY_AFTER = 30  # Secondi di blocco dopo un 429/503 senza Retry-After
+STATUS_RALLENTA = {429, 503}
+
+
+def secondi_retry_after(valore):
+    """Interpreta Retry-After, espresso in secondi o come data HTTP"""
+    if not valore:
+        return None
+    try:
+        return max(0.0, float(valore))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valore).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RitmoCondiviso:
+    """Token bucket di un host condiviso tra processi: lo stato sta in un file, letto e aggiornato sotto flock"""
+
+    FORMATO = struct.Struct("ddd")  # token, ultimo rifornimento, bloccato fino a (secondi di time.time)
+
+    def __init__(self, percorso, richieste_al_secondo):
+        self.percorso = percorso
+        self.rate = richieste_al_secondo
+        self.fd = os.open(percorso, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def _stato(self):
+        # Il lock dura una lettura e una scrittura di 24 byte: non blocca il loop in modo percettibile
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            dati = os.pread(self.fd, self.FORMATO.size, 0)
+            stato = list(self.FORMATO.unpack(dati)) if len(dati) == self.FORMATO.size else [1.0, time.time(), 0.0]
+            yield stato
+            os.pwrite(self.fd, self.FORMATO.pack(*stato), 0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _prendi(self):
+        """Prende un token: ritorna 0 se preso, altrimenti i secondi da attendere prima di riprovare"""
+        with self._stato() as stato:
+            token, ultimo, bloccato_fino = stato
+            adesso = time.time()
+            if bloccato_fino > adesso:
+                return bloccato_fino - adesso
+            token = min(max(self.rate, 1.0), token + (adesso - ultimo) * self.rate)
+            stato[1] = adesso
+            if token >= 1:
+                stato[0] = token - 1
+                return 0
+            stato[0] = token
+            return (1 - token) / self.rate
+
+    async def attendi(self):
+        while True:
+            attesa = self._prendi()
+            if attesa <= 0:
+                return
+            await asyncio.sleep(attesa)
+
+    def blocca(self, secondi):
+        with self._stato() as stato:
+            stato[2] = max(stato[2], time.time() + secondi)
+
+
+class ControlloreHost:
+    """Token bucket + concorrenza AIMD per un singolo host"""
+
+    def __init__(self, host, concorrenza=CONCORRENZA_INIZIALE, richieste_al_secondo=RICHIESTE_AL_SECONDO_INIZIALI,
+                 concorrenza_max=CONCORRENZA_MAX, richieste_al_secondo_max=RICHIESTE_AL_SECONDO_MAX, condiviso=None):
+        self.host = host
+        self.condiviso = condiviso
+        self.concorrenza_max = concorrenza_max
+        self.rate_max = richieste_al_secondo_max
+        self.limite = concorrenza
+        self.rate = richieste_al_secondo
+        self.token = 1.0
+        self.ultimo_rifornimento = time.monotonic()
+        self.bloccato_fino = 0.0
+        self.ultimo_rallentamento = 0.0
+        self.in_corso = 0
+        self.successi_finestra = 0
+        self.latenza_media = None
+        self.latenza_base = None
+        self.condizione = None
+        self.loop = None
+        self.statistiche = {"richieste": 0, "rallentamenti": 0, "concorrenza_max": concorrenza, "rate_max": richieste_al_secondo}
+
+    def _rifornisci(self):
+        adesso = time.monotonic()
+        # Il bucket contiene al massimo un secondo di richieste (raffica massima)
+        self.token = min(max(self.rate, 1.0), self.token + (adesso - self.ultimo_rifornimento) * self.rate)
+        self.ultimo_rifornimento = adesso
+
+    def _condizione(self):
+        # Ogni asyncio.run ha il suo loop: le primitive asyncio non si possono riusare tra loop diversi
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.condizione = asyncio.Condition()
+            self.in_corso = 0
+        return self.condizione
+
+    async def acquisisci(self):
+        """Attende un posto libero nella concorrenza e un token del bucket"""
+        async with self._condizione():
+            await self.condizione.wait_for(lambda: self.in_corso < self.limite)
+            self.in_corso += 1
+        try:
+            while True:
+                attesa = self.bloccato_fino - time.monotonic()
+                if attesa <= 0:
+                    self._rifornisci()
+                    if self.token >= 1:
+                        self.token -= 1
+                        break
+                    attesa = (1 - self.token) / self.rate
+                await asyncio.sleep(attesa)
+            if self.condiviso is not None:
+                await self.condiviso.attendi()
+        except BaseException:
+            await self._libera()
+            raise
+        self.statistiche["richieste"] += 1
+        return time.monotonic()
+
+    async def _libera(self):
+        async with self._condizione():
+            self.in_corso -= 1
+            self.condizione.notify_all()
+
+    async def rilascia(self, inizio, status=None, retry_after=None, timeout=False):
+        """Registra l'esito della richiesta e adatta concorrenza e ritmo"""
+        latenza = time.monotonic() - inizio
+        if timeout or status in STATUS_RALLENTA:
+            self._rallenta(status, retry_after, timeout)
+        elif status is not None and status < 500:
+            self._accelera(latenza)
+        await self._libera()
+
+    def _rallenta(self, status, retry_after, timeout):
+        # Le richieste già in volo falliscono insieme: si dimezza una sola volta per "giro"
+        adesso = time.monotonic()
+        if adesso - self.ultimo_rallentamento > (self.latenza_media or 1.0):
+            self.statistiche["rallentamenti"] += 1
+            self.limite = max(CONCORRENZA_MIN, self.limite // 2)
+            self.rate = max(RICHIESTE_AL_SECONDO_MIN, self.rate / 2)
+            self.ultimo_rallentamento = adesso
+        self.successi_finestra = 0
+        pausa = secondi_retry_after(retry_after)
+        if pausa is None and not timeout:
+            pausa = PAUSA_SENZA_RETRY_AFTER
+        if pausa:
+            self.bloccato_fino = max(self.bloccato_fino, adesso + pausa)
+            if self.condiviso is not None:
+                self.condiviso.blocca(pausa)
+        causa = "timeout" if timeout else f"HTTP {status}"
+        logger.warning(f"🐢 {self.host}: {causa}, concorrenza {self.limite}, {round(self.rate, 2)} req/s, pausa {round(pausa or 0)} sec")
+
+    def _accelera(self, latenza):
+        self.latenza_media = latenza if self.latenza_media is None else 0.8 * self.latenza_media + 0.2 * latenza
+        self.latenza_base = self.latenza_media if self.latenza_base is None else min(self.latenza_base, self.latenza_media)
+        # Latenza in crescita = il sito sta soffrendo: si mantiene il ritmo attuale
+        if self.latenza_media > 2 * self.latenza_base:
+            return
+
+        # Aumento additivo: +1 di concorrenza dopo una "finestra" intera di successi
+        self.successi_finestra += 1
+        if self.successi_finestra < self.limite:
+            return
+        self.successi_finestra = 0
+        self.limite = min(self.concorrenza_max, self.limite + 1)
+        self.rate = min(self.rate_max, self.rate + 0.5)
+        self.statistiche["concorrenza_max"] = max(self.statistiche["concorrenza_max"], self.limite)
+        self.statistiche["rate_max"] = max(self.statistiche["rate_max"], self.rate)
+
+    def richiesta(self):
+        """Context manager per una richiesta: async with controllore.richiesta() as esito"""
+        return _Richiesta(self)
+
+
+class _Richiesta:
+    def __init__(self, controllore):
+        self.controllore = controllore
+        self.status = None
+        self.retry_after = None
+
+    def esito(self, status, retry_after=None):
+        self.status = status
+        self.retry_after = retry_after
+
+    async def __aenter__(self):
+        self.inizio = await self.controllore.acquisisci()
+        return self
+
+    async def __aexit__(self, tipo_eccezione, eccezione, traceback):
+        timeout = tipo_eccezione is not None and issubclass(tipo_eccezione, asyncio.TimeoutError)
+        await self.controllore.rilascia(self.inizio, self.status, self.retry_after, timeout=timeout)
+        return False
+
+
+_controllori = {}
+_quota = 1.0
+_ritmo_condiviso = None  # (cartella dei file di stato, richieste al secondo per host di tutti i processi)
+
+
+def imposta_quota(quota):
+    """
+    Frazione dei limiti per host spettante a questo processo: con N shard che scaricano
+    dallo stesso host ognuno usa 1/N, così insieme rispettano gli stessi limiti
+    """
+    global _quota
+    _quota = quota
+
+
+def imposta_ritmo_condiviso(cartella, richieste_al_secondo=RICHIESTE_AL_SECONDO_MAX):
+    """
+    Limite di richieste al secondo per host comune a tutti i processi che usano la stessa
+    cartella; None la disattiva. Vale per i controllori creati da qui in poi
+    """
+    global _ritmo_condiviso
+    _ritmo_condiviso = (cartella, richieste_al_secondo) if cartella else None
+
+
+def concorrenza_massima():
+    """Richieste contemporanee massime per host di questo processo (quota compresa)"""
+    return max(CONCORRENZA_MIN, round(CONCORRENZA_MAX * _quota))
+
+
+def controllore_per(url):
+    """Ritorna il controllore dell'host dell'URL, condiviso da tutte le fasi del crawl"""
+    host = urlsplit(url).netloc
+    if host not in _controllori:
+        condiviso = None
+        if _ritmo_condiviso is not None:
+            cartella, richieste_al_secondo = _ritmo_condiviso
+            condiviso = RitmoCondiviso(os.path.join(cartella, f"ritmo_{host.replace(':', '_')}.bin"), richieste_al_secondo)
+        _controllori[host] = ControlloreHost(
+            host,
+            concorrenza=max(CONCORRENZA_MIN, round(CONCORRENZA_INIZIALE * _quota)),
+            richieste_al_secondo=max(RICHIESTE_AL_SECONDO_MIN, RICHIESTE_AL_SECONDO_INIZIALI * _quota),
+            concorrenza_max=concorrenza_massima(),
+            richieste_al_secondo_max=max(RICHIESTE_AL_SECONDO_MIN, RICHIESTE_AL_SECONDO_MAX * _quota),
+            condiviso=condiviso,
+        )
+    return _controllori[host]
+
+
+def log_statistiche_ritmo():
+    for host, controllore in _controllori.items():
+        s = controllore.statistiche
+        logger.info(
+            f"   - Ritmo {host}: {s['richieste']} richieste, {s['rallentamenti']} rallentamenti, "
+            f"concorrenza max {s['concorrenza_max']}, max {round(s['rate_max'], 2)} req/s"
+        )
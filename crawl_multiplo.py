@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Crawl multiplo in locale: un processo scraper_completo.py per shard, poi l'unione
+
+Ogni shard gira nella sua cartella (shard-0/, shard-1/, ...) così stato, checkpoint,
+cache e file dead-letter non si pestano i piedi tra processi; le ricerche del manifest
+sono divise a turno sui nomi ordinati (manifest_crawl.py) e ogni processo usa 1/SHARD_COUNT dei
+limiti di ritmo per host. Alla fine gli snapshot degli shard vengono uniti e deduplicati
+per url (unisci_shard.py) e i file dead-letter riuniti in annunci_falliti.jsonl. Su
+GitHub Actions lo stesso schema si ottiene con una matrix di job che impostano
+SHARD_INDEX / SHARD_COUNT.
+
+Uso: SHARD_COUNT=4 CRAWL_MANIFEST=ricerche.json python crawl_multiplo.py
+"""
+
+import logging
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+from manifest_crawl import MANIFEST
+from tentativi import FILE_FALLITI, unisci_falliti
+from unisci_shard import unisci_snapshot
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CARTELLA = os.path.dirname(os.path.abspath(__file__))
+
+
+def avvia_shard(indice, totale, manifest):
+    cartella = os.path.abspath(f"shard-{indice}")
+    os.makedirs(cartella, exist_ok=True)
+    # Il dead-letter di un'esecuzione precedente non va riunito con quelli nuovi
+    if os.path.exists(os.path.join(cartella, FILE_FALLITI)):
+        os.remove(os.path.join(cartella, FILE_FALLITI))
+    env = dict(os.environ, CRAWL_MANIFEST=manifest, SHARD_INDEX=str(indice), SHARD_COUNT=str(totale))
+    processo = subprocess.Popen([sys.executable, os.path.join(CARTELLA, "scraper_completo.py")], cwd=cartella, env=env)
+    return cartella, processo
+
+
+def snapshot_dello_shard(cartella):
+    """Percorso del file scritto dallo shard (riportato in csv_filename.txt), None se manca"""
+    try:
+        with open(os.path.join(cartella, "csv_filename.txt")) as f:
+            return os.path.join(cartella, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    totale = int(os.getenv('SHARD_COUNT', '2'))
+    manifest = os.path.abspath(os.getenv('CRAWL_MANIFEST') or MANIFEST)
+    formato = os.getenv('OUTPUT_FORMAT', 'csv').lower()
+
+    logger.info(f"🚀 Crawl multiplo: {totale} shard, manifest {manifest}")
+    shard = [avvia_shard(i, totale, manifest) for i in range(totale)]
+
+    percorsi = []
+    for indice, (cartella, processo) in enumerate(shard):
+        codice = processo.wait()
+        percorso = snapshot_dello_shard(cartella)
+        if codice != 0 or percorso is None:
+            logger.error(f"❌ Shard {indice} terminato con codice {codice}: escluso dall'unione")
+            continue
+        percorsi.append(percorso)
+    unisci_falliti([cartella for cartella, _ in shard])
+
+    if not percorsi:
+        logger.error("❌ Nessuno shard completato")
+        sys.exit(1)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    provvisorio = f"trovacasa_{timestamp}_unione.{formato}"
+    annunci = unisci_snapshot(percorsi, provvisorio)
+    filename = f"trovacasa_{timestamp}_{annunci}_annunci_completi.{formato}"
+    os.replace(provvisorio, filename)
+    with open('csv_filename.txt', 'w') as f:
+        f.write(filename)
+    logger.info(f"💾 Snapshot unito: {filename} ({len(percorsi)}/{totale} shard)")
+    if len(percorsi) < totale:
+        sys.exit(1)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Un solo crawl diviso su più processi: raccolta degli URL, estrazione in parallelo, unione
+
+crawl_multiplo.py divide le ricerche del manifest; qui invece si divide una ricerca
+sola. La frontiera raccolta da get_urls viene partizionata per hash dell'URL tra
+CRAWL_WORKERS processi (predefinito: un processo per core), ognuno con il suo loop
+get_annunci, il suo parsing e il suo file di output nella cartella partizione-N/. Il
+ritmo per host resta uno solo per tutti: i processi prendono i token da un bucket
+condiviso su file (vedi controllo_ritmo.RitmoCondiviso), RATE_LIMIT richieste al secondo
+in totale, e un 429/503 ferma tutti. Alla fine gli output vengono uniti, deduplicati per
+url e ordinati per _id (unisci_shard.py), e i file dead-letter dei processi vengono
+riuniti in annunci_falliti.jsonl. La cache HTTP (HTTP_CACHE_DIR) è una sola per tutti i
+processi: il percorso viene reso assoluto prima di avviarli, e la dimensione è contata
+nell'indice comune (vedi cache_http.py).
+
+Uso: CRAWL_WORKERS=4 MAX_PAGES=0 python crawl_partizionato.py
+"""
+
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import zlib
+from datetime import datetime
+
+import pandas as pd
+
+from cache_http import cache_da_env
+from controllo_ritmo import RICHIESTE_AL_SECONDO_MAX, imposta_ritmo_condiviso
+from output_streaming import ScrittoreAnnunci
+from scraper_completo import get_annunci, get_urls, imposta_cache_http, pool_parsing, oggi
+from tentativi import FILE_FALLITI, scrivi_falliti, unisci_falliti
+from unisci_shard import unisci_snapshot
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+FILE_URLS = "urls.txt"
+
+
+def partizione_dell_url(url, totale):
+    return zlib.crc32(url.encode("utf-8")) % totale
+
+
+def partiziona(urls, totale):
+    """Divide gli URL in totale partizioni per hash: lo stesso URL finisce sempre nella stessa"""
+    partizioni = [[] for _ in range(totale)]
+    for url in urls:
+        partizioni[partizione_dell_url(url, totale)].append(url)
+    return partizioni
+
+
+def avvia_lavoratore(indice, urls, cartella_ritmo, richieste_al_secondo):
+    cartella = os.path.abspath(f"partizione-{indice}")
+    os.makedirs(cartella, exist_ok=True)
+    # Il dead-letter di un'esecuzione precedente non va riunito con quelli nuovi
+    if os.path.exists(os.path.join(cartella, FILE_FALLITI)):
+        os.remove(os.path.join(cartella, FILE_FALLITI))
+    with open(os.path.join(cartella, FILE_URLS), "w", encoding="utf-8") as f:
+        f.writelines(url + "\n" for url in urls)
+    # get_annunci analizza l'HTML nel processo stesso: il parallelismo viene dalle partizioni
+    processo = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "lavoratore", str(indice), cartella_ritmo, str(richieste_al_secondo)],
+        cwd=cartella,
+    )
+    return cartella, processo
+
+
+def esegui_lavoratore(indice, cartella_ritmo, richieste_al_secondo):
+    """Estrae gli annunci della partizione (urls.txt nella cartella corrente) e ritorna il file scritto, None se vuoto"""
+    imposta_ritmo_condiviso(cartella_ritmo, richieste_al_secondo)
+    with open(FILE_URLS, encoding="utf-8") as f:
+        urls = [riga.strip() for riga in f if riga.strip()]
+    logger.info(f"🧵 Partizione {indice}: {len(urls)} annunci")
+
+    imposta_cache_http(cache_da_env())
+    formato = os.getenv('OUTPUT_FORMAT', 'csv').lower()
+    scrittore = ScrittoreAnnunci(formato=formato, data_scraping=datetime.strptime(oggi, "%Y-%m-%d").date())
+    asyncio.run(get_annunci(pd.DataFrame({"url": urls}), scrittore=scrittore))
+    # Dead-letter nella cartella della partizione: il processo principale li riunisce
+    scrivi_falliti()
+    if not scrittore.statistiche["annunci"]:
+        scrittore.scarta()
+        return None
+    return scrittore.finalizza(f"partizione_{indice}.{formato}")
+
+
+async def raccogli_frontiera(max_pagine):
+    with pool_parsing():
+        df_urls = await get_urls(max_pagine=max_pagine)
+    return df_urls["url"].dropna().unique().tolist() if len(df_urls) else []
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "lavoratore":
+        percorso = esegui_lavoratore(int(sys.argv[2]), sys.argv[3], float(sys.argv[4]))
+        with open('csv_filename.txt', 'w') as f:
+            f.write(percorso or "")
+        sys.exit(0)
+
+    totale = int(os.getenv('CRAWL_WORKERS', str(os.cpu_count() or 1)))
+    max_pages = os.getenv('MAX_PAGES', '5')
+    max_pages = None if max_pages == '0' else int(max_pages)
+    richieste_al_secondo = float(os.getenv('RATE_LIMIT', str(RICHIESTE_AL_SECONDO_MAX)))
+    formato = os.getenv('OUTPUT_FORMAT', 'csv').lower()
+    # I lavoratori girano nella loro cartella: un percorso relativo darebbe una cache per processo
+    if os.getenv('HTTP_CACHE_DIR'):
+        os.environ['HTTP_CACHE_DIR'] = os.path.abspath(os.environ['HTTP_CACHE_DIR'])
+
+    # Anche la raccolta della frontiera rispetta il limite comune
+    cartella_ritmo = os.path.abspath("ritmo_condiviso")
+    os.makedirs(cartella_ritmo, exist_ok=True)
+    imposta_ritmo_condiviso(cartella_ritmo, richieste_al_secondo)
+
+    logger.info(f"🚀 Crawl partizionato: {totale} processi, max_pagine={max_pages}, {richieste_al_secondo:g} req/s in totale")
+    urls = asyncio.run(raccogli_frontiera(max_pages))
+    if not urls:
+        logger.error("❌ Nessun URL trovato")
+        sys.exit(1)
+
+    partizioni = partiziona(urls, totale)
+    logger.info(f"🧩 {len(urls)} URL divisi in partizioni da {', '.join(str(len(p)) for p in partizioni)}")
+    lavoratori = [avvia_lavoratore(i, p, cartella_ritmo, richieste_al_secondo) for i, p in enumerate(partizioni) if p]
+
+    percorsi = []
+    falliti = 0
+    for cartella, processo in lavoratori:
+        codice = processo.wait()
+        try:
+            with open(os.path.join(cartella, "csv_filename.txt")) as f:
+                nome = f.read().strip()
+        except FileNotFoundError:
+            nome = ""
+        if codice != 0:
+            falliti += 1
+            logger.error(f"❌ Processo di {cartella} terminato con codice {codice}: escluso dall'unione")
+        elif nome:
+            percorsi.append(os.path.join(cartella, nome))
+    # Anche i processi falliti possono aver scritto i loro URL dead-letter
+    unisci_falliti([cartella for cartella, _ in lavoratori])
+
+    if not percorsi:
+        logger.error("❌ Nessun annuncio estratto")
+        sys.exit(1)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    provvisorio = f"trovacasa_milano_{timestamp}_unione.{formato}"
+    annunci = unisci_snapshot(percorsi, provvisorio, ordina_per="_id")
+    filename = f"trovacasa_milano_{timestamp}_{annunci}_annunci_completi.{formato}"
+    os.replace(provvisorio, filename)
+    with open('csv_filename.txt', 'w') as f:
+        f.write(filename)
+    logger.info(f"💾 Snapshot unito: {filename} ({len(percorsi)} partizioni)")
+    if falliti:
+        sys.exit(1)
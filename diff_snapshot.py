@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Confronto tra due snapshot degli annunci e calcolo del ciclo di vita
+
+Senza lo stato persistente (STATE_DB, vedi stato_annunci.py) ogni snapshot è isolato:
+qui il nuovo snapshot viene unito al precedente (file locale o ultimo file sotto
+scraping-data/ su GCS) per _id con merge vettoriali di pandas, senza cicli per riga:
+- nuovi: assenti nel precedente, data_comparsa = oggi
+- rimossi: attivi nel precedente e assenti oggi, attivo = False e data_scomparsa = oggi;
+  solo se il crawl è completo (crawl_completo), come in stato_annunci.aggiorna_stato: con
+  MAX_PAGES, DEADLINE o pagine dei risultati fallite un annuncio assente può essere ancora online
+- modificati: prezzo, superficie o classe energetica diversi, data_aggiornamento = oggi
+Lo snapshot risultante ha le stesse righe di quello dello stato: gli annunci visti oggi
+seguiti da quelli scomparsi oggi. Le modifiche vanno anche in un file a parte
+(una riga per campo cambiato, con valore precedente e nuovo).
+
+Uso: python diff_snapshot.py <snapshot_nuovo> <snapshot_precedente> [<snapshot_finale>]
+"""
+
+import logging
+import os
+import re
+import sys
+import tempfile
+from datetime import date
+
+import pandas as pd
+
+from stato_annunci import COLONNE_CICLO_VITA
+from unisci_shard import leggi_snapshot, scrivi_snapshot
+
+logger = logging.getLogger(__name__)
+
+CAMPI_CONFRONTO = ["prezzo", "superficie_m2", "classe_ener"]
+CAMPI_NUMERICI = {"superficie_m2"}
+VALORI_MANCANTI = ["", "N/A", "nan", "None", "NaN", "<NA>"]
+
+
+def _testo(serie):
+    # I campi sono già ripuliti dall'estrazione: niente .str.strip(), che scorre le stringhe in Python
+    # fillna prima di isin: isin su una colonna string tutta NA è lento
+    testo = serie.astype("string")
+    return testo.mask(testo.fillna("").isin(VALORI_MANCANTI))
+
+
+def _confrontabile(serie, campo):
+    if campo in CAMPI_NUMERICI:
+        # "85", "85.0" e 85.0 (CSV, JSONL, Parquet) sono lo stesso valore
+        return pd.to_numeric(_testo(serie), errors="coerce")
+    return _testo(serie)
+
+
+def _attivo(serie):
+    if serie.dtype == bool:
+        return serie
+    return ~_testo(serie).str.lower().isin(["false", "0"])
+
+
+def _colonna(df, nome):
+    return df[nome] if nome in df.columns else pd.Series(pd.NA, index=df.index, dtype="object")
+
+
+def _chiave(df):
+    # _id è il codice annuncio del sito; un record senza codice si riconosce dall'URL
+    return _testo(_colonna(df, "_id")).fillna(_testo(_colonna(df, "url")))
+
+
+def diff_snapshot(nuovo, precedente, oggi=None, crawl_completo=True):
+    """
+    Confronta lo snapshot nuovo con il precedente (DataFrame, None se non c'è). Ritorna un dizionario con
+    snapshot (nuovo + scomparsi, con il ciclo di vita aggiornato), nuovi, rimossi, modifiche.
+    Con crawl_completo=False nessun annuncio viene considerato scomparso
+    """
+    oggi = oggi or date.today().isoformat()
+    if precedente is None:
+        precedente = pd.DataFrame()
+    nuovo = nuovo.assign(_chiave=_chiave(nuovo)).drop_duplicates("_chiave").reset_index(drop=True)
+    if "url" not in precedente.columns:
+        precedente = pd.DataFrame(columns=["_id", "url"])
+    precedente = precedente.assign(_chiave=_chiave(precedente)).drop_duplicates("_chiave")
+
+    colonne_uscita = [c for c in nuovo.columns if c != "_chiave" and c not in COLONNE_CICLO_VITA] + COLONNE_CICLO_VITA
+    da_unire = precedente.reindex(columns=["_chiave"] + CAMPI_CONFRONTO + ["data_comparsa", "data_aggiornamento"])
+    unione = nuovo.merge(
+        da_unire.add_suffix("_prec").rename(columns={"_chiave_prec": "_chiave"}),
+        on="_chiave", how="left", indicator=True,
+    )
+    noto = (unione.pop("_merge") == "both").to_numpy()
+
+    # Campi cambiati, tutti insieme per colonna
+    cambi = []
+    modificato = pd.Series(False, index=unione.index)
+    for campo in CAMPI_CONFRONTO:
+        prima = _confrontabile(unione[f"{campo}_prec"], campo)
+        dopo = _confrontabile(_colonna(unione, campo), campo)
+        uguale = (prima == dopo).fillna(False) | (prima.isna() & dopo.isna())
+        diverso = noto & ~uguale.to_numpy(dtype=bool)
+        modificato |= diverso
+        cambi.append(pd.DataFrame({
+            "_id": _colonna(unione, "_id")[diverso], "url": unione["url"][diverso], "campo": campo,
+            "valore_precedente": unione[f"{campo}_prec"][diverso], "valore_nuovo": _colonna(unione, campo)[diverso],
+        }))
+
+    comparsa_prec = _testo(unione["data_comparsa_prec"])
+    aggiornamento_prec = _testo(unione["data_aggiornamento_prec"])
+    unione["data_comparsa"] = comparsa_prec.where(noto & comparsa_prec.notna().to_numpy(), oggi)
+    unione["data_aggiornamento"] = aggiornamento_prec.where(noto).mask(modificato, oggi)
+    # Colonne tipizzate anche se vuote: concat di colonne object tutte NA controlla ogni cella
+    unione["data_scomparsa"] = pd.Series(pd.NA, index=unione.index, dtype="string")
+    unione["attivo"] = True
+
+    attivi_prima = precedente[_attivo(_colonna(precedente, "attivo"))]
+    rimossi = attivi_prima[~attivi_prima["_chiave"].isin(nuovo["_chiave"])].copy()
+    if not crawl_completo:
+        if len(rimossi):
+            logger.info(f"🔀 Crawl incompleto: {len(rimossi)} annunci assenti non vengono marcati come scomparsi")
+        rimossi = rimossi.iloc[0:0]
+    rimossi["attivo"] = False
+    rimossi["data_scomparsa"] = oggi
+    rimossi["data_comparsa"] = _testo(_colonna(rimossi, "data_comparsa"))
+    rimossi["data_aggiornamento"] = _testo(_colonna(rimossi, "data_aggiornamento"))
+    rimossi = rimossi.reindex(columns=colonne_uscita)
+
+    attuali = unione[colonne_uscita]
+    modifiche = pd.concat(cambi, ignore_index=True)
+    risultato = {
+        "snapshot": pd.concat([attuali, rimossi], ignore_index=True),
+        "nuovi": attuali[~noto],
+        "rimossi": rimossi,
+        "modifiche": modifiche,
+    }
+    logger.info(
+        f"🔀 Diff snapshot: {len(risultato['nuovi'])} nuovi, {len(rimossi)} rimossi, "
+        f"{int(modificato.sum())} modificati ({len(modifiche)} campi cambiati)"
+    )
+    return risultato
+
+
+def percorso_modifiche(percorso_snapshot):
+    return os.path.splitext(percorso_snapshot)[0] + "_modifiche.csv"
+
+
+def rinomina_con_conteggio(percorso, annunci):
+    """
+    Il nome dello snapshot riporta il numero di annunci (..._<n>_annunci_completi.<ext>): dopo il
+    diff il file contiene anche i rimossi. Rinomina snapshot e file delle modifiche e ritorna il nuovo percorso
+    """
+    nuovo = re.sub(r"_\d+_annunci_completi", f"_{annunci}_annunci_completi", percorso)
+    if nuovo != percorso:
+        os.replace(percorso, nuovo)
+        if os.path.exists(percorso_modifiche(percorso)):
+            os.replace(percorso_modifiche(percorso), percorso_modifiche(nuovo))
+    return nuovo
+
+
+def applica_diff(percorso_nuovo, precedente, percorso_finale=None, oggi=None, crawl_completo=True):
+    """
+    Aggiorna il ciclo di vita del file percorso_nuovo (o di un DataFrame) confrontandolo con
+    precedente (percorso, DataFrame o None) e lo riscrive in percorso_finale (predefinito: lo stesso file);
+    le modifiche vanno in <percorso_finale>_modifiche.csv. Ritorna il risultato di diff_snapshot
+    """
+    percorso_finale = percorso_finale or percorso_nuovo
+    oggi = oggi or date.today().isoformat()
+    nuovo = leggi_snapshot(percorso_nuovo) if isinstance(percorso_nuovo, str) else percorso_nuovo
+    if isinstance(precedente, str):
+        precedente = leggi_snapshot(precedente)
+    risultato = diff_snapshot(nuovo, precedente, oggi, crawl_completo)
+    scrivi_snapshot(risultato["snapshot"], percorso_finale, date.fromisoformat(oggi))
+    risultato["modifiche"].to_csv(percorso_modifiche(percorso_finale), index=False, sep=';', encoding='utf-8')
+    return risultato
+
+
+def snapshot_precedente_gcs(bucket, escludi=None, prefisso="scraping-data", giorno=None):
+    """
+    Ultimo snapshot caricato sotto prefisso/YYYY/MM/ (mese corrente, poi il precedente),
+    escluso il file escludi; None se non ce ne sono. Si elencano solo due mesi, non tutto lo storico
+    """
+    giorno = giorno or date.today()
+    mese_prima = (giorno.replace(day=1) - pd.Timedelta(days=1))
+    for mese in (giorno, mese_prima):
+        blobs = [
+            blob for blob in bucket.list_blobs(prefix=f"{prefisso}/{mese.year:04d}/{mese.month:02d}/")
+            if "_annunci_completi." in blob.name and "_EMPTY" not in blob.name
+            and os.path.basename(blob.name) != escludi
+        ]
+        if blobs:
+            ultimo = max(blobs, key=lambda blob: blob.updated)
+            logger.info(f"🔀 Snapshot precedente: gs://{bucket.name}/{ultimo.name}")
+            with tempfile.TemporaryDirectory() as cartella:
+                percorso = os.path.join(cartella, os.path.basename(ultimo.name))
+                # CSV/JSONL caricati con Content-Encoding gzip vengono decompressi dal client
+                ultimo.download_to_filename(percorso)
+                return leggi_snapshot(percorso)
+    return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    applica_diff(sys.argv[1], sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Manifest delle ricerche da scaricare e suddivisione in shard
+
+Il manifest (JSON) elenca le ricerche, ognuna con un nome e l'URL della prima pagina
+dei risultati. Con SHARD_COUNT > 1 ogni worker (processo o runner) prende solo le
+ricerche del suo SHARD_INDEX, assegnate a turno sui nomi in ordine alfabetico: gli shard
+differiscono al più di una ricerca.
+Lo stato persistente (STATE_DB) è per shard e non va condiviso: ogni shard marca come
+scomparsi tutti gli annunci dello stato che non ha visto, quindi anche quelli delle
+ricerche degli altri shard. Con una matrix di job la chiave della cache dello stato deve
+includere SHARD_INDEX / SHARD_COUNT (crawl_multiplo.py usa già una cartella per shard).
+Aggiungere o togliere ricerche può spostare le altre da uno shard all'altro: al primo run
+dopo la modifica lo shard che perde una ricerca ne marca gli annunci come scomparsi.
+Tutti gli shard interrogano lo stesso host, quindi ognuno usa 1/SHARD_COUNT dei limiti
+di ritmo per host (vedi controllo_ritmo.imposta_quota).
+"""
+
+import json
+import logging
+import os
+
+from controllo_ritmo import imposta_quota
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "ricerche.json"
+
+
+def carica_manifest(percorso=MANIFEST):
+    """Legge il manifest: lista di {"nome": ..., "url": ...} con nomi univoci"""
+    with open(percorso, encoding="utf-8") as f:
+        ricerche = json.load(f)
+    nomi = [ricerca["nome"] for ricerca in ricerche]
+    if len(set(nomi)) != len(nomi):
+        raise ValueError(f"❌ Nomi di ricerca duplicati nel manifest {percorso}")
+    return ricerche
+
+
+def shard_delle_ricerche(ricerche, totale_shard):
+    """Nome della ricerca -> shard, a turno sui nomi ordinati (dipende solo dal manifest)"""
+    return {nome: i % totale_shard for i, nome in enumerate(sorted(r["nome"] for r in ricerche))}
+
+
+def ricerche_dello_shard(ricerche, indice_shard, totale_shard):
+    if not 0 <= indice_shard < totale_shard:
+        raise ValueError(f"❌ SHARD_INDEX {indice_shard} fuori dall'intervallo 0-{totale_shard - 1}")
+    shard = shard_delle_ricerche(ricerche, totale_shard)
+    return [r for r in ricerche if shard[r["nome"]] == indice_shard]
+
+
+def configura_shard():
+    """
+    Legge CRAWL_MANIFEST / SHARD_INDEX / SHARD_COUNT e ritorna (ricerche, prefisso_output).
+    Senza manifest ritorna (None, "trovacasa_milano"): la sola ricerca predefinita.
+    """
+    percorso = os.getenv('CRAWL_MANIFEST', '')
+    indice_shard = int(os.getenv('SHARD_INDEX', '0'))
+    totale_shard = int(os.getenv('SHARD_COUNT', '1'))
+    imposta_quota(1 / totale_shard)
+
+    if not percorso:
+        return None, "trovacasa_milano"
+
+    ricerche = ricerche_dello_shard(carica_manifest(percorso), indice_shard, totale_shard)
+    logger.info(
+        f"🗺️ Shard {indice_shard + 1}/{totale_shard}: {len(ricerche)} ricerche "
+        f"({', '.join(r['nome'] for r in ricerche) or 'nessuna'})"
+    )
+    prefisso = f"trovacasa_shard{indice_shard}-{totale_shard}" if totale_shard > 1 else "trovacasa"
+    return [r["url"] for r in ricerche], prefisso
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Metriche di tempo per ogni richiesta HTTP, raccolte con i TraceConfig di aiohttp
+
+Per ogni richiesta vengono misurati, per fase (risultati / dettaglio) e status:
+- attesa_ritmo: attesa nel controllore dell'host (limiti nostri, vedi controllo_ritmo.py)
+- dns, connessione: risoluzione e apertura della connessione (TCP + TLS, senza il DNS
+  che aiohttp risolve al suo interno); solo connessioni nuove
+- ttfb: dall'invio della richiesta all'arrivo delle intestazioni della risposta
+- download: dalle intestazioni alla fine del corpo
+- parsing: analisi dell'HTML (nel pool di processi, se attivo)
+- byte: dimensione del corpo ricevuto
+e quante richieste hanno aperto una connessione nuova o riusato una keep-alive.
+Alla fine si scrivono percentili e istogrammi in JSON o nel formato textfile di
+Prometheus, così si vede se una notte lenta dipende dalla rete, dal sito che
+rallenta o dal nostro parsing.
+"""
+
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+FILE_METRICHE = "metriche_http.json"
+PERCENTILI = (50, 90, 99)
+# Limiti superiori dei bucket degli istogrammi (secondi; per i byte si usa BUCKET_BYTE)
+BUCKET_SECONDI = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKET_BYTE = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_campioni = defaultdict(list)  # (metrica, fase, status) -> valori
+_connessioni = Counter()  # "nuove" / "riusate"
+
+
+class MisuraRichiesta:
+    """Tempi di una richiesta: riempita dai callback del TraceConfig e da scarica_e_analizza"""
+
+    def __init__(self, fase):
+        self.fase = fase
+        self.valori = {}
+        self.inizio = None
+        self.intestazioni = None
+        self.byte = 0
+
+    def aggiungi(self, metrica, valore):
+        self.valori[metrica] = self.valori.get(metrica, 0) + valore
+
+    def fine_download(self):
+        if self.intestazioni is not None:
+            self.aggiungi("download", time.perf_counter() - self.intestazioni)
+        self.valori["byte"] = self.byte
+
+    def registra(self, status):
+        for metrica, valore in self.valori.items():
+            _campioni[(metrica, self.fase, str(status))].append(valore)
+
+
+def _misura(trace_config_ctx):
+    return trace_config_ctx.trace_request_ctx
+
+
+async def _inizio_richiesta(session, ctx, params):
+    misura = _misura(ctx)
+    if misura is not None:
+        misura.inizio = time.perf_counter()
+
+
+# La risoluzione DNS avviene dentro l'apertura della connessione: ogni fase ha il suo
+# inizio, e dalla connessione si toglie il DNS così le fasi non si sovrappongono
+async def _inizio_dns(session, ctx, params):
+    ctx.inizio_dns = time.perf_counter()
+
+
+async def _fine_dns(session, ctx, params):
+    durata = time.perf_counter() - ctx.inizio_dns
+    ctx.durata_dns = getattr(ctx, "durata_dns", 0) + durata
+    misura = _misura(ctx)
+    if misura is not None:
+        misura.aggiungi("dns", durata)
+
+
+async def _inizio_connessione(session, ctx, params):
+    ctx.inizio_connessione = time.perf_counter()
+    ctx.durata_dns = 0
+
+
+async def _fine_connessione(session, ctx, params):
+    misura = _misura(ctx)
+    if misura is not None:
+        misura.aggiungi("connessione", time.perf_counter() - ctx.inizio_connessione - ctx.durata_dns)
+
+
+async def _intestazioni_ricevute(session, ctx, params):
+    misura = _misura(ctx)
+    if misura is not None:
+        misura.intestazioni = time.perf_counter()
+        misura.aggiungi("ttfb", misura.intestazioni - misura.inizio)
+
+
+def _conta_connessione(tipo):
+    async def callback(session, ctx, params):
+        _connessioni[tipo] += 1
+    return callback
+
+
+def riuso_connessioni():
+    """Frazione delle richieste servite da una connessione già aperta"""
+    totale = sum(_connessioni.values())
+    return _connessioni["riusate"] / totale if totale else None
+
+
+async def _blocco_ricevuto(session, ctx, params):
+    misura = _misura(ctx)
+    if misura is not None:
+        misura.byte += len(params.chunk)
+
+
+def trace_config():
+    """TraceConfig da passare a ClientSession(trace_configs=[...])"""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(_inizio_richiesta)
+    trace.on_dns_resolvehost_start.append(_inizio_dns)
+    trace.on_dns_resolvehost_end.append(_fine_dns)
+    trace.on_connection_create_start.append(_inizio_connessione)
+    trace.on_connection_create_end.append(_fine_connessione)
+    trace.on_connection_create_end.append(_conta_connessione("nuove"))
+    trace.on_connection_reuseconn.append(_conta_connessione("riusate"))
+    trace.on_request_end.append(_intestazioni_ricevute)
+    trace.on_response_chunk_received.append(_blocco_ricevuto)
+    return trace
+
+
+def _percentile(ordinati, p):
+    indice = min(len(ordinati) - 1, max(0, round(p / 100 * len(ordinati)) - 1))
+    return ordinati[indice]
+
+
+def riepilogo():
+    """Per ogni (metrica, fase, status): conteggio, somma, media e percentili"""
+    righe = []
+    for (metrica, fase, status), valori in sorted(_campioni.items()):
+        ordinati = sorted(valori)
+        riga = {"metrica": metrica, "fase": fase, "status": status, "conteggio": len(ordinati),
+                "somma": sum(ordinati), "media": sum(ordinati) / len(ordinati), "max": ordinati[-1]}
+        riga.update({f"p{p}": _percentile(ordinati, p) for p in PERCENTILI})
+        righe.append(riga)
+    return righe
+
+
+def testo_prometheus():
+    """Istogrammi nel formato textfile di Prometheus (node_exporter --collector.textfile)"""
+    righe = []
+    metriche = sorted({metrica for metrica, _, _ in _campioni})
+    for metrica in metriche:
+        unita = "bytes" if metrica == "byte" else "seconds"
+        nome = f"trovacasa_http_{metrica}_{unita}"
+        bucket = BUCKET_BYTE if metrica == "byte" else BUCKET_SECONDI
+        righe.append(f"# TYPE {nome} histogram")
+        for (m, fase, status), valori in sorted(_campioni.items()):
+            if m != metrica:
+                continue
+            etichette = f'fase="{fase}",status="{status}"'
+            for limite in bucket:
+                righe.append(f'{nome}_bucket{{{etichette},le="{limite}"}} {sum(1 for v in valori if v <= limite)}')
+            righe.append(f'{nome}_bucket{{{etichette},le="+Inf"}} {len(valori)}')
+            righe.append(f"{nome}_sum{{{etichette}}} {sum(valori)}")
+            righe.append(f"{nome}_count{{{etichette}}} {len(valori)}")
+    righe.append("# TYPE trovacasa_http_connessioni_total counter")
+    for tipo, conteggio in sorted(_connessioni.items()):
+        righe.append(f'trovacasa_http_connessioni_total{{tipo="{tipo}"}} {conteggio}')
+    return "\n".join(righe) + "\n"
+
+
+def scrivi_metriche(percorso=FILE_METRICHE):
+    """Scrive le metriche raccolte: formato Prometheus se il file finisce in .prom, altrimenti JSON"""
+    if not _campioni:
+        return None
+    with open(percorso, "w", encoding="utf-8") as f:
+        if percorso.endswith(".prom"):
+            f.write(testo_prometheus())
+        else:
+            json.dump({
+                "percentili": PERCENTILI,
+                "connessioni": {**_connessioni, "riuso": riuso_connessioni()},
+                "metriche": riepilogo(),
+            }, f, indent=2)
+    logger.info(f"⏱️ Metriche HTTP salvate in {percorso}")
+    return percorso
+
+
+def log_statistiche_metriche():
+    """Riuso delle connessioni, mediana e p90 dei tempi principali per fase sulle risposte 200"""
+    if riuso_connessioni() is not None:
+        logger.info(
+            f"   - Connessioni: {_connessioni['nuove']} nuove, {_connessioni['riusate']} riusate "
+            f"(riuso {riuso_connessioni():.0%})"
+        )
+    for riga in riepilogo():
+        if riga["status"] == "200" and riga["metrica"] in ("attesa_ritmo", "ttfb", "download", "parsing"):
+            logger.info(
+                f"   - {riga['fase']} {riga['metrica']}: p50 {round(riga['p50'] * 1000)} ms, "
+                f"p90 {round(riga['p90'] * 1000)} ms ({riga['conteggio']} richieste)"
+            )
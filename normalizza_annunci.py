@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Normalizzazione a blocchi dei campi numerici degli annunci
+
+analizza_annuncio riporta prezzo, superficie, locali e bagni come testo della scheda
+("€ 350.000", "1.240,50 m²", "5+"); qui vengono convertiti su tutto il DataFrame con
+operazioni vettoriali di pandas (str.replace / str.fullmatch), fuori dalla coroutine di
+ogni richiesta:
+- prezzo_eur, superficie_m2, prezzo_m2: float (NaN se mancanti)
+- num_locali, num_bagni: interi Int16 ("5+" diventa 5)
+- errore_prezzo, errore_superficie, errore_locali, errore_bagni: il testo c'era ma non
+  è stato possibile ricavarne un numero ("Prezzo su richiesta" non è un errore)
+La normalizzazione si può riapplicare a dati già normalizzati (es. snapshot dello stato
+salvati prima di questa fase, con "120.5" e 3): il risultato non cambia.
+"""
+
+import importlib.util
+
+MIGLIAIA = r"\d{1,3}(?:\.\d{3})+(?:,\d+)?"  # Punto delle migliaia all'italiana
+PREZZO_SENZA_CIFRA = r"(?i)richiesta|riservat"  # Prezzi non indicati di proposito
+VALORI_MANCANTI = ["", "N/A", "None", "nan", "<NA>"]
+
+# Con pyarrow (già richiesto per l'output colonnare) le operazioni sulle stringhe girano
+# in C++ invece che con un ciclo Python per elemento
+TIPO_TESTO = "string[pyarrow]" if importlib.util.find_spec("pyarrow") else "string"
+
+COLONNE_ERRORE = ["errore_prezzo", "errore_superficie", "errore_locali", "errore_bagni"]
+
+
+def _testo(df, nome):
+    # Import qui: gli entry point importano questo modulo, pandas serve solo quando si normalizza
+    import pandas as pd
+    # I campi arrivano già senza spazi ai bordi (get_text(strip=True) in analizza_annuncio)
+    if nome not in df.columns:
+        return pd.Series(pd.NA, index=df.index, dtype=TIPO_TESTO)
+    testo = df[nome].astype(TIPO_TESTO)
+    return testo.mask(testo.fillna("").isin(VALORI_MANCANTI))
+
+
+def _numero(testo):
+    """Primo numero del testo come float: punto delle migliaia e virgola decimale, oppure punto decimale"""
+    # replace con gruppo al posto di str.extract, che con pyarrow ripiega su un ciclo Python
+    cifre = testo.str.replace(r"(?s)^\D*(\d+(?:[.,]\d+)*).*$", r"\1", regex=True)
+    migliaia = cifre.str.fullmatch(MIGLIAIA).fillna(False).astype(bool)
+    cifre = cifre.mask(migliaia, cifre.str.replace(".", "", regex=False)).str.replace(",", ".", regex=False)
+    return _converti(cifre, r"\d+(?:\.\d+)?", "float64")
+
+
+def _intero(testo):
+    # "5+" vuol dire 5 o più: si tiene il 5
+    return _converti(testo.str.replace(r"(?s)^\D*(\d+).*$", r"\1", regex=True), r"\d+", "Int16")
+
+
+def _converti(cifre, forma, tipo):
+    # Solo i testi ridotti a un numero valido: gli altri (senza cifre) diventano nulli
+    valido = cifre.str.fullmatch(forma).fillna(False).astype(bool)
+    return cifre.where(valido).astype("float64").astype(tipo)
+
+
+def _dopo(colonne, nome, nuove):
+    """Ordine delle colonne con nuove subito dopo nome (o in fondo se nome manca)"""
+    colonne = [c for c in colonne if c not in nuove]
+    posizione = colonne.index(nome) + 1 if nome in colonne else len(colonne)
+    return colonne[:posizione] + nuove + colonne[posizione:]
+
+
+def normalizza_annunci(df):
+    """Ritorna una copia di df con i campi numerici normalizzati e i flag di errore"""
+    df = df.copy()
+    prezzo = _testo(df, "prezzo")
+    superficie = _testo(df, "superficie_m2")
+    locali = _testo(df, "num_locali")
+    bagni = _testo(df, "num_bagni")
+
+    df["prezzo_eur"] = _numero(prezzo)
+    df["superficie_m2"] = _numero(superficie)
+    df["num_locali"] = _intero(locali)
+    df["num_bagni"] = _intero(bagni)
+    df["prezzo_m2"] = (df["prezzo_eur"] / df["superficie_m2"].where(df["superficie_m2"] > 0)).round(2)
+
+    errori = {
+        "errore_prezzo": prezzo.notna() & df["prezzo_eur"].isna() & ~prezzo.str.contains(PREZZO_SENZA_CIFRA).fillna(False),
+        "errore_superficie": superficie.notna() & df["superficie_m2"].isna(),
+        "errore_locali": locali.notna() & df["num_locali"].isna(),
+        "errore_bagni": bagni.notna() & df["num_bagni"].isna(),
+    }
+    for nome, errore in errori.items():
+        # Su dati già normalizzati il testo originale non c'è più: l'errore già segnato resta
+        precedente = _testo(df, nome).str.lower().isin(["true", "1"])
+        df[nome] = (errore.fillna(False) | precedente).astype(bool)
+
+    colonne = _dopo(list(df.columns), "prezzo", ["prezzo_eur"])
+    colonne = _dopo(colonne, "superficie_m2", ["prezzo_m2"])
+    colonne = _dopo(colonne, "tags", COLONNE_ERRORE)
+    return df[colonne]
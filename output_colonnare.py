@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Output colonnare tipizzato degli annunci (Parquet o Arrow IPC)
+
+Rispetto al CSV con ';' le colonne hanno un tipo: prezzo_eur, superficie_m2 e prezzo_m2
+sono numeri, num_locali/num_bagni interi (vedi normalizza_annunci.py), i flag di errore
+booleani, le date sono date e tags è una lista di stringhe.
+I file vanno in percorsi partizionati per data di scraping (scraping-data/YYYY/MM/),
+la stessa struttura usata su GCS, così mesi di snapshot si leggono con una sola
+scansione colonnare (es. pyarrow.dataset.dataset("scraping-data", format="parquet")).
+"""
+
+import logging
+import os
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from normalizza_annunci import normalizza_annunci
+from record_annunci import lista_tags
+
+logger = logging.getLogger(__name__)
+
+FORMATI_COLONNARI = ("parquet", "arrow")
+COMPRESSIONE = "zstd"  # Parquet: zstd, snappy, gzip, none; Arrow IPC: zstd, lz4, none
+CARTELLA_DATI = "scraping-data"
+RIGHE_PER_BLOCCO = 50000  # Righe convertite alla volta (un row group / record batch per blocco)
+
+SCHEMA_ANNUNCI = pa.schema([
+    ("_id", pa.string()),
+    ("url", pa.string()),
+    ("prezzo", pa.string()),  # Testo originale, es. "€ 350.000" o "Prezzo su richiesta"
+    ("prezzo_eur", pa.float64()),
+    ("titolo", pa.string()),
+    ("indirizzo", pa.string()),
+    ("superficie_m2", pa.float64()),
+    ("prezzo_m2", pa.float64()),
+    ("num_locali", pa.int16()),
+    ("num_bagni", pa.int16()),
+    ("classe_ener", pa.string()),
+    ("tags", pa.list_(pa.string())),
+    ("errore_prezzo", pa.bool_()),
+    ("errore_superficie", pa.bool_()),
+    ("errore_locali", pa.bool_()),
+    ("errore_bagni", pa.bool_()),
+    ("attivo", pa.bool_()),
+    ("data_comparsa", pa.date32()),
+    ("data_aggiornamento", pa.date32()),
+    ("data_scomparsa", pa.date32()),
+    ("data_scraping", pa.date32()),
+])
+
+
+def percorso_partizione(nome_file, giorno=None, radice=CARTELLA_DATI):
+    """Percorso del file nella partizione del mese di scraping: radice/YYYY/MM/nome_file"""
+    giorno = giorno or date.today()
+    cartella = os.path.join(radice, f"{giorno.year:04d}", f"{giorno.month:02d}")
+    os.makedirs(cartella, exist_ok=True)
+    return os.path.join(cartella, nome_file)
+
+
+def _date(serie):
+    return pd.to_datetime(serie, errors="coerce").dt.date
+
+
+def tabella_annunci(df, data_scraping=None):
+    """Converte un DataFrame di annunci in una tabella Arrow con SCHEMA_ANNUNCI"""
+    if "prezzo_eur" not in df.columns or not pd.api.types.is_float_dtype(df["prezzo_eur"]):
+        # Non ancora normalizzato (o riletto come testo, es. da un CSV)
+        df = normalizza_annunci(df)
+    n = len(df)
+    colonne = {}
+    for campo in SCHEMA_ANNUNCI:
+        nome = campo.name
+        serie = df[nome] if nome in df.columns else pd.Series([None] * n, index=df.index, dtype="object")
+        if nome in ("prezzo_eur", "superficie_m2", "prezzo_m2", "num_locali", "num_bagni") or nome.startswith("errore_"):
+            valori = serie
+        elif nome == "tags":
+            valori = serie.map(lista_tags)
+        elif nome == "attivo":
+            valori = serie.map(lambda v: None if v is None or v != v else str(v).lower() in ("true", "1"))
+        elif nome == "data_scraping":
+            valori = pd.Series([data_scraping or date.today()] * n, index=df.index)
+        elif pa.types.is_date32(campo.type):
+            valori = _date(serie)
+        else:
+            valori = serie.map(lambda v: None if v is None or v != v else str(v))
+        colonne[nome] = pa.array(valori, type=campo.type, from_pandas=True)
+    return pa.Table.from_pydict(colonne, schema=SCHEMA_ANNUNCI)
+
+
+class _ScrittoreColonnare:
+    """Scrive blocchi di DataFrame come row group Parquet o record batch Arrow IPC"""
+
+    def __init__(self, percorso, formato, compressione):
+        if formato not in FORMATI_COLONNARI:
+            raise ValueError(f"❌ Formato colonnare non supportato: {formato}")
+        compressione = None if compressione in (None, "", "none") else compressione
+        if formato == "parquet":
+            self.writer = pq.ParquetWriter(percorso, SCHEMA_ANNUNCI, compression=compressione or "none")
+        else:
+            opzioni = pa.ipc.IpcWriteOptions(compression=compressione)
+            self.writer = pa.ipc.new_file(percorso, SCHEMA_ANNUNCI, options=opzioni)
+
+    def scrivi(self, tabella):
+        self.writer.write_table(tabella)
+
+    def chiudi(self):
+        self.writer.close()
+
+
+def scrivi_colonnare(blocchi, destinazione, formato="parquet", compressione=COMPRESSIONE, data_scraping=None):
+    """
+    Scrive uno o più DataFrame (iterabile di blocchi) in un unico file; ritorna le righe
+    scritte. destinazione è un percorso oppure un file binario aperto in scrittura
+    (es. l'upload diretto su GCS, vedi caricamento_gcs.py)
+    """
+    su_file = isinstance(destinazione, str)
+    righe = 0
+    scrittore = _ScrittoreColonnare(destinazione + ".tmp" if su_file else destinazione, formato, compressione)
+    try:
+        for blocco in blocchi:
+            if len(blocco):
+                scrittore.scrivi(tabella_annunci(blocco, data_scraping))
+                righe += len(blocco)
+    finally:
+        scrittore.chiudi()
+    if su_file:
+        # Il file definitivo compare solo completo (un Parquet senza footer è illeggibile)
+        os.replace(destinazione + ".tmp", destinazione)
+    nome = destinazione if su_file else "stream"
+    logger.info(f"🧱 Scritto {nome}: {righe} righe ({formato}, compressione {compressione or 'nessuna'})")
+    return righe
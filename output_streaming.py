@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Scrittura in streaming degli annunci estratti con checkpoint per la ripresa
+
+Ogni record viene accodato al file di output (CSV con ';' o JSONL) man mano che
+arriva, con flush a blocchi; gli URL completati finiscono nel file di checkpoint.
+Se il job viene interrotto, l'esecuzione successiva riprende dagli stessi file
+saltando gli annunci già scritti. La memoria non cresce con il numero di annunci.
+Con i formati colonnari (parquet, arrow) i record vengono accodati in JSONL e
+convertiti nel formato finale solo alla fine (vedi output_colonnare.py). Nel file
+definitivo i campi numerici sono normalizzati a blocchi (vedi normalizza_annunci.py).
+"""
+
+import csv
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_IN_CORSO = "trovacasa_milano_in_corso"  # Nome base dei file parziali
+BATCH_SCRITTURA = 50
+CHECKPOINT_MAX_ORE = 24  # Checkpoint più vecchi appartengono a un'altra esecuzione e vengono ignorati
+FORMATI_COLONNARI = ("parquet", "arrow")  # Un file colonnare non si può accodare: si passa dal JSONL
+RIGHE_PER_BLOCCO = 50000  # Righe rilette e normalizzate alla volta alla fine
+
+
+def scrivi_blocchi(blocchi, destinazione, formato="csv"):
+    """Scrive blocchi di DataFrame su un file di testo aperto: CSV con ';' (intestazione una volta) o JSONL"""
+    for numero, blocco in enumerate(blocchi):
+        if formato == "csv":
+            blocco.to_csv(destinazione, index=False, sep=";", header=numero == 0)
+        else:
+            testo = blocco.to_json(orient="records", lines=True, force_ascii=False)
+            destinazione.write(testo if testo.endswith("\n") else testo + "\n")
+
+
+class ScrittoreAnnunci:
+    """Accoda i record a un file CSV/JSONL e tiene il checkpoint degli URL completati"""
+
+    def __init__(self, nome_base=OUTPUT_IN_CORSO, formato="csv", batch=BATCH_SCRITTURA, max_ore=CHECKPOINT_MAX_ORE,
+                 compressione=None, data_scraping=None):
+        if formato not in ("csv", "jsonl") + FORMATI_COLONNARI:
+            raise ValueError(f"❌ Formato di output non supportato: {formato}")
+        self.formato_finale = formato
+        self.compressione = compressione
+        self.data_scraping = data_scraping
+        formato = "jsonl" if formato in FORMATI_COLONNARI else formato
+        self.formato = formato
+        self.percorso = f"{nome_base}.{formato}"
+        self.percorso_checkpoint = f"{nome_base}.checkpoint"
+        self.batch = batch
+        self.buffer = []
+        self.colonne = None
+        self.statistiche = {"annunci": 0, "con_prezzo": 0, "con_superficie": 0, "con_locali": 0}
+
+        self.completati = set()
+        if os.path.exists(self.percorso_checkpoint) and time.time() - os.path.getmtime(self.percorso_checkpoint) < max_ore * 3600:
+            with open(self.percorso_checkpoint, encoding="utf-8") as f:
+                self.completati = {riga.strip() for riga in f if riga.strip()}
+        if self.completati and os.path.exists(self.percorso):
+            self._prepara_ripresa()
+            logger.info(f"♻️ Ripresa da checkpoint: {len(self.completati)} annunci già scritti in {self.percorso}")
+        else:
+            # Nessun checkpoint valido: si riparte da file vuoti
+            self.completati = set()
+            for percorso in (self.percorso, self.percorso_checkpoint):
+                if os.path.exists(percorso):
+                    os.remove(percorso)
+
+        self.file = open(self.percorso, "a", encoding="utf-8", newline="")
+        self.file_checkpoint = open(self.percorso_checkpoint, "a", encoding="utf-8")
+        self.writer = csv.writer(self.file, delimiter=";") if formato == "csv" else None
+
+    def _prepara_ripresa(self):
+        """Scarta un'eventuale ultima riga incompleta e recupera intestazione e conteggi"""
+        with open(self.percorso, "rb+") as f:
+            dimensione = f.seek(0, os.SEEK_END)
+            inizio_coda = max(0, dimensione - 65536)
+            f.seek(inizio_coda)
+            coda = f.read()
+            fine = inizio_coda + coda.rfind(b"\n") + 1
+            if fine < dimensione:
+                f.truncate(fine)
+
+        with open(self.percorso, encoding="utf-8", newline="") as f:
+            if self.formato == "csv":
+                righe = csv.DictReader(f, delimiter=";")
+                self.colonne = righe.fieldnames
+            else:
+                righe = (json.loads(riga) for riga in f if riga.strip())
+            for record in righe:
+                self._conta(record)
+                # Il file di dati fa fede: un record scritto prima del checkpoint non va riscaricato
+                self.completati.add(record["url"])
+
+    def _conta(self, record):
+        self.statistiche["annunci"] += 1
+        self.statistiche["con_prezzo"] += record.get("prezzo") not in (None, "", "N/A")
+        self.statistiche["con_superficie"] += record.get("superficie_m2") not in (None, "")
+        self.statistiche["con_locali"] += record.get("num_locali") not in (None, "")
+
+    def scrivi(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Scrive il blocco di record in attesa e poi aggiorna il checkpoint"""
+        if not self.buffer:
+            return
+        for record in self.buffer:
+            if self.formato == "csv":
+                if self.colonne is None:
+                    self.colonne = list(record.keys())
+                    self.writer.writerow(self.colonne)
+                self.writer.writerow([record.get(colonna) for colonna in self.colonne])
+            else:
+                self.file.write(json.dumps(dict(record), ensure_ascii=False) + "\n")
+            self._conta(record)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        # Il checkpoint si aggiorna solo dopo che i dati sono su disco
+        self.file_checkpoint.write("".join(record["url"] + "\n" for record in self.buffer))
+        self.file_checkpoint.flush()
+        self.completati.update(record["url"] for record in self.buffer)
+        self.buffer = []
+
+    def chiudi(self):
+        self.flush()
+        self.file.close()
+        self.file_checkpoint.close()
+
+    def scarta(self):
+        """Chiude e rimuove i file parziali (nessun annuncio da salvare)"""
+        self.rimuovi()
+
+    def rimuovi(self):
+        """Chiude e rimuove i file parziali, es. dopo averne caricato il contenuto su GCS"""
+        self.chiudi()
+        os.remove(self.percorso)
+        os.remove(self.percorso_checkpoint)
+
+    def blocchi(self, righe=RIGHE_PER_BLOCCO):
+        """Chiude i file e rilegge l'output parziale a blocchi di DataFrame normalizzati"""
+        # Import qui: pandas serve solo alla fine, non durante il crawl
+        import pandas as pd
+        from normalizza_annunci import normalizza_annunci
+
+        self.chiudi()
+        if self.formato == "csv":
+            lettore = pd.read_csv(self.percorso, sep=";", dtype=str, keep_default_na=False, chunksize=righe)
+        else:
+            lettore = pd.read_json(self.percorso, lines=True, dtype=False, convert_dates=False, chunksize=righe)
+        with lettore:
+            for blocco in lettore:
+                yield normalizza_annunci(blocco)
+
+    def finalizza(self, percorso_finale):
+        """Chiude i file, converte l'output parziale in quello definitivo (normalizzato) e rimuove i parziali"""
+        if self.formato_finale in FORMATI_COLONNARI:
+            # Import qui: pyarrow serve solo per l'output colonnare
+            from output_colonnare import scrivi_colonnare, COMPRESSIONE
+            scrivi_colonnare(
+                self.blocchi(), percorso_finale, self.formato_finale,
+                self.compressione or COMPRESSIONE, self.data_scraping,
+            )
+        else:
+            # Il file definitivo compare solo completo
+            with open(percorso_finale + ".tmp", "w", encoding="utf-8", newline="") as f:
+                scrivi_blocchi(self.blocchi(), f, self.formato)
+            os.replace(percorso_finale + ".tmp", percorso_finale)
+        os.remove(self.percorso)
+        os.remove(self.percorso_checkpoint)
+        return percorso_finale
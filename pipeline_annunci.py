@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Pipeline produttore/consumatore tra la raccolta degli URL e l'estrazione degli annunci
+
+Il produttore (le pagine dei risultati) accoda gli URL in una asyncio.Queue limitata
+man mano che li trova; un numero fisso di lavoratori li consuma subito. Se i lavoratori
+restano indietro la coda piena rallenta il produttore, quindi in memoria ci sono al più
+"dimensione_coda" URL in attesa e non una coroutine per ogni annuncio.
+Le estrazioni fallite passano dalla coda dei tentativi (vedi tentativi.py) e rientrano
+nella pipeline quando il loro backoff è scaduto.
+La coda è ordinata per priorità (nuovi, poi scaduti, poi refresh ordinari; a parità
+nell'ordine di arrivo). Con una scadenza (vedi scadenza_crawl.py) la pipeline si ferma
+allo scadere del tempo e gli URL non conclusi restano nella frontiera.
+"""
+
+import asyncio
+import itertools
+import logging
+
+from tentativi import CodaTentativi
+
+logger = logging.getLogger(__name__)
+
+LAVORATORI = 16
+DIMENSIONE_CODA = 500
+
+
+class PipelineAnnunci:
+    """
+    operazione(url) ritorna (risultato, classe_errore, dettaglio) come estrai_annuncio;
+    al_risultato(risultato) riceve ogni estrazione riuscita
+    """
+
+    def __init__(self, operazione, al_risultato, lavoratori=LAVORATORI, dimensione_coda=DIMENSIONE_CODA, scadenza=None):
+        self.operazione = operazione
+        self.al_risultato = al_risultato
+        self.lavoratori = lavoratori
+        self.coda = asyncio.PriorityQueue(maxsize=dimensione_coda)
+        self.ordine = itertools.count()  # A parità di priorità si segue l'ordine di arrivo
+        self.priorita = {}  # URL accodati e non ancora conclusi -> priorità
+        self.scadenza = scadenza
+        self.tentativi = CodaTentativi("annuncio")
+        self.nuovo_tentativo = asyncio.Event()
+        self.finito = asyncio.Event()
+        self.produzione_finita = False
+        self.visti = set()
+        self.in_sospeso = 0  # URL accodati e non ancora conclusi (estratti o scartati)
+
+    async def accoda(self, url, priorita=0):
+        """Accoda un URL (i duplicati vengono ignorati); attende se la coda è piena"""
+        if url in self.visti:
+            return False
+        self.visti.add(url)
+        self.in_sospeso += 1
+        self.priorita[url] = priorita
+        await self._metti(url)
+        return True
+
+    async def _metti(self, url):
+        await self.coda.put((self.priorita[url], next(self.ordine), url))
+
+    def frontiera(self):
+        """URL accodati e non conclusi (in coda, in estrazione o in attesa di un nuovo tentativo) -> priorità"""
+        return dict(self.priorita)
+
+    def _concluso(self, url):
+        self.priorita.pop(url, None)
+        self.in_sospeso -= 1
+        self._controlla_fine()
+
+    def _controlla_fine(self):
+        if self.produzione_finita and self.in_sospeso == 0:
+            self.finito.set()
+
+    async def _lavoratore(self):
+        while True:
+            _, _, url = await self.coda.get()
+            risultato, classe, dettaglio = await self.operazione(url)
+            if classe is None:
+                self.tentativi.riuscito(url)
+                self.al_risultato(risultato)
+                self._concluso(url)
+            elif self.tentativi.rimanda(url, classe, dettaglio):
+                self.nuovo_tentativo.set()
+            else:
+                self._concluso(url)
+
+    async def _rientro(self):
+        """Rimette in coda gli URL il cui backoff è scaduto"""
+        while True:
+            attesa = self.tentativi.secondi_al_prossimo()
+            self.nuovo_tentativo.clear()
+            try:
+                # Un nuovo tentativo può scadere prima di quello atteso: si ricalcola l'attesa
+                await asyncio.wait_for(self.nuovo_tentativo.wait(), timeout=attesa)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            for url in self.tentativi.pronti():
+                await self._metti(url)
+
+    async def esegui(self, produttore):
+        """
+        Esegue la coroutine produttore (che chiama accoda) insieme ai lavoratori finché
+        ogni URL accodato è concluso; ritorna il valore ritornato dal produttore.
+        Allo scadere della scadenza si ferma subito (produttore compreso, che allora ritorna
+        None): le estrazioni in corso vengono abbandonate e restano nella frontiera
+        """
+        produzione = asyncio.ensure_future(produttore)
+        fine = asyncio.ensure_future(self.finito.wait())
+        attivi = {produzione, fine, asyncio.ensure_future(self._rientro())}
+        attivi.update(asyncio.ensure_future(self._lavoratore()) for _ in range(self.lavoratori))
+        allarme = None
+        if self.scadenza is not None:
+            allarme = asyncio.ensure_future(asyncio.sleep(self.scadenza.secondi_rimanenti()))
+            attivi.add(allarme)
+        try:
+            while not fine.done():
+                completati, attivi = await asyncio.wait(attivi, return_when=asyncio.FIRST_COMPLETED)
+                if allarme in completati and not fine.done():
+                    self.scadenza.raggiunta = True
+                    logger.warning(f"⏰ Scadenza di {self.scadenza.minuti:g} minuti raggiunta: crawl interrotto, {len(self.priorita)} URL non conclusi")
+                    return produzione.result() if produzione.done() else None
+                for task in completati:
+                    # Propaga subito gli errori del produttore o di un lavoratore
+                    task.result()
+                    if task is produzione:
+                        self.produzione_finita = True
+                        self._controlla_fine()
+            return produzione.result()
+        finally:
+            for task in attivi:
+                task.cancel()
+            await asyncio.gather(*attivi, return_exceptions=True)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Rappresentazione compatta degli annunci estratti
+
+- Annuncio: record a schema fisso con __slots__ al posto di un dict da 14 chiavi per
+  annuncio; i tag sono una tupla di stringhe internate (gli stessi pochi tag si
+  ripetono su tutti gli annunci) e le colonne del ciclo di vita puntano agli stessi
+  oggetti costanti. Si legge come un dict (record["url"], get, keys, items), quindi
+  scrittori e stato (output_streaming.py, stato_annunci.py) non cambiano.
+- BloccoAnnunci: annunci accumulati per colonna (una lista per campo), convertiti in
+  DataFrame o tabella Arrow direttamente dalle colonne, senza passare da una lista di dict.
+"""
+
+import ast
+import sys
+from collections.abc import Mapping
+
+from stato_annunci import COLONNE_CICLO_VITA
+
+COLONNE_ESTRATTE = (
+    "_id", "url", "prezzo", "titolo", "indirizzo", "superficie_m2", "num_locali", "num_bagni", "classe_ener", "tags",
+)
+COLONNE_ANNUNCIO = COLONNE_ESTRATTE + tuple(COLONNE_CICLO_VITA)
+
+
+def lista_tags(valore):
+    """
+    Tag di un annuncio riletto da un file come lista di stringhe: lista (JSONL, Parquet),
+    repr di una lista Python o JSON (CSV), testo singolo, None/NaN
+    """
+    if isinstance(valore, str):
+        if not valore.startswith("["):
+            return [valore] if valore else []
+        try:
+            # literal_eval e non json.loads: nella repr un tag con l'apostrofo sta tra virgolette doppie
+            valore = ast.literal_eval(valore)
+        except (ValueError, SyntaxError):
+            return [valore]
+    if isinstance(valore, (list, tuple)):
+        return [str(tag) for tag in valore]
+    return []
+
+
+def _interna(valore):
+    return sys.intern(valore) if isinstance(valore, str) else valore
+
+
+class Annuncio(Mapping):
+    """Un annuncio con le colonne di COLONNE_ANNUNCIO, in sola lettura come un dict"""
+
+    __slots__ = COLONNE_ANNUNCIO
+
+    def __init__(self, **campi):
+        for nome in COLONNE_ANNUNCIO:
+            setattr(self, nome, campi.get(nome))
+
+    @classmethod
+    def da_analisi(cls, dati, oggi):
+        """Record di un annuncio appena estratto (dict di analizza_annuncio): attivo, comparso oggi"""
+        annuncio = cls.__new__(cls)
+        for nome in COLONNE_ESTRATTE:
+            setattr(annuncio, nome, dati.get(nome))
+        annuncio.tags = tuple(_interna(tag) for tag in dati.get("tags") or ())
+        annuncio.classe_ener = _interna(annuncio.classe_ener)
+        annuncio.attivo = True
+        annuncio.data_comparsa = oggi
+        annuncio.data_aggiornamento = None
+        annuncio.data_scomparsa = None
+        return annuncio
+
+    def __getitem__(self, nome):
+        if nome not in COLONNE_ANNUNCIO:
+            raise KeyError(nome)
+        valore = getattr(self, nome)
+        # All'esterno i tag restano una lista, come nei CSV e JSONL già prodotti
+        return list(valore) if nome == "tags" else valore
+
+    def __iter__(self):
+        return iter(COLONNE_ANNUNCIO)
+
+    def __len__(self):
+        return len(COLONNE_ANNUNCIO)
+
+    def __repr__(self):
+        return f"Annuncio({dict(self)!r})"
+
+
+class BloccoAnnunci:
+    """Annunci accumulati per colonna: una lista per campo invece di un oggetto per annuncio"""
+
+    def __init__(self, colonne=COLONNE_ANNUNCIO):
+        self.colonne = {nome: [] for nome in colonne}
+
+    def aggiungi(self, record):
+        for nome, valori in self.colonne.items():
+            # getattr legge la tupla dei tag di un Annuncio senza copiarla in una lista
+            valori.append(getattr(record, nome) if isinstance(record, Annuncio) else record.get(nome))
+
+    def __len__(self):
+        return len(self.colonne["url"])
+
+    def dataframe(self):
+        # Import qui: pandas serve solo a chi vuole i risultati in memoria, non al crawl
+        import pandas as pd
+        colonne = dict(self.colonne)
+        colonne["tags"] = [list(tags) if tags is not None else [] for tags in colonne["tags"]]
+        return pd.DataFrame(colonne)
+
+    def tabella(self, data_scraping=None):
+        """Tabella Arrow con lo schema dell'output colonnare (vedi output_colonnare.py)"""
+        from output_colonnare import tabella_annunci
+        return tabella_annunci(self.dataframe(), data_scraping)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Tempo a disposizione del crawl e frontiera rimasta da scaricare
+
+I workflow uccidono il job allo scadere di timeout-minutes: se succede durante il crawl
+non viene scritto nessun file. Con DEADLINE (minuti per il crawl, 0 = nessun limite) la
+pipeline degli annunci (vedi pipeline_annunci.py) si ferma da sola prima: gli annunci
+già estratti vengono scritti come snapshot parziale e gli URL accodati e non ancora
+scaricati finiscono nel file della frontiera, da cui riparte l'esecuzione successiva.
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FILE_FRONTIERA = "frontiera_crawl.json"
+
+
+class Scadenza:
+    """Istante entro cui il crawl deve fermarsi; raggiunta diventa True quando la pipeline si ferma per la scadenza"""
+
+    def __init__(self, minuti):
+        self.minuti = minuti
+        self.fine = time.monotonic() + minuti * 60
+        self.raggiunta = False
+
+    def secondi_rimanenti(self):
+        return max(0.0, self.fine - time.monotonic())
+
+
+def scadenza_da_env():
+    """Scadenza da DEADLINE (minuti dall'avvio); None se non impostata o 0"""
+    minuti = float(os.getenv('DEADLINE', '0') or 0)
+    if minuti <= 0:
+        return None
+    logger.info(f"⏰ Tempo a disposizione per il crawl: {minuti:g} minuti")
+    return Scadenza(minuti)
+
+
+def salva_frontiera(priorita, percorso=FILE_FRONTIERA):
+    """Salva gli URL rimasti (URL -> priorità) in ordine di priorità, per l'esecuzione successiva"""
+    urls = sorted(priorita, key=priorita.get)
+    with open(percorso, "w", encoding="utf-8") as f:
+        json.dump({"data": datetime.now().isoformat(timespec="seconds"), "urls": urls}, f)
+    if urls:
+        logger.warning(f"⏰ {len(urls)} URL non scaricati salvati nella frontiera {percorso}")
+    return percorso
+
+
+def carica_frontiera(percorso=FILE_FRONTIERA):
+    """URL rimasti dall'esecuzione precedente interrotta dalla scadenza (lista vuota se non ce ne sono)"""
+    if not os.path.exists(percorso):
+        return []
+    with open(percorso, encoding="utf-8") as f:
+        frontiera = json.load(f)
+    if frontiera["urls"]:
+        logger.info(f"⏰ Riprendo dalla frontiera del {frontiera['data']}: {len(frontiera['urls'])} URL")
+    return frontiera["urls"]
+
+
+def svuota_frontiera(percorso=FILE_FRONTIERA):
+    """
+    La frontiera è stata smaltita da un crawl arrivato in fondo. Il file resta, vuoto: la
+    cache dei workflow salva solo file esistenti e ripristinerebbe la frontiera vecchia
+    """
+    if os.path.exists(percorso):
+        salva_frontiera({}, percorso)
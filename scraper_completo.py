@@ -6,11 +6,33 @@ Scraping completo annunci TrovaCasa Milano - Versione GitHub Actions
 import aiohttp
 import asyncio
 from bs4 import BeautifulSoup
-import pandas as pd
+import hashlib
+import inspect
+import json
+import re
 import time
 from datetime import datetime
 import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+from archivio_html import archivio_da_env
+from cache_http import cache_da_env
+from controllo_ritmo import controllore_per, log_statistiche_ritmo
+from manifest_crawl import configura_shard
+from metriche_http import MisuraRichiesta, scrivi_metriche, log_statistiche_metriche
+from sessione_http import sessione_http
+from output_streaming import ScrittoreAnnunci, FORMATI_COLONNARI
+from normalizza_annunci import normalizza_annunci
+from pipeline_annunci import PipelineAnnunci, LAVORATORI, DIMENSIONE_CODA
+from record_annunci import Annuncio, BloccoAnnunci
+from tentativi import CodaTentativi, classifica_errore, scrivi_falliti, log_statistiche_tentativi
+from stato_annunci import (
+    apri_stato, priorita_download, urls_schede_cambiate, aggiorna_stato, snapshot_stato, iter_snapshot, RegistroStato,
+    GIORNI_REFRESH, PRIORITA_NUOVO
+)
+from scadenza_crawl import scadenza_da_env, salva_frontiera, carica_frontiera, svuota_frontiera
 
 # Configurazione logging per GitHub Actions
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,220 +44,922 @@ logger = logging.getLogger(__name__)
 base_url = "https://www.trovacasa.it"
 start_url = f"{base_url}/case-in-vendita/milano"
 headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
-MAX_CONCURRENT_REQUESTS = 4  # Ridotto per GitHub Actions (inizialmente ridotto a 8 ma si bloccava)
+MAX_CONCURRENT_PAGES = 4  # Pagine dei risultati scaricate in parallelo (1 = navigazione sequenziale)
+SEGNAPOSTO_PAGINA = "{pagina}"
 oggi = datetime.today().strftime("%Y-%m-%d")
 
+# Parsing HTML: backend di BeautifulSoup ("html.parser" oppure "lxml", più veloce)
+# e numero di processi dedicati al parsing (0 = parsing direttamente nel loop asyncio)
+HTML_PARSER = os.getenv('HTML_PARSER', 'html.parser')
+PARSER_WORKERS = int(os.getenv('PARSER_WORKERS', str(os.cpu_count() or 1)))
+# Lavoratori che estraggono gli annunci in parallelo (il ritmo reale lo decide controllo_ritmo.py)
+DETAIL_WORKERS = int(os.getenv('DETAIL_WORKERS', str(LAVORATORI)))
+
+# Etichette della scheda annuncio (dt.term) e colonna del CSV in cui finisce il valore (dd.description)
+CAMPI_DETTAGLIO = {
+    "Codice annuncio": "_id",
+    "Superficie": "superficie_m2",
+    "Numero locali": "num_locali",
+    "Numero bagni": "num_bagni",
+    "Classe energetica": "classe_ener",
+}
+
+# Caratteristiche della scheda nella pagina dei risultati (ul.card__features li):
+# parola contenuta nel testo -> colonna del CSV in cui finisce il testo
+CARATTERISTICHE_SCHEDA = {
+    "m²": "superficie_m2",
+    "mq": "superficie_m2",
+    "local": "num_locali",
+    "bagn": "num_bagni",
+}
+
 # -----------------------
-# Funzioni
+# Parsing in processi separati
 # -----------------------
-async def scarica_pagina(session, url, numero_pagina):
-    logger.info(f"📄 Scarico pagina {numero_pagina}")
+_parsing_executor = None
+
+
+@contextmanager
+def pool_parsing(workers=None):
+    """Avvia il pool di processi per il parsing HTML per la durata del blocco with"""
+    global _parsing_executor
+    workers = PARSER_WORKERS if workers is None else workers
+    if workers > 0:
+        _parsing_executor = ProcessPoolExecutor(max_workers=workers)
+        logger.info(f"⚙️ Parsing HTML su {workers} processi (parser: {HTML_PARSER})")
     try:
-        async with session.get(url, headers=headers, timeout=30) as response:
-            if response.status != 200:
-                logger.warning(f"⚠️ Errore HTTP {response.status} per pagina {numero_pagina}")
-                return None, None
-            html = await response.text()
-            soup = BeautifulSoup(html, "html.parser")
+        yield
+    finally:
+        if _parsing_executor is not None:
+            _parsing_executor.shutdown(wait=True)
+            _parsing_executor = None
+
+
+async def analizza_html(funzione, *args):
+    """Esegue una funzione di parsing nel pool di processi, se attivo, altrimenti nel loop"""
+    if _parsing_executor is None:
+        return funzione(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_parsing_executor, funzione, *args)
+
+
+def estrai_paginazione(soup):
+    """
+    Ricava dal pager il numero totale di pagine e lo schema degli URL delle pagine.
+    Ritorna (totale_pagine, schema_url) oppure None se il pager non è interpretabile.
+    """
+    link_numerati = {}
+    for a in soup.select("a.pager__link"):
+        href = a.get("href")
+        testo = a.get_text(strip=True)
+        if href and testo.isdigit():
+            link_numerati[int(testo)] = href
+
+    # Lo schema si ricava da un link numerato >= 2 sostituendo il numero con un segnaposto
+    for numero, href in sorted(link_numerati.items(), reverse=True):
+        if numero < 2:
+            continue
+        posizione = href.rfind(str(numero))
+        if posizione >= 0:
+            schema_url = base_url + href[:posizione] + SEGNAPOSTO_PAGINA + href[posizione + len(str(numero)):]
+            return max(link_numerati), schema_url
+    return None
+
+
+def analizza_scheda(link):
+    """Campi dell'annuncio leggibili dalla sua scheda nella pagina dei risultati, a partire dal link del titolo"""
+    scheda = link.find_parent(class_="card") or link.parent
+    prezzo = scheda.select_one(".card__price")
+    indirizzo = scheda.select_one(".card__address, .card__location")
+    campi = {
+        "url": base_url + link.get("href"),
+        "prezzo": prezzo.get_text(strip=True) if prezzo else "N/A",
+        "titolo": link.get_text(strip=True) or "N/A",
+        "indirizzo": indirizzo.get_text(strip=True) if indirizzo else "N/A",
+        "superficie_m2": None,
+        "num_locali": None,
+        "num_bagni": None,
+    }
+    for voce in scheda.select(".card__features li"):
+        testo = voce.get_text(" ", strip=True)
+        for parola, colonna in CARATTERISTICHE_SCHEDA.items():
+            if campi[colonna] is None and parola in testo.lower():
+                campi[colonna] = testo
+    return campi
+
+
+def analizza_pagina_risultati(html, parser, schede=False):
+    """
+    Estrae da una pagina dei risultati i link agli annunci, il link "next" e la paginazione.
+    Con schede=True al posto dei link ritorna i campi della scheda di ogni annuncio (vedi analizza_scheda)
+    """
+    soup = BeautifulSoup(html, parser)
+
+    link = [a for a in soup.select("a.card__title.js_link_immobile") if a.get("href")]
+    link_annunci = [analizza_scheda(a) for a in link] if schede else [base_url + a.get("href") for a in link]
+
+    next_button = soup.select_one("a.pager__link.next")
+    next_url = base_url + next_button.get("href") if next_button and next_button.get("href") else None
+
+    return link_annunci, next_url, estrai_paginazione(soup)
+
+
+def estrai_dettaglio(soup):
+    """
+    Visita una sola volta il DOM della pagina di dettaglio e raccoglie prezzo, titolo,
+    indirizzo, tag e tutte le coppie dt.term -> dd.description dei blocchi dl.row
+    """
+    dettaglio = {"prezzo": None, "titolo": None, "indirizzo": None, "tags": [], "termini": {}}
+    termini = dettaglio["termini"]
+
+    for elemento in soup.find_all(True):
+        classi = elemento.get("class")
+        if not classi:
+            continue
+        if "price" in classi:
+            if dettaglio["prezzo"] is None:
+                dettaglio["prezzo"] = elemento.get_text(strip=True)
+        elif "immobile__title" in classi and "headingOne" in classi:
+            if dettaglio["titolo"] is None:
+                dettaglio["titolo"] = elemento.get_text(strip=True)
+        elif "indirizzo" in classi:
+            if dettaglio["indirizzo"] is None:
+                dettaglio["indirizzo"] = elemento.get_text(strip=True)
+        elif "immobileDetails__tagLabel" in classi:
+            dettaglio["tags"].append(elemento.get_text(strip=True))
+        elif elemento.name == "dl" and "row" in classi:
+            dt = elemento.find("dt", class_="term")
+            dd = elemento.find("dd", class_="description")
+            if dt and dd:
+                termini.setdefault(dt.get_text().strip(), dd.get_text().strip())
+
+    return dettaglio
+
+
+def campi_da_termini(termini):
+    """Applica CAMPI_DETTAGLIO alle coppie dt/dd: la prima etichetta che contiene il testo cercato vince"""
+    campi = dict.fromkeys(CAMPI_DETTAGLIO.values())
+    for etichetta_scheda, valore in termini.items():
+        for etichetta, colonna in CAMPI_DETTAGLIO.items():
+            if campi[colonna] is None and etichetta in etichetta_scheda:
+                campi[colonna] = valore
+    return campi
+
+
+def analizza_annuncio(html, url, parser):
+    """
+    Estrae i dati di un annuncio dalla pagina di dettaglio. Prezzo, superficie, locali e
+    bagni restano il testo della scheda: li converte normalizza_annunci su tutto il blocco
+    """
+    soup = BeautifulSoup(html, parser)
+
+    dettaglio = estrai_dettaglio(soup)
+    campi = campi_da_termini(dettaglio["termini"])
+
+    return {
+        "_id": campi["_id"],
+        "url": url,
+        "prezzo": dettaglio["prezzo"] if dettaglio["prezzo"] is not None else "N/A",
+        "titolo": dettaglio["titolo"] if dettaglio["titolo"] is not None else "N/A",
+        "indirizzo": dettaglio["indirizzo"] if dettaglio["indirizzo"] is not None else "N/A",
+        "superficie_m2": campi["superficie_m2"],
+        "num_locali": campi["num_locali"],
+        "num_bagni": campi["num_bagni"],
+        "classe_ener": campi["classe_ener"],
+        "tags": dettaglio["tags"],
+    }
+
+
+# Parti della pagina che cambiano a ogni richiesta anche se l'annuncio è lo stesso
+# (script di tracciamento, token nei campi nascosti, commenti con timestamp)
+PARTI_VOLATILI = re.compile(
+    r"<script\b.*?</script>|<style\b.*?</style>|<noscript\b.*?</noscript>|<!--.*?-->|<input\b[^>]*type=[\"']?hidden[^>]*>",
+    re.S | re.I,
+)
+SPAZI = re.compile(r"\s+")
+
+
+# Le impronte includono VERSIONE_PARSING: dopo una modifica al parser (es. un campo nuovo in
+# CAMPI_DETTAGLIO) una pagina invariata va rianalizzata, non riusata dallo stato
+def impronta_pagina(html):
+    """Hash del corpo normalizzato (senza parti volatili e differenze di spazi), senza analizzare l'HTML"""
+    normalizzato = SPAZI.sub(" ", PARTI_VOLATILI.sub("", html))
+    return hashlib.blake2b(f"{VERSIONE_PARSING}:{normalizzato}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+def impronta_scheda(scheda):
+    """Hash dei campi della scheda nella pagina dei risultati (vedi analizza_scheda)"""
+    return hashlib.blake2b(f"{VERSIONE_PARSING}:{json.dumps(scheda, sort_keys=True)}".encode("utf-8"), digest_size=16).hexdigest()
+
 
-            link_annunci = [base_url + a.get("href") for a in soup.select("a.card__title.js_link_immobile") if a.get("href")]
+# -----------------------
+# Download con cache HTTP
+# -----------------------
+_cache_http = None
+
+
+def imposta_cache_http(cache):
+    """Attiva la cache HTTP (vedi cache_http.py) per tutte le richieste; None la disattiva"""
+    global _cache_http
+    _cache_http = cache
+
+
+# Archivio dell'HTML per la riproduzione senza rete (vedi archivio_html.py); None = disattivato
+_archivio_html = None
+
+
+def imposta_archivio_html(archivio):
+    """Attiva l'acquisizione di tutte le pagine arrivate allo scraper; None la disattiva"""
+    global _archivio_html
+    _archivio_html = archivio
+
+
+def _versione_parsing():
+    """Impronta del codice di parsing: cambia se cambiano le funzioni o le tabelle che ne determinano il risultato"""
+    funzioni = (estrai_paginazione, analizza_scheda, analizza_pagina_risultati, estrai_dettaglio, campi_da_termini, analizza_annuncio)
+    sorgente = "".join(inspect.getsource(funzione) for funzione in funzioni) + repr(CAMPI_DETTAGLIO) + repr(CARATTERISTICHE_SCHEDA)
+    return hashlib.blake2b(sorgente.encode("utf-8"), digest_size=8).hexdigest()
+
+
+# Fa parte della chiave dei risultati di parsing in cache e delle impronte salvate nello
+# stato: cache e stato viaggiano tra esecuzioni (actions/cache) e dopo una modifica al
+# parser i risultati vecchi non vanno più riusati
+VERSIONE_PARSING = _versione_parsing()
+
+# Fase di ogni funzione di parsing, per le metriche delle richieste (vedi metriche_http.py)
+FASI_METRICHE = {"analizza_pagina_risultati": "risultati", "analizza_annuncio": "dettaglio"}
+
+
+async def scarica_e_analizza(session, url, funzione, *args, riuso=None):
+    """
+    Scarica url e applica all'HTML la funzione di parsing: funzione(html, *args).
+    Il ritmo delle richieste è regolato dal controllore dell'host (vedi controllo_ritmo.py).
+    Con la cache HTTP attiva una risposta ancora fresca o confermata da un 304 non
+    viene né riscaricata né rianalizzata. riuso(impronta), se indicata, può ritornare il
+    risultato già noto per una pagina con la stessa impronta: il parsing viene saltato.
+    Ritorna (status, risultato).
+    """
+    cache = _cache_http
+    voce, fresca = cache.cerca(url) if cache else (None, False)
+    html = None
+    fase = FASI_METRICHE.get(funzione.__name__, funzione.__name__)
+    misura = MisuraRichiesta(fase)
+    status = "cache"
+
+    if fresca:
+        cache.usa(url, voce)
+    else:
+        condizionali = cache.intestazioni_condizionali(voce) if cache else {}
+        status, html, etag, last_modified = await _scarica(session, url, condizionali, misura)
+        if status == 304 and voce is None:
+            # 304 senza una copia in cache (es. da un proxy intermedio): è un miss, si chiede la pagina intera
+            logger.info(f"🔁 304 senza copia in cache per {url}: nuova richiesta senza condizioni")
+            status, html, etag, last_modified = await _scarica(session, url, {"Cache-Control": "no-cache"}, misura)
+
+        if status == 304 and voce is not None:
+            cache.usa(url, voce, rivalidata=True)
+        elif status != 200:
+            misura.registra(status)
+            return status, None
+        elif cache:
+            voce = {"hash": cache.salva(url, html, etag, last_modified)}
+
+    if cache is None:
+        risultato = await _analizza_con_misura(misura, funzione, html, *args, riuso=riuso)
+        misura.registra(status)
+        if _archivio_html is not None:
+            _archivio_html.registra(url, fase, html)
+        return 200, risultato
 
-            next_button = soup.select_one("a.pager__link.next")
-            next_url = base_url + next_button.get("href") if next_button and next_button.get("href") else None
+    # Il risultato del parsing è legato al contenuto e al codice: stesso HTML e stesso parser, stesso risultato
+    chiave = f"{funzione.__name__}:{VERSIONE_PARSING}:{args!r}:{voce['hash']}"
+    risultato = cache.risultato_analisi(chiave)
+    if risultato is None:
+        if html is None:
+            html = cache.leggi(voce)
+        risultato = await _analizza_con_misura(misura, funzione, html, *args, riuso=riuso)
+        cache.salva_analisi(chiave, voce["hash"], risultato)
+    misura.registra(status)
+    if _archivio_html is not None:
+        # Anche le pagine servite dalla cache: la riproduzione di un giorno deve trovarle tutte
+        _archivio_html.registra(url, fase, html if html is not None else cache.leggi(voce))
+    return 200, risultato
 
-            logger.info(f"✅ Trovati {len(link_annunci)} annunci in pagina {numero_pagina}")
-            return link_annunci, next_url
+
+async def _scarica(session, url, intestazioni, misura):
+    """Una richiesta GET regolata dal controllore dell'host: ritorna (status, html, etag, last_modified)"""
+    html = etag = last_modified = None
+    inizio_attesa = time.perf_counter()
+    try:
+        async with controllore_per(url).richiesta() as richiesta:
+            misura.aggiungi("attesa_ritmo", time.perf_counter() - inizio_attesa)
+            async with session.get(url, headers=intestazioni, timeout=30, trace_request_ctx=misura) as response:
+                status = response.status
+                richiesta.esito(status, response.headers.get("Retry-After"))
+                if status == 200:
+                    html = await response.text()
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                misura.fine_download()
+    # Anche le richieste senza risposta contano: dicono quanto tempo si è perso in rete
     except asyncio.TimeoutError:
+        misura.registra("timeout")
+        raise
+    except aiohttp.ClientError:
+        misura.registra("rete")
+        raise
+    return status, html, etag, last_modified
+
+
+async def _analizza_con_misura(misura, funzione, html, *args, riuso=None):
+    inizio = time.perf_counter()
+    risultato = riuso(impronta_pagina(html)) if riuso else None
+    if risultato is None:
+        risultato = await analizza_html(funzione, html, *args)
+    misura.aggiungi("parsing", time.perf_counter() - inizio)
+    return risultato
+
+
+# -----------------------
+# Modalità veloce: annunci dalle schede dei risultati
+# -----------------------
+# URL -> campi della scheda (vedi analizza_scheda), raccolti da scarica_pagina solo con la
+# modalità veloce attiva (None = disattivata) e consumati dall'estrazione degli annunci
+_schede = None
+
+
+async def estrai_da_scheda(url, progress_counter):
+    """Record parziale dell'annuncio con i soli campi della scheda, senza scaricare la pagina di dettaglio"""
+    progress_counter[0] += 1
+    return Annuncio.da_analisi(_schede.pop(url), oggi), None, None
+
+
+def schede_da_aggiornare(conn, registro, urls):
+    """
+    Filtro della modalità veloce con lo stato: solo gli annunci nuovi o con la scheda
+    cambiata vanno scaricati (URL -> priorità); l'impronta della scheda si registra insieme
+    al record estratto
+    """
+    impronte = {url: impronta_scheda(_schede.pop(url)) for url in urls if url in _schede}
+    cambiate = urls_schede_cambiate(conn, impronte)
+    registro.schede.update((url, impronte[url]) for url in cambiate)
+    return cambiate
+
+
+# -----------------------
+# Funzioni
+# -----------------------
+async def scarica_pagina(session, url, numero_pagina):
+    """Un tentativo di download della pagina: ritorna ((link, next_url, paginazione), classe_errore, dettaglio)"""
+    logger.info(f"📄 Scarico pagina {numero_pagina}")
+    # In modalità veloce si leggono anche le schede: il risultato in cache è distinto da quello dei soli link
+    argomenti = (HTML_PARSER,) if _schede is None else (HTML_PARSER, True)
+    try:
+        status, risultato = await scarica_e_analizza(session, url, analizza_pagina_risultati, *argomenti)
+    except asyncio.TimeoutError as e:
         logger.error(f"⌛ Timeout per pagina {numero_pagina}")
-        return None, None
+        return None, classifica_errore(eccezione=e), "timeout"
     except Exception as e:
         logger.error(f"❌ Errore pagina {numero_pagina}: {e}")
-        return None, None
+        return None, classifica_errore(eccezione=e), str(e)
+    if status != 200:
+        logger.warning(f"⚠️ Errore HTTP {status} per pagina {numero_pagina}")
+        return None, classifica_errore(status=status), f"HTTP {status}"
+
+    if _schede is not None:
+        schede, next_url, paginazione = risultato
+        _schede.update((scheda["url"], scheda) for scheda in schede)
+        risultato = ([scheda["url"] for scheda in schede], next_url, paginazione)
+
+    logger.info(f"✅ Trovati {len(risultato[0])} annunci in pagina {numero_pagina}")
+    return risultato, None, None
+
+
+async def scarica_pagina_con_tentativi(session, coda, url, numero_pagina):
+    """Scarica la pagina ritentando gli errori temporanei; (None, None, None) se fallisce definitivamente"""
+    risultato = await coda.riprova(url, lambda url: scarica_pagina(session, url, numero_pagina))
+    return risultato or (None, None, None)
+
+
+def url_pagina(schema_url, numero_pagina):
+    return schema_url.replace(SEGNAPOSTO_PAGINA, str(numero_pagina))
+
+
+async def scarica_pagine_sequenziali(session, coda, pagina_corrente, pagina_numero, max_pagine, tutti_link_annunci, accoda=None,
+                                     pagine_fallite=None):
+    """
+    Percorre le pagine seguendo il pulsante "next" una alla volta. Ritorna il numero di pagine scaricate;
+    la pagina che interrompe la navigazione (fallita o senza annunci) finisce in pagine_fallite
+    """
+    pagine_scaricate = 0
+    while pagina_corrente:
+        if max_pagine and pagina_numero > max_pagine:
+            logger.info(f"🔄 Raggiunto il limite di {max_pagine} pagine")
+            break
+
+        link_annunci, pagina_corrente, _ = await scarica_pagina_con_tentativi(session, coda, pagina_corrente, pagina_numero)
+        if link_annunci:
+            tutti_link_annunci.extend(link_annunci)
+            pagine_scaricate += 1
+            if accoda is not None:
+                await accoda(link_annunci)
+        elif link_annunci is None:
+            # Senza la pagina manca anche il link "next": in sequenza non si può proseguire
+            logger.warning(f"⚠️ Pagina {pagina_numero} non scaricabile dopo i tentativi, interruzione")
+            if pagine_fallite is not None:
+                pagine_fallite.append(pagina_numero)
+            break
+        else:
+            logger.warning(f"⚠️ Nessun annuncio trovato in pagina {pagina_numero}, interruzione")
+            if pagine_fallite is not None:
+                pagine_fallite.append(pagina_numero)
+            break
 
+        pagina_numero += 1
+    return pagine_scaricate
 
-async def get_urls(max_pagine=None):
-    pagina_corrente = start_url
-    pagina_numero = 1
+
+async def scarica_pagine_concorrenti(session, coda, schema_url, ultima_pagina, pagine_concorrenti, accoda=None):
+    """
+    Scarica le pagine da 2 a ultima_pagina con un pool limitato; le pagine fallite vengono
+    ritentate dalla coda senza fermare le altre. Ritorna i risultati in ordine di pagina,
+    ma passa ad accoda i link di ogni pagina appena arriva.
+    """
+    semaforo = asyncio.Semaphore(pagine_concorrenti)
+    numeri_pagina = {url_pagina(schema_url, n): n for n in range(2, ultima_pagina + 1)}
+
+    async def scarica(url):
+        async with semaforo:
+            return await scarica_pagina(session, url, numeri_pagina[url])
+
+    risultati = {}
+    async for url, risultato in coda.esegui(numeri_pagina, scarica):
+        risultati[numeri_pagina[url]] = risultato
+        if accoda is not None and risultato[0]:
+            await accoda(risultato[0])
+    return [risultati.get(n, (None, None, None)) for n in range(2, ultima_pagina + 1)]
+
+
+async def raccogli_link(max_pagine=None, pagine_concorrenti=MAX_CONCURRENT_PAGES, accoda=None, url_ricerca=None, pagine_fallite=None):
+    """
+    Raccoglie gli URL degli annunci dalle pagine dei risultati della ricerca url_ricerca
+    (predefinita: start_url) e li ritorna come lista, senza duplicati.
+    Con pagine_concorrenti > 1 legge il numero di pagine dal pager della prima pagina
+    e scarica le restanti in parallelo; se il pager non è interpretabile torna alla
+    navigazione sequenziale tramite il pulsante "next".
+    Con accoda (coroutine che riceve la lista dei link) gli URL di ogni pagina vengono
+    passati subito all'estrazione, senza aspettare le altre pagine.
+    pagine_fallite, se indicata, è una lista in cui vengono aggiunti i numeri delle pagine
+    rimaste senza annunci anche dopo i tentativi: se non resta vuota la raccolta è incompleta
+    e gli annunci mancanti non si possono considerare scomparsi.
+    """
+    pagine_fallite = [] if pagine_fallite is None else pagine_fallite
     tutti_link_annunci = []
+    coda = CodaTentativi("pagina")
+    url_ricerca = url_ricerca or start_url
     start_time = time.time()
 
-    # Timeout più lungo per GitHub Actions
-    timeout = aiohttp.ClientTimeout(total=60)
-    
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        logger.info(f"🔄 Inizio scaricamento pagine (max: {max_pagine or 'tutte'})")
+    # Sessione condivisa con le altre ricerche e con l'estrazione (vedi sessione_http.py)
+    async with sessione_http(headers) as session:
+        logger.info(f"🔄 Inizio scaricamento pagine di {url_ricerca} (max: {max_pagine or 'tutte'})")
+
+        link_annunci, next_url, paginazione = await scarica_pagina_con_tentativi(session, coda, url_ricerca, 1)
+        if not link_annunci:
+            logger.warning("⚠️ Nessun annuncio trovato in pagina 1, interruzione")
+            pagine_fallite.append(1)
+            return []
+        tutti_link_annunci.extend(link_annunci)
+        pagine_scaricate = 1
+        if accoda is not None:
+            await accoda(link_annunci)
 
-        while pagina_corrente:
-            link_annunci, pagina_corrente = await scarica_pagina(session, pagina_corrente, pagina_numero)
-            if link_annunci:
-                tutti_link_annunci.extend(link_annunci)
-            else:
-                logger.warning(f"⚠️ Nessun annuncio trovato in pagina {pagina_numero}, interruzione")
-                break
+        if pagine_concorrenti > 1 and paginazione and next_url:
+            totale_pagine, schema_url = paginazione
+            ultima_pagina = min(totale_pagine, max_pagine) if max_pagine else totale_pagine
+            logger.info(f"⚡ Pager: {totale_pagine} pagine, scarico fino a pagina {ultima_pagina} con {pagine_concorrenti} richieste parallele")
 
-            pagina_numero += 1
+            risultati = await scarica_pagine_concorrenti(session, coda, schema_url, ultima_pagina, pagine_concorrenti, accoda)
+            for numero_pagina, (link_annunci, next_url, _) in enumerate(risultati, start=2):
+                if link_annunci:
+                    tutti_link_annunci.extend(link_annunci)
+                    pagine_scaricate += 1
+                else:
+                    logger.warning(f"⚠️ Nessun annuncio ottenuto da pagina {numero_pagina}, pagina saltata")
+                    pagine_fallite.append(numero_pagina)
 
-            if max_pagine and pagina_numero > max_pagine:
-                logger.info(f"🔄 Raggiunto il limite di {max_pagine} pagine")
-                break
+            # Se il pager mostrava meno pagine di quelle reali si prosegue in sequenza
+            if risultati and next_url:
+                pagine_scaricate += await scarica_pagine_sequenziali(
+                    session, coda, next_url, ultima_pagina + 1, max_pagine, tutti_link_annunci, accoda, pagine_fallite
+                )
+        else:
+            if pagine_concorrenti > 1 and next_url:
+                logger.warning("⚠️ Pager non interpretabile, uso la navigazione sequenziale")
+            pagine_scaricate += await scarica_pagine_sequenziali(
+                session, coda, next_url, 2, max_pagine, tutti_link_annunci, accoda, pagine_fallite
+            )
 
-            # Pausa più lunga per GitHub Actions per evitare rate limiting
-            await asyncio.sleep(2.5)
+    # Rimuove i duplicati mantenendo l'ordine delle pagine
+    tutti_link_annunci = list(dict.fromkeys(tutti_link_annunci))
 
-    df_urls = pd.DataFrame({"url": tutti_link_annunci})
     logger.info(f"✅ Totale annunci trovati: {len(tutti_link_annunci)}")
-    logger.info(f"📄 Pagine scaricate: {pagina_numero - 1}")
+    logger.info(f"📄 Pagine scaricate: {pagine_scaricate}")
+    if pagine_fallite:
+        logger.warning(f"⚠️ Pagine dei risultati non lette: {sorted(pagine_fallite)} (raccolta incompleta)")
     logger.info(f"⏱️ Tempo URLs: {round(time.time() - start_time,2)} sec")
-    return df_urls
-
-
-async def estrai_annuncio(session, url, semaforo, progress_counter):
-    async with semaforo:
-        try:
-            async with session.get(url, headers=headers, timeout=30) as response:
-                if response.status != 200:
-                    return None
-                html = await response.text()
-                soup = BeautifulSoup(html, "html.parser")
-
-                prezzo = soup.select_one(".price")
-                titolo = soup.select_one(".immobile__title.headingOne")
-                indirizzo = soup.select_one(".indirizzo")
-                tag_elements = soup.select(".immobileDetails__tagLabel")
-
-                def get_value(label):
-                    for dl in soup.select("dl.row"):
-                        dt = dl.find("dt", class_="term")
-                        if dt and label in dt.text:
-                            dd = dl.find("dd", class_="description")
-                            if dd:
-                                return dd.text.strip()
-                    return None
-
-                id_annuncio = get_value("Codice annuncio")
-                superficie_raw = get_value("Superficie")
-                num_locali_raw = get_value("Numero locali")
-                num_bagni_raw = get_value("Numero bagni")
-                classe_ener = get_value("Classe energetica")
-
-                superficie = superficie_raw.split()[0].replace('.', '').replace(',', '.') if superficie_raw else None
-                num_locali = int(num_locali_raw) if num_locali_raw and num_locali_raw.isdigit() else None
-                num_bagni = int(num_bagni_raw) if num_bagni_raw and num_bagni_raw.isdigit() else None
-
-                dati = {
-                    "_id": id_annuncio,
-                    "url": url,
-                    "prezzo": prezzo.get_text(strip=True) if prezzo else "N/A",
-                    "titolo": titolo.get_text(strip=True) if titolo else "N/A",
-                    "indirizzo": indirizzo.get_text(strip=True) if indirizzo else "N/A",
-                    "superficie_m2": superficie,
-                    "num_locali": num_locali,
-                    "num_bagni": num_bagni,
-                    "classe_ener": classe_ener,
-                    "tags": [tag.get_text(strip=True) for tag in tag_elements] if tag_elements else [],
-                    "attivo": True,
-                    "data_comparsa": oggi,
-                    "data_aggiornamento": None,
-                    "data_scomparsa": None
-                }
-                
-                # Log progresso ogni 50 annunci
-                progress_counter[0] += 1
-                if progress_counter[0] % 50 == 0:
-                    logger.info(f"🏠 Processati {progress_counter[0]} annunci...")
-                
-                return dati
-        except asyncio.TimeoutError:
-            logger.warning(f"⌛ Timeout per annuncio: {url}")
-            return None
-        except Exception as e:
-            logger.warning(f"❌ Errore estrazione annuncio {url}: {e}")
-            return None
-
-
-async def get_annunci(df_urls):
-    urls = df_urls["url"].dropna().unique().tolist()
-    semaforo = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return tutti_link_annunci
+
+
+async def get_urls(max_pagine=None, pagine_concorrenti=MAX_CONCURRENT_PAGES, accoda=None, url_ricerca=None):
+    """Come raccogli_link, ma ritorna un DataFrame con la colonna url"""
+    return _dataframe({"url": await raccogli_link(max_pagine, pagine_concorrenti, accoda, url_ricerca)})
+
+
+def _dataframe(dati):
+    # Import qui: pandas serve solo a chi vuole i risultati in memoria, non al crawl
+    import pandas as pd
+    return pd.DataFrame(dati)
+
+
+async def estrai_annuncio(session, url, progress_counter, riuso=None):
+    """
+    Un tentativo di estrazione dell'annuncio: ritorna (dati, classe_errore, dettaglio).
+    riuso(url, impronta) ritorna il record già estratto se la pagina non è cambiata (vedi RegistroStato)
+    """
+    try:
+        status, dati = await scarica_e_analizza(
+            session, url, analizza_annuncio, url, HTML_PARSER,
+            riuso=(lambda impronta: riuso(url, impronta)) if riuso else None,
+        )
+        if status != 200:
+            return None, classifica_errore(status=status), f"HTTP {status}"
+        dati = Annuncio.da_analisi(dati, oggi)
+        
+        # Log progresso ogni 50 annunci
+        progress_counter[0] += 1
+        if progress_counter[0] % 50 == 0:
+            logger.info(f"🏠 Processati {progress_counter[0]} annunci...")
+        
+        return dati, None, None
+    except asyncio.TimeoutError as e:
+        logger.warning(f"⌛ Timeout per annuncio: {url}")
+        return None, classifica_errore(eccezione=e), "timeout"
+    except Exception as e:
+        logger.warning(f"❌ Errore estrazione annuncio {url}: {e}")
+        return None, classifica_errore(eccezione=e), str(e)
+
+
+async def estrai_annunci_in_pipeline(produttore, scrittore=None, filtro=None, riuso=None, da_schede=False, scadenza=None):
+    """
+    Estrae gli annunci man mano che produttore(accoda) li trova: accoda(urls) li mette
+    nella coda limitata della pipeline (vedi pipeline_annunci.py), consumata subito da
+    DETAIL_WORKERS lavoratori. Ritorna (valore ritornato dal produttore, record estratti
+    in un BloccoAnnunci, vedi record_annunci.py).
+    Con uno scrittore (vedi output_streaming.py) i record vengono scritti su file man
+    mano che arrivano invece di essere accumulati, e gli URL già nel checkpoint saltati.
+    filtro(urls) può ridurre gli URL da scaricare (es. quelli già aggiornati nello stato) e
+    ritorna URL -> priorità (vedi stato_annunci.priorita_download); riuso(url, impronta)
+    evita il parsing delle pagine non cambiate (vedi estrai_annuncio).
+    Con da_schede i record si ricavano dalle schede dei risultati (modalità veloce), senza
+    scaricare le pagine di dettaglio; solo gli URL senza scheda passano dal dettaglio.
+    Con una scadenza (vedi scadenza_crawl.py) l'estrazione si ferma allo scadere del tempo:
+    gli URL non conclusi vanno nel file della frontiera e, se la raccolta era ancora in
+    corso, il valore ritornato sono gli URL trovati fino a quel momento.
+    Gli annunci falliti vengono ritentati con backoff (vedi tentativi.py).
+    """
+    completati = scrittore.completati if scrittore is not None else set()
+    if completati:
+        logger.info(f"♻️ {len(completati)} annunci già completati, verranno saltati")
+
     start_time = time.time()
-    risultati = []
+    risultati = BloccoAnnunci()
     progress_counter = [0]  # Lista per passaggio per referenza
+    conteggi = {"trovati": 0, "accodati": 0}
+    trovati = []  # Solo con la scadenza: gli URL raccolti se la raccolta viene interrotta
 
-    logger.info(f"🔄 Inizio estrazione dati da {len(urls)} annunci")
-    
-    # Timeout più lungo per l'estrazione dati
-    timeout = aiohttp.ClientTimeout(total=90)
+    def al_risultato(record):
+        if scrittore is not None:
+            scrittore.scrivi(record)
+        else:
+            risultati.aggiungi(record)
+
+    logger.info(f"🔄 Inizio estrazione dati con {DETAIL_WORKERS} lavoratori")
     
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = [estrai_annuncio(session, url, semaforo, progress_counter) for url in urls]
-        
-        # Processa i task man mano che completano
-        for i, task in enumerate(asyncio.as_completed(tasks)):
-            result = await task
-            if result:
-                risultati.append(result)
-            
-            # Log progresso ogni 100 task completati
-            if (i + 1) % 100 == 0:
-                logger.info(f"📊 Completati {i + 1}/{len(tasks)} task")
-            
-            # Piccola pausa per non sovraccaricare
-            if (i + 1) % 20 == 0:
-                await asyncio.sleep(1)
+    # Stessa sessione (e connessioni) della raccolta URL, se già aperta
+    async with sessione_http(headers) as session:
+        if da_schede:
+            # Gli URL senza scheda (es. ripresi dalla frontiera) si scaricano dalla pagina di dettaglio
+            operazione = lambda url: (
+                estrai_da_scheda(url, progress_counter) if url in _schede
+                else estrai_annuncio(session, url, progress_counter, riuso)
+            )
+        else:
+            operazione = lambda url: estrai_annuncio(session, url, progress_counter, riuso)
+        # Con la scadenza la coda non è limitata: la priorità vale su tutti gli URL già trovati
+        pipeline = PipelineAnnunci(
+            operazione, al_risultato, lavoratori=DETAIL_WORKERS,
+            dimensione_coda=0 if scadenza is not None else DIMENSIONE_CODA, scadenza=scadenza,
+        )
 
-    df_scraping_oggi = pd.DataFrame(risultati)
-    logger.info(f"✅ Totale annunci estratti: {len(df_scraping_oggi)} in {round(time.time() - start_time,2)} sec")
-    return df_scraping_oggi
+        async def accoda(urls):
+            conteggi["trovati"] += len(urls)
+            if scadenza is not None:
+                trovati.extend(urls)
+            urls = [url for url in urls if url not in completati and url not in pipeline.visti]
+            da_scaricare = filtro(urls) if filtro and urls else dict.fromkeys(urls, PRIORITA_NUOVO)
+            for url, priorita in da_scaricare.items():
+                conteggi["accodati"] += await pipeline.accoda(url, priorita)
 
+        valore = await pipeline.esegui(produttore(accoda))
+        if scadenza is not None and scadenza.raggiunta:
+            salva_frontiera(pipeline.frontiera())
+            if valore is None:
+                valore = list(dict.fromkeys(trovati))
 
-async def scraping_completo(max_pagine=None):
-    logger.info(f"🚀 Avvio scraping completo TrovaCasa Milano")
-    
-    # Fase 1: Raccolta URLs
-    df_urls = await get_urls(max_pagine=max_pagine)
-    if df_urls.empty:
-        logger.error("❌ Nessun URL trovato")
-        return pd.DataFrame()
+    logger.info(f"🔄 Annunci messi in estrazione: {conteggi['accodati']} su {conteggi['trovati']} trovati")
+    if scrittore is not None:
+        scrittore.flush()
+        logger.info(f"✅ Totale annunci scritti su {scrittore.percorso}: {scrittore.statistiche['annunci']} in {round(time.time() - start_time,2)} sec")
+        if scrittore.statistiche.get("invariati"):
+            logger.info(f"♻️ Pagine non cambiate dall'ultimo download (parsing saltato): {scrittore.statistiche['invariati']}")
+    else:
+        logger.info(f"✅ Totale annunci estratti: {len(risultati)} in {round(time.time() - start_time,2)} sec")
+    return valore, risultati
+
+
+async def estrai_annunci(urls, scrittore=None, filtro=None, riuso=None):
+    """Come estrai_annunci_in_pipeline, per una lista di URL già nota; ritorna i record estratti"""
+    async def produttore(accoda):
+        await accoda(urls)
+
+    _, risultati = await estrai_annunci_in_pipeline(produttore, scrittore=scrittore, filtro=filtro, riuso=riuso)
+    return risultati
+
+
+async def get_annunci(df_urls, scrittore=None):
+    """Estrae gli annunci in un DataFrame; con uno scrittore i record vanno su file e ritorna None"""
+    urls = df_urls["url"].dropna().unique().tolist()
+    risultati = await estrai_annunci(urls, scrittore=scrittore)
+    return normalizza_annunci(risultati.dataframe()) if scrittore is None else None
+
+
+async def get_annunci_incrementale(df_urls, stato_db, giorni_refresh=GIORNI_REFRESH, crawl_completo=True, scrittore=None):
+    """
+    Come get_annunci, ma scarica solo gli annunci nuovi o non aggiornati da giorni_refresh
+    giorni; gli altri vengono ripresi dallo stato salvato in stato_db. I record estratti
+    finiscono subito nello stato, quindi un job interrotto non perde quanto già scaricato.
+    """
+    urls = df_urls["url"].dropna().unique().tolist()
+    conn = apri_stato(stato_db)
+    try:
+        registro = RegistroStato(conn, oggi)
+        await estrai_annunci(
+            urls, scrittore=registro, filtro=lambda urls: priorita_download(conn, urls, oggi, giorni_refresh),
+            riuso=registro.riusa,
+        )
+        return concludi_incrementale(conn, urls, crawl_completo, scrittore)
+    finally:
+        conn.close()
+
+
+def concludi_incrementale(conn, urls, crawl_completo, scrittore=None):
+    """Aggiorna il ciclo di vita nello stato e ritorna lo snapshot di oggi (con lo scrittore lo scrive e ritorna None)"""
+    aggiorna_stato(conn, [], urls, oggi, crawl_completo=crawl_completo)
+
+    if scrittore is None:
+        return normalizza_annunci(_dataframe(snapshot_stato(conn, urls, oggi)))
+
+    # Snapshot scritto un record alla volta, saltando quelli già scritti prima di un'interruzione
+    for record in iter_snapshot(conn, urls, oggi):
+        if record["url"] not in scrittore.completati:
+            scrittore.scrivi(record)
+    scrittore.flush()
+    return None
+
+
+# Se l'ultimo scraping_completo ha letto tutte le pagine dei risultati (vedi ultimo_crawl_completo)
+_ultimo_crawl_completo = None
+
+
+def ultimo_crawl_completo():
+    """
+    True se l'ultimo scraping_completo ha percorso tutte le pagine dei risultati di tutte le
+    ricerche: senza MAX_PAGES, senza scadenza raggiunta e senza pagine fallite. Solo allora gli
+    annunci assenti si possono considerare scomparsi (vedi diff_snapshot.py)
+    """
+    return _ultimo_crawl_completo
+
+
+async def scraping_completo(max_pagine=None, pagine_concorrenti=MAX_CONCURRENT_PAGES, stato_db=None, giorni_refresh=GIORNI_REFRESH, scrittore=None,
+                            ricerche=None, veloce=False, scadenza=None):
+    """
+    Raccolta degli URL ed estrazione degli annunci in pipeline: ogni pagina dei risultati
+    passa subito i suoi annunci ai lavoratori dell'estrazione. Con stato_db si scaricano
+    solo gli annunci nuovi o da aggiornare, gli altri vengono ripresi dallo stato.
+    ricerche: URL delle ricerche da percorrere (vedi manifest_crawl.py), None = solo start_url
+    veloce: i campi vengono dalle schede delle pagine dei risultati; senza stato_db i record
+    restano parziali (niente codice, classe energetica e tag) e non si scarica nessuna pagina di
+    dettaglio, con stato_db si scaricano solo gli annunci nuovi o con la scheda cambiata
+    scadenza: tempo a disposizione (vedi scadenza_crawl.py); allo scadere si ritorna lo snapshot
+    parziale. Gli URL rimasti dall'esecuzione precedente interrotta vengono scaricati per primi
+    Ritorna il DataFrame degli annunci, oppure None con uno scrittore (i record sono già su file).
+    """
+    global _schede, _ultimo_crawl_completo
+    ricerche = [start_url] if ricerche is None else ricerche
+    logger.info(f"🚀 Avvio scraping completo TrovaCasa ({len(ricerche)} ricerche{', modalità veloce' if veloce else ''})")
+    _schede = {} if veloce else None
+    frontiera = carica_frontiera()
+    pagine_fallite = []
     
-    # Fase 2: Estrazione dati
-    df_annunci = await get_annunci(df_urls)
-    return df_annunci
+    async def raccogli_urls(accoda):
+        if frontiera:
+            await accoda(frontiera)
+        # Le ricerche procedono insieme: il ritmo per host è comunque uno solo (controllo_ritmo.py)
+        risultati = await asyncio.gather(*(
+            raccogli_link(max_pagine=max_pagine, pagine_concorrenti=pagine_concorrenti, accoda=accoda, url_ricerca=url,
+                          pagine_fallite=pagine_fallite)
+            for url in ricerche
+        ))
+        return list(dict.fromkeys(url for link in risultati for url in link))
+
+    with pool_parsing():
+        # Una sola sessione HTTP per tutte le ricerche e per l'estrazione
+        async with sessione_http(headers):
+            if not stato_db:
+                urls, risultati = await estrai_annunci_in_pipeline(
+                    raccogli_urls, scrittore=scrittore, da_schede=veloce, scadenza=scadenza,
+                )
+                if not urls:
+                    logger.error("❌ Nessun URL trovato")
+                interrotto = scadenza is not None and scadenza.raggiunta
+                if not interrotto:
+                    svuota_frontiera()
+                _ultimo_crawl_completo = max_pagine is None and not interrotto and not pagine_fallite
+                return normalizza_annunci(risultati.dataframe()) if scrittore is None else None
+
+            conn = apri_stato(stato_db)
+            try:
+                # Gli annunci da aggiornare con la pagina identica all'ultimo download non vengono rianalizzati
+                registro = RegistroStato(conn, oggi)
+                if veloce:
+                    filtro = lambda urls: schede_da_aggiornare(conn, registro, urls)
+                else:
+                    filtro = lambda urls: priorita_download(conn, urls, oggi, giorni_refresh)
+                urls, _ = await estrai_annunci_in_pipeline(
+                    raccogli_urls, scrittore=registro, filtro=filtro, riuso=registro.riusa, scadenza=scadenza,
+                )
+                interrotto = scadenza is not None and scadenza.raggiunta
+                if not interrotto:
+                    svuota_frontiera()
+                if not urls:
+                    logger.error("❌ Nessun URL trovato")
+                    return _dataframe([]) if scrittore is None else None
+                # Gli annunci scomparsi si possono marcare solo se sono state lette tutte le pagine
+                _ultimo_crawl_completo = max_pagine is None and not interrotto and not pagine_fallite
+                return concludi_incrementale(conn, urls, _ultimo_crawl_completo, scrittore)
+            finally:
+                conn.close()
+
+
+def statistiche_annunci(df):
+    """Conteggi per le statistiche finali, gli stessi tenuti da ScrittoreAnnunci"""
+    if df.empty:
+        return {"annunci": 0, "con_prezzo": 0, "con_superficie": 0, "con_locali": 0}
+    return {
+        "annunci": len(df),
+        "con_prezzo": len(df[df['prezzo'] != 'N/A']),
+        "con_superficie": len(df[df['superficie_m2'].notna()]),
+        "con_locali": len(df[df['num_locali'].notna()]),
+    }
+
+
+def salva_risultato(df_result, scrittore, nome_file, formato="csv", compressione=None):
+    """
+    Salva gli annunci nel file definitivo e ritorna il percorso. I formati colonnari
+    (parquet, arrow) finiscono nella partizione del mese: scraping-data/YYYY/MM/nome_file
+    """
+    if formato in FORMATI_COLONNARI:
+        # Import qui: pyarrow serve solo per l'output colonnare
+        from output_colonnare import percorso_partizione, scrivi_colonnare, COMPRESSIONE
+        giorno = datetime.strptime(oggi, "%Y-%m-%d").date()
+        percorso = percorso_partizione(nome_file, giorno)
+        if scrittore is None:
+            scrivi_colonnare([df_result], percorso, formato, compressione or COMPRESSIONE, giorno)
+            return percorso
+    else:
+        percorso = nome_file
+
+    if scrittore is not None:
+        scrittore.finalizza(percorso)
+    else:
+        df_result.to_csv(percorso, index=False, sep=';', encoding='utf-8')
+    return percorso
+
+
+def log_statistiche_finali(statistiche):
+    logger.info(f"📊 Statistiche finali:")
+    logger.info(f"   - Annunci totali: {statistiche['annunci']}")
+    logger.info(f"   - Con prezzo: {statistiche['con_prezzo']}")
+    logger.info(f"   - Con superficie: {statistiche['con_superficie']}")
+    logger.info(f"   - Con numero locali: {statistiche['con_locali']}")
 
 
 # -----------------------
 # Esecuzione da script
 # -----------------------
 if __name__ == "__main__":
+    # Tempo a disposizione per il crawl (DEADLINE in minuti, 0 = nessun limite), contato dall'avvio
+    scadenza = scadenza_da_env()
+    
     # Leggi configurazione da variabili d'ambiente
     max_pages = os.getenv('MAX_PAGES', '5')
     max_pages = None if max_pages == '0' else int(max_pages)
+    concurrent_pages = int(os.getenv('CONCURRENT_PAGES', str(MAX_CONCURRENT_PAGES)))
+    state_db = os.getenv('STATE_DB', '')  # Vuoto = nessuno stato, si riscarica tutto
+    refresh_days = int(os.getenv('REFRESH_DAYS', str(GIORNI_REFRESH)))
+    # Modalità veloce: campi dalle schede dei risultati, dettaglio solo per annunci nuovi o cambiati (con STATE_DB)
+    fast_mode = os.getenv('FAST_MODE', '0') == '1'
+    
+    # Manifest delle ricerche e shard di questo worker (CRAWL_MANIFEST / SHARD_INDEX / SHARD_COUNT)
+    ricerche, prefisso_output = configura_shard()
+    
+    logger.info(f"🚀 Configurazione: max_pagine={max_pages}, pagine_concorrenti={concurrent_pages}, stato={state_db or 'nessuno'}, veloce={fast_mode}")
     
-    logger.info(f"🚀 Configurazione: max_pagine={max_pages}")
+    # Cache HTTP su disco condivisa con gli altri scraper (HTTP_CACHE_DIR vuoto = disattivata)
+    cache = cache_da_env()
+    imposta_cache_http(cache)
+    
+    # Archivio dell'HTML scaricato per rianalizzarlo senza rete (HTML_ARCHIVE_DIR vuoto = disattivato)
+    archivio_html = archivio_da_env()
+    imposta_archivio_html(archivio_html)
+    
+    # Output in streaming con checkpoint, per riprendere un job interrotto (STREAM_OUTPUT=0 lo disattiva)
+    # OUTPUT_FORMAT: csv, jsonl oppure parquet / arrow (tipizzati, compressi con OUTPUT_COMPRESSION)
+    output_format = os.getenv('OUTPUT_FORMAT', 'csv')
+    output_compression = os.getenv('OUTPUT_COMPRESSION', '') or None
+    scrittore = None
+    if os.getenv('STREAM_OUTPUT', '1') == '1':
+        scrittore = ScrittoreAnnunci(
+            formato=output_format, compressione=output_compression, data_scraping=datetime.strptime(oggi, "%Y-%m-%d").date()
+        )
     
     # Esegui scraping
-    df_result = asyncio.run(scraping_completo(max_pagine=max_pages))
+    df_result = asyncio.run(scraping_completo(
+        max_pagine=max_pages, pagine_concorrenti=concurrent_pages, stato_db=state_db, giorni_refresh=refresh_days,
+        scrittore=scrittore, ricerche=ricerche, veloce=fast_mode, scadenza=scadenza
+    ))
+    if archivio_html:
+        archivio_html.chiudi()
+    if scadenza is not None and scadenza.raggiunta:
+        logger.warning("⏰ Snapshot parziale: il resto della frontiera verrà scaricato dalla prossima esecuzione")
+    statistiche = scrittore.statistiche if scrittore is not None else statistiche_annunci(df_result)
+    # URL falliti anche dopo i nuovi tentativi (dead-letter), da controllare o riprovare
+    scrivi_falliti()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Tempi delle richieste per fase e status (METRICS_FORMAT: json oppure prom per Prometheus)
+    scrivi_metriche(f"{prefisso_output}_{timestamp}_metriche.{os.getenv('METRICS_FORMAT', 'json')}")
 
     # Salva CSV con timestamp dettagliato
-    if not df_result.empty:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"trovacasa_milano_{timestamp}_{len(df_result)}_annunci_completi.csv"
-        df_result.to_csv(filename, index=False, sep=';', encoding='utf-8')
+    if statistiche["annunci"]:
+        estensione = output_format if scrittore is not None or output_format in FORMATI_COLONNARI else "csv"
+        filename = f"{prefisso_output}_{timestamp}_{statistiche['annunci']}_annunci_completi.{estensione}"
+        filename = salva_risultato(df_result, scrittore, filename, estensione, output_compression)
         logger.info(f"✅ File salvato: {filename}")
         
+        # Senza stato persistente il ciclo di vita viene dal confronto con lo snapshot precedente
+        previous_snapshot = os.getenv('PREVIOUS_SNAPSHOT', '')
+        if previous_snapshot and not state_db:
+            from diff_snapshot import applica_diff, rinomina_con_conteggio
+            # Con un crawl parziale gli annunci assenti non vengono marcati come scomparsi
+            risultato_diff = applica_diff(filename, previous_snapshot, oggi=oggi, crawl_completo=ultimo_crawl_completo())
+            filename = rinomina_con_conteggio(filename, len(risultato_diff["snapshot"]))
+        
+        # Archivio storico interrogabile (ARCHIVE_DB vuoto = disattivato, vedi archivio_snapshot.py)
+        archive_db = os.getenv('ARCHIVE_DB', '')
+        if archive_db:
+            from archivio_snapshot import importa_dopo_scraping
+            importa_dopo_scraping(archive_db, filename, oggi)
+        
         # Scrivi il nome del file per GitHub Actions
         with open('csv_filename.txt', 'w') as f:
             f.write(filename)
             
         # Statistiche finali
-        logger.info(f"📊 Statistiche finali:")
-        logger.info(f"   - Annunci totali: {len(df_result)}")
-        logger.info(f"   - Con prezzo: {len(df_result[df_result['prezzo'] != 'N/A'])}")
-        logger.info(f"   - Con superficie: {len(df_result[df_result['superficie_m2'].notna()])}")
-        logger.info(f"   - Con numero locali: {len(df_result[df_result['num_locali'].notna()])}")
+        log_statistiche_finali(statistiche)
+        log_statistiche_ritmo()
+        log_statistiche_tentativi()
+        log_statistiche_metriche()
+        if cache:
+            cache.log_statistiche()
+        if archivio_html:
+            archivio_html.log_statistiche()
     else:
         logger.error("❌ Nessun annuncio estratto")
+        if scrittore is not None:
+            scrittore.scarta()
         # Crea file vuoto per evitare errori nel workflow
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        empty_filename = f"trovacasa_milano_{timestamp}_0_annunci_completi_EMPTY.csv"
-        pd.DataFrame().to_csv(empty_filename, index=False)
+        empty_filename = f"{prefisso_output}_{timestamp}_0_annunci_completi_EMPTY.csv"
+        with open(empty_filename, 'w') as f:
+            f.write("\n")
         with open('csv_filename.txt', 'w') as f:
             f.write(empty_filename)
@@ -3,31 +3,32 @@
 Scraping completo annunci TrovaCasa Milano - Versione con Google Cloud Storage
 """
 
-import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
-import pandas as pd
-import time
 from datetime import datetime
 import os
 import logging
 import json
 import tempfile
-from google.cloud import storage
+
+# Funzioni di scraping condivise con la versione GitHub Actions
+from scraper_completo import (
+    scraping_completo, ultimo_crawl_completo, imposta_cache_http, imposta_archivio_html, statistiche_annunci,
+    log_statistiche_finali, oggi, MAX_CONCURRENT_PAGES, GIORNI_REFRESH
+)
+from archivio_html import archivio_da_env
+from cache_http import cache_da_env
+from scadenza_crawl import scadenza_da_env
+from manifest_crawl import configura_shard
+from metriche_http import scrivi_metriche, log_statistiche_metriche
+from controllo_ritmo import log_statistiche_ritmo
+from tentativi import scrivi_falliti, log_statistiche_tentativi
+from output_streaming import ScrittoreAnnunci, FORMATI_COLONNARI
+from caricamento_gcs import carica_annunci, carica_file, TIPI_CONTENUTO
 
 # Configurazione logging per GitHub Actions
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# -----------------------
-# Parametri generali
-# -----------------------
-base_url = "https://www.trovacasa.it"
-start_url = f"{base_url}/case-in-vendita/milano"
-headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
-MAX_CONCURRENT_REQUESTS = 4
-oggi = datetime.today().strftime("%Y-%m-%d")
-
 # -----------------------
 # Configurazione Google Cloud Storage
 # -----------------------
@@ -41,7 +42,8 @@ def setup_gcs_client():
         else:
             logger.info("🔧 Usando credenziali GCS di default dell'ambiente")
         
-        # Crea il client GCS
+        # Crea il client GCS (import qui: google-cloud-storage serve solo per l'upload)
+        from google.cloud import storage
         client = storage.Client()
         bucket_name = os.getenv('GCP_BUCKET_NAME')
         
@@ -58,245 +60,152 @@ def setup_gcs_client():
         raise
 
 def upload_to_gcs(bucket, file_path, gcs_path):
-    """Carica un file su Google Cloud Storage"""
+    """Carica un file locale su Google Cloud Storage (metadati nella richiesta iniziale, vedi caricamento_gcs.py)"""
     try:
-        blob = bucket.blob(gcs_path)
-        blob.upload_from_filename(file_path)
-        
-        # Imposta metadati utili
-        blob.metadata = {
-            'created_by': 'github-actions-scraper',
-            'upload_date': datetime.now().isoformat(),
-            'source': 'trovacasa.it'
-        }
-        blob.patch()
-        
-        logger.info(f"✅ File caricato su GCS: gs://{bucket.name}/{gcs_path}")
-        return f"gs://{bucket.name}/{gcs_path}"
+        estensione = os.path.splitext(file_path)[1].lstrip(".")
+        gcs_url = carica_file(
+            bucket, file_path, gcs_path, TIPI_CONTENUTO.get(estensione, "application/octet-stream"),
+            comprimi=estensione in ("csv", "jsonl"),
+        )
+        logger.info(f"✅ File caricato su GCS: {gcs_url}")
+        return gcs_url
         
     except Exception as e:
         logger.error(f"❌ Errore upload su GCS: {e}")
         raise
 
-# -----------------------
-# Funzioni di scraping (identiche a prima)
-# -----------------------
-async def scarica_pagina(session, url, numero_pagina):
-    logger.info(f"📄 Scarico pagina {numero_pagina}")
-    try:
-        async with session.get(url, headers=headers, timeout=30) as response:
-            if response.status != 200:
-                logger.warning(f"⚠️ Errore HTTP {response.status} per pagina {numero_pagina}")
-                return None, None
-            html = await response.text()
-            soup = BeautifulSoup(html, "html.parser")
-
-            link_annunci = [base_url + a.get("href") for a in soup.select("a.card__title.js_link_immobile") if a.get("href")]
-
-            next_button = soup.select_one("a.pager__link.next")
-            next_url = base_url + next_button.get("href") if next_button and next_button.get("href") else None
-
-            logger.info(f"✅ Trovati {len(link_annunci)} annunci in pagina {numero_pagina}")
-            return link_annunci, next_url
-    except asyncio.TimeoutError:
-        logger.error(f"⏱ Timeout per pagina {numero_pagina}")
-        return None, None
-    except Exception as e:
-        logger.error(f"❌ Errore pagina {numero_pagina}: {e}")
-        return None, None
-
-async def get_urls(max_pagine=None):
-    pagina_corrente = start_url
-    pagina_numero = 1
-    tutti_link_annunci = []
-    start_time = time.time()
-
-    timeout = aiohttp.ClientTimeout(total=60)
-    
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        logger.info(f"📄 Inizio scaricamento pagine (max: {max_pagine or 'tutte'})")
-
-        while pagina_corrente:
-            link_annunci, pagina_corrente = await scarica_pagina(session, pagina_corrente, pagina_numero)
-            if link_annunci:
-                tutti_link_annunci.extend(link_annunci)
-            else:
-                logger.warning(f"⚠️ Nessun annuncio trovato in pagina {pagina_numero}, interruzione")
-                break
-
-            pagina_numero += 1
-
-            if max_pagine and pagina_numero > max_pagine:
-                logger.info(f"📄 Raggiunto il limite di {max_pagine} pagine")
-                break
-
-            await asyncio.sleep(2.5)
-
-    df_urls = pd.DataFrame({"url": tutti_link_annunci})
-    logger.info(f"✅ Totale annunci trovati: {len(tutti_link_annunci)}")
-    logger.info(f"📄 Pagine scaricate: {pagina_numero - 1}")
-    logger.info(f"⏱️ Tempo URLs: {round(time.time() - start_time,2)} sec")
-    return df_urls
-
-async def estrai_annuncio(session, url, semaforo, progress_counter):
-    async with semaforo:
-        try:
-            async with session.get(url, headers=headers, timeout=30) as response:
-                if response.status != 200:
-                    return None
-                html = await response.text()
-                soup = BeautifulSoup(html, "html.parser")
-
-                prezzo = soup.select_one(".price")
-                titolo = soup.select_one(".immobile__title.headingOne")
-                indirizzo = soup.select_one(".indirizzo")
-                tag_elements = soup.select(".immobileDetails__tagLabel")
-
-                def get_value(label):
-                    for dl in soup.select("dl.row"):
-                        dt = dl.find("dt", class_="term")
-                        if dt and label in dt.text:
-                            dd = dl.find("dd", class_="description")
-                            if dd:
-                                return dd.text.strip()
-                    return None
-
-                id_annuncio = get_value("Codice annuncio")
-                superficie_raw = get_value("Superficie")
-                num_locali_raw = get_value("Numero locali")
-                num_bagni_raw = get_value("Numero bagni")
-                classe_ener = get_value("Classe energetica")
-
-                superficie = superficie_raw.split()[0].replace('.', '').replace(',', '.') if superficie_raw else None
-                num_locali = int(num_locali_raw) if num_locali_raw and num_locali_raw.isdigit() else None
-                num_bagni = int(num_bagni_raw) if num_bagni_raw and num_bagni_raw.isdigit() else None
-
-                dati = {
-                    "_id": id_annuncio,
-                    "url": url,
-                    "prezzo": prezzo.get_text(strip=True) if prezzo else "N/A",
-                    "titolo": titolo.get_text(strip=True) if titolo else "N/A",
-                    "indirizzo": indirizzo.get_text(strip=True) if indirizzo else "N/A",
-                    "superficie_m2": superficie,
-                    "num_locali": num_locali,
-                    "num_bagni": num_bagni,
-                    "classe_ener": classe_ener,
-                    "tags": [tag.get_text(strip=True) for tag in tag_elements] if tag_elements else [],
-                    "attivo": True,
-                    "data_comparsa": oggi,
-                    "data_aggiornamento": None,
-                    "data_scomparsa": None
-                }
-                
-                progress_counter[0] += 1
-                if progress_counter[0] % 50 == 0:
-                    logger.info(f"🏠 Processati {progress_counter[0]} annunci...")
-                
-                return dati
-        except asyncio.TimeoutError:
-            logger.warning(f"⏱ Timeout per annuncio: {url}")
-            return None
-        except Exception as e:
-            logger.warning(f"❌ Errore estrazione annuncio {url}: {e}")
-            return None
-
-async def get_annunci(df_urls):
-    urls = df_urls["url"].dropna().unique().tolist()
-    semaforo = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
-    start_time = time.time()
-    risultati = []
-    progress_counter = [0]
-
-    logger.info(f"📄 Inizio estrazione dati da {len(urls)} annunci")
-    
-    timeout = aiohttp.ClientTimeout(total=90)
-    
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = [estrai_annuncio(session, url, semaforo, progress_counter) for url in urls]
-        
-        for i, task in enumerate(asyncio.as_completed(tasks)):
-            result = await task
-            if result:
-                risultati.append(result)
-            
-            if (i + 1) % 100 == 0:
-                logger.info(f"📊 Completati {i + 1}/{len(tasks)} task")
-            
-            if (i + 1) % 20 == 0:
-                await asyncio.sleep(1)
-
-    df_scraping_oggi = pd.DataFrame(risultati)
-    logger.info(f"✅ Totale annunci estratti: {len(df_scraping_oggi)} in {round(time.time() - start_time,2)} sec")
-    return df_scraping_oggi
-
-async def scraping_completo(max_pagine=None):
-    logger.info(f"🚀 Avvio scraping completo TrovaCasa Milano")
-    
-    # Fase 1: Raccolta URLs
-    df_urls = await get_urls(max_pagine=max_pagine)
-    if df_urls.empty:
-        logger.error("❌ Nessun URL trovato")
-        return pd.DataFrame()
-    
-    # Fase 2: Estrazione dati
-    df_annunci = await get_annunci(df_urls)
-    return df_annunci
-
 # -----------------------
 # Esecuzione da script con upload su GCS
 # -----------------------
 if __name__ == "__main__":
+    # Tempo a disposizione per il crawl (DEADLINE in minuti, 0 = nessun limite), contato dall'avvio
+    scadenza = scadenza_da_env()
+    
     # Leggi configurazione da variabili d'ambiente
     max_pages = os.getenv('MAX_PAGES', '5')
     max_pages = None if max_pages == '0' else int(max_pages)
+    concurrent_pages = int(os.getenv('CONCURRENT_PAGES', str(MAX_CONCURRENT_PAGES)))
+    state_db = os.getenv('STATE_DB', '')  # Vuoto = nessuno stato, si riscarica tutto
+    refresh_days = int(os.getenv('REFRESH_DAYS', str(GIORNI_REFRESH)))
+    # Modalità veloce: campi dalle schede dei risultati, dettaglio solo per annunci nuovi o cambiati (con STATE_DB)
+    fast_mode = os.getenv('FAST_MODE', '0') == '1'
+    
+    # Manifest delle ricerche e shard di questo worker (CRAWL_MANIFEST / SHARD_INDEX / SHARD_COUNT)
+    ricerche, prefisso_output = configura_shard()
     
-    logger.info(f"🚀 Configurazione: max_pagine={max_pages}")
+    logger.info(f"🚀 Configurazione: max_pagine={max_pages}, pagine_concorrenti={concurrent_pages}, stato={state_db or 'nessuno'}, veloce={fast_mode}")
     
     try:
         # Setup Google Cloud Storage
         bucket = setup_gcs_client()
         
+        # Cache HTTP su disco condivisa con gli altri scraper (HTTP_CACHE_DIR vuoto = disattivata)
+        cache = cache_da_env()
+        imposta_cache_http(cache)
+        
+        # Archivio dell'HTML scaricato per rianalizzarlo senza rete (HTML_ARCHIVE_DIR vuoto = disattivato)
+        archivio_html = archivio_da_env()
+        imposta_archivio_html(archivio_html)
+        
+        # Output in streaming con checkpoint, per riprendere un job interrotto (STREAM_OUTPUT=0 lo disattiva)
+        # OUTPUT_FORMAT: csv oppure parquet / arrow (tipizzati, compressi con OUTPUT_COMPRESSION)
+        output_format = os.getenv('OUTPUT_FORMAT', 'csv')
+        output_compression = os.getenv('OUTPUT_COMPRESSION', '') or None
+        scrittore = None
+        if os.getenv('STREAM_OUTPUT', '1') == '1':
+            scrittore = ScrittoreAnnunci(
+                formato=output_format, compressione=output_compression,
+                data_scraping=datetime.strptime(oggi, "%Y-%m-%d").date(),
+            )
+        
         # Esegui scraping
-        df_result = asyncio.run(scraping_completo(max_pagine=max_pages))
+        df_result = asyncio.run(scraping_completo(
+            max_pagine=max_pages, pagine_concorrenti=concurrent_pages, stato_db=state_db, giorni_refresh=refresh_days,
+            scrittore=scrittore, ricerche=ricerche, veloce=fast_mode, scadenza=scadenza
+        ))
+        if archivio_html:
+            archivio_html.chiudi()
+        if scadenza is not None and scadenza.raggiunta:
+            logger.warning("⏰ Snapshot parziale: il resto della frontiera verrà scaricato dalla prossima esecuzione")
+        statistiche = scrittore.statistiche if scrittore is not None else statistiche_annunci(df_result)
+        # URL falliti anche dopo i nuovi tentativi (dead-letter), da controllare o riprovare
+        scrivi_falliti()
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Tempi delle richieste per fase e status (METRICS_FORMAT: json oppure prom per Prometheus)
+        scrivi_metriche(f"{prefisso_output}_{timestamp}_metriche.{os.getenv('METRICS_FORMAT', 'json')}")
 
         # Salva e carica su GCS
-        if not df_result.empty:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"trovacasa_milano_{timestamp}_{len(df_result)}_annunci_completi.csv"
-            
-            # Salva localmente
-            df_result.to_csv(filename, index=False, sep=';', encoding='utf-8')
-            logger.info(f"✅ File creato localmente: {filename}")
+        if statistiche["annunci"]:
+            estensione = output_format if scrittore is not None or output_format in FORMATI_COLONNARI else "csv"
+            filename = f"{prefisso_output}_{timestamp}_{statistiche['annunci']}_annunci_completi.{estensione}"
             
             # Path su GCS con struttura organizzata
             year_month = datetime.now().strftime("%Y/%m")
             gcs_path = f"scraping-data/{year_month}/{filename}"
             
-            # Upload su Google Cloud Storage
-            gcs_url = upload_to_gcs(bucket, filename, gcs_path)
+            # Senza stato persistente il ciclo di vita viene dal confronto con lo snapshot precedente
+            # (PREVIOUS_SNAPSHOT: percorso locale, oppure "gcs" per l'ultimo caricato nel bucket)
+            previous_snapshot = os.getenv('PREVIOUS_SNAPSHOT', '')
+            if previous_snapshot and not state_db:
+                from diff_snapshot import applica_diff, snapshot_precedente_gcs, percorso_modifiche, rinomina_con_conteggio
+                if previous_snapshot == "gcs":
+                    previous_snapshot = snapshot_precedente_gcs(bucket, escludi=filename)
+                # Con un crawl parziale gli annunci assenti non vengono marcati come scomparsi
+                crawl_completo = ultimo_crawl_completo()
+                if scrittore is not None:
+                    # Il diff lavora sui campi già normalizzati del file definitivo
+                    scrittore.finalizza(filename)
+                    risultato_diff = applica_diff(filename, previous_snapshot, oggi=oggi, crawl_completo=crawl_completo)
+                else:
+                    risultato_diff = applica_diff(df_result, previous_snapshot, filename, oggi=oggi, crawl_completo=crawl_completo)
+                # Il conteggio nel nome comprende anche gli annunci scomparsi aggiunti dal diff
+                filename = rinomina_con_conteggio(filename, len(risultato_diff["snapshot"]))
+                gcs_path = f"scraping-data/{year_month}/{filename}"
+                gcs_url = upload_to_gcs(bucket, filename, gcs_path)
+                upload_to_gcs(bucket, percorso_modifiche(filename), os.path.splitext(gcs_path)[0] + "_modifiche.csv")
+                # Caricati su GCS: le copie locali non servono più
+                os.remove(filename)
+                os.remove(percorso_modifiche(filename))
+            else:
+                # Upload diretto su Google Cloud Storage, senza file locale intermedio
+                gcs_url = carica_annunci(
+                    bucket, gcs_path, estensione, df_result=df_result, scrittore=scrittore,
+                    compressione=output_compression, data_scraping=datetime.strptime(oggi, "%Y-%m-%d").date(),
+                )
+            
+            # Archivio storico interrogabile: gli snapshot del mese non ancora importati, compreso questo
+            archive_db = os.getenv('ARCHIVE_DB', '')
+            if archive_db:
+                from archivio_snapshot import apri_archivio, importa_gcs
+                archivio = apri_archivio(archive_db)
+                try:
+                    importa_gcs(archivio, bucket, os.path.dirname(gcs_path))
+                finally:
+                    archivio.close()
             
             # Scrivi informazioni per GitHub Actions (se necessario)
             with open('gcs_info.txt', 'w') as f:
                 f.write(f"GCS_URL={gcs_url}\n")
                 f.write(f"FILENAME={filename}\n")
-                f.write(f"ANNUNCI_COUNT={len(df_result)}\n")
+                f.write(f"ANNUNCI_COUNT={statistiche['annunci']}\n")
                 f.write(f"TIMESTAMP={timestamp}\n")
             
-            # Cleanup file locale
-            os.remove(filename)
-            
             # Statistiche finali
-            logger.info(f"📊 Statistiche finali:")
-            logger.info(f"   - Annunci totali: {len(df_result)}")
-            logger.info(f"   - Con prezzo: {len(df_result[df_result['prezzo'] != 'N/A'])}")
-            logger.info(f"   - Con superficie: {len(df_result[df_result['superficie_m2'].notna()])}")
-            logger.info(f"   - Con numero locali: {len(df_result[df_result['num_locali'].notna()])}")
+            log_statistiche_finali(statistiche)
             logger.info(f"   - Caricato su: {gcs_url}")
+            log_statistiche_ritmo()
+            log_statistiche_tentativi()
+            log_statistiche_metriche()
+            if cache:
+                cache.log_statistiche()
+            if archivio_html:
+                archivio_html.log_statistiche()
             
         else:
             logger.error("❌ Nessun annuncio estratto")
+            if scrittore is not None:
+                scrittore.scarta()
             # Crea file vuoto informativo
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             with open('gcs_info.txt', 'w') as f:
                 f.write(f"GCS_URL=EMPTY\n")
                 f.write(f"FILENAME=EMPTY\n")
@@ -1,99 +1,53 @@
-import aiohttp
 import asyncio
-from bs4 import BeautifulSoup
-import pandas as pd
+import csv
 from datetime import datetime
 import os
 import logging
 
+from scraper_completo import raccogli_link, pool_parsing, imposta_cache_http, headers, MAX_CONCURRENT_PAGES
+from cache_http import cache_da_env
+from controllo_ritmo import log_statistiche_ritmo
+from tentativi import scrivi_falliti, log_statistiche_tentativi
+from manifest_crawl import configura_shard
+from sessione_http import sessione_http
+from metriche_http import scrivi_metriche, log_statistiche_metriche
+
 # Configurazione logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# URL di partenza
-base_url = "https://www.trovacasa.it"
-start_url = f"{base_url}/case-in-vendita/milano"
-
 tutti_link_annunci = []
 
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-}
-
-async def scarica_pagina(session, url, numero_pagina):
-    logger.info(f"📄 Scarico pagina {numero_pagina}: {url}")
-    try:
-        async with session.get(url, headers=headers, timeout=30) as response:
-            if response.status != 200:
-                logger.warning(f"⚠️ Errore HTTP {response.status} per pagina {numero_pagina}")
-                return None, None
-
-            html = await response.text()
-            soup = BeautifulSoup(html, "html.parser")
-
-            # Estrazione link annunci
-            link_annunci = []
-            annunci = soup.select("a.card__title.js_link_immobile")
-            for a in annunci:
-                href = a.get("href")
-                if href:
-                    link_assoluto = base_url + href
-                    link_annunci.append(link_assoluto)
-
-            logger.info(f"✅ Trovati {len(link_annunci)} annunci in pagina {numero_pagina}")
-
-            # Link "pagina successiva"
-            next_button = soup.select_one("a.pager__link.next")
-            next_url = base_url + next_button.get("href") if next_button and next_button.get("href") else None
-
-            return link_annunci, next_url
-    except asyncio.TimeoutError:
-        logger.error(f"⌛ Timeout per pagina {numero_pagina}")
-        return None, None
-    except Exception as e:
-        logger.error(f"❌ Errore per pagina {numero_pagina}: {e}")
-        return None, None
-
-async def main(max_pagine=None):
+async def main(max_pagine=None, pagine_concorrenti=MAX_CONCURRENT_PAGES, ricerche=None, prefisso="url_annunci_milano"):
     """
     max_pagine = None -> scarica tutte le pagine disponibili
     max_pagine = N    -> scarica solo N pagine
+    ricerche = None   -> solo la ricerca predefinita (start_url), altrimenti lista di URL
+    Ritorna il timestamp nel nome del file salvato
     """
     global tutti_link_annunci
-    tutti_link_annunci = []  # Reset della lista per esecuzioni multiple
-    
-    pagina_corrente = start_url
-    pagina_numero = 1
-
-    # Timeout per GitHub Actions
-    timeout = aiohttp.ClientTimeout(total=60)
     
-    async with aiohttp.ClientSession(timeout=timeout) as session:
-        while pagina_corrente:
-            link_annunci, pagina_corrente = await scarica_pagina(session, pagina_corrente, pagina_numero)
-
-            if link_annunci:
-                tutti_link_annunci.extend(link_annunci)
-            else:
-                logger.warning(f"⚠️ Nessun annuncio trovato in pagina {pagina_numero}, interruzione")
-                break
-
-            pagina_numero += 1
-            if max_pagine and pagina_numero > max_pagine:
-                logger.info(f"🔄 Raggiunto il limite di {max_pagine} pagine")
-                break
-
-            # Pausa per evitare di essere bloccati
-            await asyncio.sleep(2)
+    # Raccolta URL condivisa con lo scraper completo (pager concorrente con fallback sequenziale)
+    with pool_parsing():
+        # Una sola sessione HTTP (e pool di connessioni) per tutte le ricerche
+        async with sessione_http(headers):
+            risultati = await asyncio.gather(*(
+                raccogli_link(max_pagine=max_pagine, pagine_concorrenti=pagine_concorrenti, url_ricerca=url)
+                for url in (ricerche if ricerche is not None else [None])
+            ))
+    tutti_link_annunci = list(dict.fromkeys(url for link in risultati for url in link))
 
     # Generazione nome file con timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"url_annunci_milano_{timestamp}.csv"
+    filename = f"{prefisso}_{timestamp}.csv"
     
     # Salvataggio risultati
     if tutti_link_annunci:
-        df = pd.DataFrame({"url": tutti_link_annunci})
-        df.to_csv(filename, index=False, encoding="utf-8")
+        # Una sola colonna: basta il modulo csv, senza caricare pandas
+        with open(filename, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["url"])
+            writer.writerows([url] for url in tutti_link_annunci)
         
         logger.info(f"✅ Totale annunci trovati: {len(tutti_link_annunci)}")
         logger.info(f"📁 File salvato: {filename}")
@@ -104,16 +58,34 @@ async def main(max_pagine=None):
     else:
         logger.error("❌ Nessun annuncio trovato")
         # Crea comunque un file vuoto per evitare errori nel workflow
-        with open(f"url_annunci_milano_{timestamp}_EMPTY.csv", 'w') as f:
+        with open(f"{prefisso}_{timestamp}_EMPTY.csv", 'w') as f:
             f.write("url\n")
         with open('csv_filename.txt', 'w') as f:
-            f.write(f"url_annunci_milano_{timestamp}_EMPTY.csv")
+            f.write(f"{prefisso}_{timestamp}_EMPTY.csv")
+    return timestamp
 
 if __name__ == "__main__":
     # Leggi configurazione da variabili d'ambiente
     max_pages = os.getenv('MAX_PAGES', '5')
     max_pages = None if max_pages == '0' else int(max_pages)
+    concurrent_pages = int(os.getenv('CONCURRENT_PAGES', str(MAX_CONCURRENT_PAGES)))
+    
+    # Manifest delle ricerche e shard di questo worker (CRAWL_MANIFEST / SHARD_INDEX / SHARD_COUNT)
+    ricerche, prefisso_output = configura_shard()
+    prefisso_url = prefisso_output.replace("trovacasa", "url_annunci", 1)
+    
+    logger.info(f"🚀 Avvio scraper con max_pagine={max_pages}, pagine_concorrenti={concurrent_pages}")
     
-    logger.info(f"🚀 Avvio scraper con max_pagine={max_pages}")
+    # Cache HTTP su disco condivisa con gli scraper completi (HTTP_CACHE_DIR vuoto = disattivata)
+    cache = cache_da_env()
+    imposta_cache_http(cache)
     
-    asyncio.run(main(max_pagine=max_pages))
\ No newline at end of file
+    timestamp = asyncio.run(main(max_pagine=max_pages, pagine_concorrenti=concurrent_pages, ricerche=ricerche, prefisso=prefisso_url))
+    scrivi_falliti()
+    # Accanto al CSV degli URL, con lo stesso timestamp
+    scrivi_metriche(f"{prefisso_url}_{timestamp}_metriche.{os.getenv('METRICS_FORMAT', 'json')}")
+    log_statistiche_ritmo()
+    log_statistiche_tentativi()
+    log_statistiche_metriche()
+    if cache:
+        cache.log_statistiche()
\ No newline at end of file
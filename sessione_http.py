@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Client HTTP condiviso da tutte le fasi del crawl
+
+Una sola ClientSession per tutta l'esecuzione (raccolta URL di tutte le ricerche ed
+estrazione degli annunci), così connessioni keep-alive e risoluzioni DNS della prima
+fase vengono riusate dalla seconda invece di rifare handshake TLS per ogni pagina:
+- pool per host grande quanto la concorrenza massima del controllore (controllo_ritmo.py)
+- cache DNS con TTL e keep-alive configurabili (HTTP_DNS_TTL, HTTP_KEEPALIVE)
+- intestazioni impostate una volta sulla sessione, con Accept-Encoding gzip/deflate e
+  br se il modulo Brotli è installato (aiohttp lo usa per decomprimere)
+- metriche di tempo e di riuso delle connessioni (metriche_http.py)
+"""
+
+import importlib.util
+import logging
+import os
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from controllo_ritmo import concorrenza_massima
+from metriche_http import trace_config
+
+logger = logging.getLogger(__name__)
+
+DNS_TTL = int(os.getenv('HTTP_DNS_TTL', '300'))  # Secondi di validità della cache DNS
+KEEPALIVE = int(os.getenv('HTTP_KEEPALIVE', '30'))  # Secondi di vita di una connessione inattiva
+TIMEOUT_TOTALE = 90  # Tetto per richiesta; ogni chiamata può indicarne uno più stretto
+
+_sessione = None
+
+
+def codifiche_accettate():
+    brotli = any(importlib.util.find_spec(modulo) for modulo in ("brotli", "brotlicffi"))
+    return "gzip, deflate, br" if brotli else "gzip, deflate"
+
+
+def crea_sessione(intestazioni=None):
+    connettore = aiohttp.TCPConnector(
+        limit_per_host=concorrenza_massima(),
+        ttl_dns_cache=DNS_TTL,
+        keepalive_timeout=KEEPALIVE,
+        enable_cleanup_closed=True,
+    )
+    return aiohttp.ClientSession(
+        connector=connettore,
+        headers={**(intestazioni or {}), "Accept-Encoding": codifiche_accettate()},
+        timeout=aiohttp.ClientTimeout(total=TIMEOUT_TOTALE),
+        trace_configs=[trace_config()],
+    )
+
+
+@asynccontextmanager
+async def sessione_http(intestazioni=None):
+    """
+    Sessione condivisa: dentro un blocco già aperto ritorna la stessa sessione, altrimenti
+    ne apre una che resta condivisa (e viene chiusa) per la durata del blocco
+    """
+    global _sessione
+    if _sessione is not None and not _sessione.closed:
+        yield _sessione
+        return
+
+    async with crea_sessione(intestazioni) as sessione:
+        _sessione = sessione
+        logger.info(
+            f"🔌 Sessione HTTP: {concorrenza_massima()} connessioni per host, DNS TTL {DNS_TTL} sec, "
+            f"keep-alive {KEEPALIVE} sec, Accept-Encoding {codifiche_accettate()}"
+        )
+        try:
+            yield sessione
+        finally:
+            _sessione = None
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+Stato persistente degli annunci tra un'esecuzione e l'altra (SQLite)
+
+Per ogni URL conserva l'ultimo record estratto e le date del ciclo di vita
+(data_comparsa, data_aggiornamento, data_scomparsa, attivo), così lo scraping
+completo scarica solo gli annunci nuovi o da aggiornare. Conserva anche l'impronta
+della pagina di dettaglio: se al riscaricamento non è cambiata si riusa il record
+salvato senza rianalizzare l'HTML. In modalità veloce conserva anche l'impronta della
+scheda nella pagina dei risultati: la pagina di dettaglio si scarica solo se cambia.
+"""
+
+import sqlite3
+import json
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+STATO_DB = "stato_annunci.sqlite"
+GIORNI_REFRESH = 7  # Dopo quanti giorni un annuncio già noto viene riscaricato
+
+# Colonne del ciclo di vita gestite dallo stato e non dall'estrazione
+COLONNE_CICLO_VITA = ["attivo", "data_comparsa", "data_aggiornamento", "data_scomparsa"]
+
+# Priorità degli URL da scaricare (vedi pipeline_annunci.py): prima gli annunci nuovi, poi
+# quelli scaduti (scheda cambiata, o non riscaricati da oltre due periodi di refresh, ad
+# esempio perché esclusi da un crawl interrotto dalla scadenza), infine i refresh ordinari
+PRIORITA_NUOVO = 0
+PRIORITA_SCADUTO = 1
+PRIORITA_REFRESH = 2
+
+
+def apri_stato(percorso=STATO_DB):
+    """Apre (creandolo se serve) il database dello stato annunci"""
+    conn = sqlite3.connect(percorso)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS annunci (
+            url TEXT PRIMARY KEY,
+            _id TEXT,
+            dati TEXT NOT NULL,
+            attivo INTEGER NOT NULL DEFAULT 1,
+            data_comparsa TEXT NOT NULL,
+            data_aggiornamento TEXT,
+            data_scomparsa TEXT,
+            data_ultima_visita TEXT NOT NULL,
+            data_ultimo_download TEXT NOT NULL,
+            impronta TEXT,
+            scheda TEXT
+        )
+    """)
+    # Database creati prima dell'impronta delle pagine o delle schede
+    colonne = {colonna[1] for colonna in conn.execute("PRAGMA table_info(annunci)")}
+    for colonna in ("impronta", "scheda"):
+        if colonna not in colonne:
+            conn.execute(f"ALTER TABLE annunci ADD COLUMN {colonna} TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annunci_id ON annunci(_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_annunci_attivo ON annunci(attivo)")
+    conn.commit()
+    return conn
+
+
+def priorita_download(conn, urls, oggi, giorni_refresh=GIORNI_REFRESH):
+    """Ritorna, nell'ordine dato, gli URL nuovi o scaricati da almeno giorni_refresh giorni -> priorità"""
+    giorno = datetime.strptime(oggi, "%Y-%m-%d")
+    limite = (giorno - timedelta(days=giorni_refresh)).strftime("%Y-%m-%d")
+    limite_scaduti = (giorno - timedelta(days=2 * giorni_refresh)).strftime("%Y-%m-%d")
+    # Ricerca per chiave primaria: viene chiamata pagina per pagina, non si carica tutta la tabella
+    da_scaricare = {}
+    for url in urls:
+        riga = conn.execute("SELECT data_ultimo_download FROM annunci WHERE url = ?", (url,)).fetchone()
+        if riga is None:
+            da_scaricare[url] = PRIORITA_NUOVO
+        elif riga[0] <= limite_scaduti:
+            da_scaricare[url] = PRIORITA_SCADUTO
+        elif riga[0] <= limite:
+            da_scaricare[url] = PRIORITA_REFRESH
+    return da_scaricare
+
+
+def urls_da_scaricare(conn, urls, oggi, giorni_refresh=GIORNI_REFRESH):
+    """Come priorita_download, ma ritorna solo la lista degli URL"""
+    return list(priorita_download(conn, urls, oggi, giorni_refresh))
+
+
+def urls_schede_cambiate(conn, schede):
+    """
+    Ritorna, nell'ordine dato, gli URL di schede (URL -> impronta della scheda) nuovi o
+    con la scheda cambiata -> priorità
+    """
+    cambiate = {}
+    for url, impronta in schede.items():
+        riga = conn.execute("SELECT scheda FROM annunci WHERE url = ?", (url,)).fetchone()
+        if riga is None:
+            cambiate[url] = PRIORITA_NUOVO
+        elif riga[0] != impronta:
+            cambiate[url] = PRIORITA_SCADUTO
+    return cambiate
+
+
+def registra_annunci(conn, records, oggi, impronte=None, schede=None):
+    """
+    Registra i record appena estratti:
+    - nuovi annunci: data_comparsa = oggi
+    - annunci riscaricati con dati diversi: data_aggiornamento = oggi
+    impronte: URL -> impronta della pagina da cui è stato estratto il record (se nota)
+    schede: URL -> impronta della scheda nella pagina dei risultati (modalità veloce)
+    """
+    impronte = impronte or {}
+    schede = schede or {}
+    for record in records:
+        dati = {k: v for k, v in record.items() if k not in COLONNE_CICLO_VITA}
+        dati_json = json.dumps(dati, ensure_ascii=False, sort_keys=True)
+        impronta = impronte.get(record["url"])
+        scheda = schede.get(record["url"])
+        precedente = conn.execute("SELECT dati FROM annunci WHERE url = ?", (record["url"],)).fetchone()
+        if precedente is None:
+            conn.execute(
+                "INSERT INTO annunci (url, _id, dati, attivo, data_comparsa, data_ultima_visita, data_ultimo_download, impronta, scheda) "
+                "VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)",
+                (record["url"], record.get("_id"), dati_json, oggi, oggi, oggi, impronta, scheda),
+            )
+        elif precedente[0] != dati_json:
+            conn.execute(
+                "UPDATE annunci SET _id = ?, dati = ?, data_aggiornamento = ?, data_ultimo_download = ?, "
+                "impronta = COALESCE(?, impronta), scheda = COALESCE(?, scheda) WHERE url = ?",
+                (record.get("_id"), dati_json, oggi, oggi, impronta, scheda, record["url"]),
+            )
+        else:
+            conn.execute(
+                "UPDATE annunci SET data_ultimo_download = ?, impronta = COALESCE(?, impronta), "
+                "scheda = COALESCE(?, scheda) WHERE url = ?",
+                (oggi, impronta, scheda, record["url"]),
+            )
+    conn.commit()
+
+
+def aggiorna_stato(conn, records, urls_visti, oggi, crawl_completo=True):
+    """
+    Registra i record appena estratti (vedi registra_annunci) e le date di ciclo di vita:
+    - annunci visti oggi: attivi (anche se erano scomparsi)
+    - annunci attivi non più presenti nei risultati: data_scomparsa = oggi, solo se il
+      crawl ha coperto tutte le pagine (con MAX_PAGES mancano per forza degli annunci)
+    """
+    registra_annunci(conn, records, oggi)
+
+    conn.executemany(
+        "UPDATE annunci SET attivo = 1, data_scomparsa = NULL, data_ultima_visita = ? WHERE url = ?",
+        [(oggi, url) for url in urls_visti],
+    )
+
+    scomparsi = 0
+    if crawl_completo:
+        scomparsi = conn.execute(
+            "UPDATE annunci SET attivo = 0, data_scomparsa = ? WHERE attivo = 1 AND data_ultima_visita < ?",
+            (oggi, oggi),
+        ).rowcount
+    conn.commit()
+    logger.info(f"🗂️ Stato annunci aggiornato: {len(urls_visti)} visti oggi, {scomparsi} scomparsi")
+    return scomparsi
+
+
+def _dati_salvati(dati):
+    """
+    Record salvato nello stato, con le colonne nell'ordine dell'estrazione: i dati sono
+    salvati con le chiavi in ordine alfabetico (confronto stabile tra un download e l'altro)
+    """
+    # Import qui: record_annunci importa a sua volta questo modulo
+    from record_annunci import COLONNE_ESTRATTE
+    salvato = json.loads(dati)
+    record = {colonna: salvato.pop(colonna) for colonna in COLONNE_ESTRATTE if colonna in salvato}
+    record.update(salvato)
+    return record
+
+
+def _record_da_riga(dati, attivo, comparsa, aggiornamento, scomparsa):
+    record = _dati_salvati(dati)
+    record.update({
+        "attivo": bool(attivo),
+        "data_comparsa": comparsa,
+        "data_aggiornamento": aggiornamento,
+        "data_scomparsa": scomparsa,
+    })
+    return record
+
+
+def iter_snapshot(conn, urls_visti, oggi):
+    """
+    Record completi (dati + ciclo di vita) degli annunci visti oggi, nell'ordine dei
+    risultati, seguiti da quelli scomparsi oggi; uno alla volta, senza caricarli tutti
+    """
+    visti = set()
+    for url in urls_visti:
+        riga = conn.execute(
+            "SELECT dati, attivo, data_comparsa, data_aggiornamento, data_scomparsa FROM annunci "
+            "WHERE url = ? AND data_ultima_visita = ?",
+            (url, oggi),
+        ).fetchone()
+        if riga and url not in visti:
+            visti.add(url)
+            yield _record_da_riga(*riga)
+
+    for riga in conn.execute(
+        "SELECT dati, attivo, data_comparsa, data_aggiornamento, data_scomparsa FROM annunci "
+        "WHERE data_scomparsa = ? AND data_ultima_visita < ?",
+        (oggi, oggi),
+    ):
+        yield _record_da_riga(*riga)
+
+
+def snapshot_stato(conn, urls_visti, oggi):
+    """Come iter_snapshot, ma ritorna direttamente la lista dei record"""
+    return list(iter_snapshot(conn, urls_visti, oggi))
+
+
+class RegistroStato:
+    """
+    Destinazione dei record per estrai_annunci (stessa interfaccia di ScrittoreAnnunci):
+    i record vengono registrati nello stato a blocchi man mano che arrivano, così se il
+    job viene interrotto gli annunci già scaricati non vanno riscaricati
+    """
+
+    def __init__(self, conn, oggi, batch=50):
+        self.conn = conn
+        self.oggi = oggi
+        self.batch = batch
+        self.buffer = []
+        self.completati = set()
+        self.percorso = "stato annunci"
+        self.statistiche = {"annunci": 0, "invariati": 0}
+        self.impronte = {}
+        self.schede = {}  # URL -> impronta della scheda, registrata con il record (modalità veloce)
+
+    def riusa(self, url, impronta):
+        """
+        Record salvato per url se la pagina ha la stessa impronta dell'ultimo download,
+        altrimenti None: l'impronta nuova viene registrata insieme al record estratto
+        """
+        riga = self.conn.execute("SELECT dati, impronta FROM annunci WHERE url = ?", (url,)).fetchone()
+        if riga is not None and riga[1] == impronta:
+            self.statistiche["invariati"] += 1
+            return _dati_salvati(riga[0])
+        self.impronte[url] = impronta
+        return None
+
+    def scrivi(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        registra_annunci(self.conn, self.buffer, self.oggi, self.impronte, self.schede)
+        for record in self.buffer:
+            self.impronte.pop(record["url"], None)
+            self.schede.pop(record["url"], None)
+        self.statistiche["annunci"] += len(self.buffer)
+        self.buffer = []
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Nuovi tentativi per le richieste fallite (pagine dei risultati e annunci)
+
+- ogni errore viene classificato (timeout, rete, rallentamento, server, client, parsing)
+  e ogni classe ha il suo numero massimo di tentativi per URL
+- le richieste fallite finiscono in una coda differita e vengono ritentate dopo un
+  backoff esponenziale con jitter, senza bloccare le altre
+- gli URL che falliscono anche dopo l'ultimo tentativo finiscono nel file dead-letter
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+FILE_FALLITI = "annunci_falliti.jsonl"
+BACKOFF_BASE = 2  # Secondi di attesa prima del primo nuovo tentativo
+BACKOFF_MAX = 120
+
+# Tentativi per URL oltre al primo, per classe di errore
+TENTATIVI_PER_CLASSE = {
+    "timeout": 4,
+    "rete": 4,
+    "rallentamento": 6,  # 429/503: il controllore dell'host rispetta anche Retry-After
+    "server": 3,
+    "client": 0,  # 404/410 & co.: l'annuncio non esiste più, riprovare non serve
+    "parsing": 1,
+}
+
+
+def classifica_errore(status=None, eccezione=None):
+    """Classe di errore di una richiesta fallita, dallo status HTTP o dall'eccezione"""
+    if eccezione is not None:
+        if isinstance(eccezione, asyncio.TimeoutError):
+            return "timeout"
+        if isinstance(eccezione, (aiohttp.ClientError, OSError)):
+            return "rete"
+        return "parsing"
+    if status in (429, 503):
+        return "rallentamento"
+    if status == 408:
+        return "timeout"
+    if status == 304:
+        # 304 anche senza richiesta condizionale (vedi scarica_e_analizza): risposta anomala, si riprova
+        return "server"
+    if status is not None and status >= 500:
+        return "server"
+    return "client"
+
+
+def attesa_backoff(tentativo):
+    """Backoff esponenziale con jitter completo: casuale tra 0 e BASE * 2^tentativo"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** tentativo))
+
+
+_falliti = []
+_statistiche = {"ritentati": 0, "recuperati": 0, "falliti": 0}
+
+
+def _registra_fallimento(url, tipo, classe, tentativi, dettaglio):
+    _statistiche["falliti"] += 1
+    _falliti.append({
+        "url": url,
+        "tipo": tipo,
+        "classe": classe,
+        "tentativi": tentativi,
+        "errore": dettaglio,
+        "data": datetime.now().isoformat(timespec="seconds"),
+    })
+    logger.warning(f"☠️ {tipo} {url} scartato dopo {tentativi} tentativi ({classe}: {dettaglio})")
+
+
+class CodaTentativi:
+    """
+    Coda differita dei nuovi tentativi: tiene gli URL falliti ordinati per l'istante
+    in cui possono essere ritentati e i tentativi già fatti per ognuno
+    """
+
+    def __init__(self, tipo):
+        self.tipo = tipo  # "pagina" o "annuncio", per log e dead-letter
+        self.attesa = []  # heap di (pronto_il, url)
+        self.tentativi = {}
+
+    def __len__(self):
+        return len(self.attesa)
+
+    def _prossimo_tentativo(self, url, classe, dettaglio):
+        """Secondi di backoff prima del nuovo tentativo, None se la classe di errore ha esaurito i tentativi"""
+        tentativo = self.tentativi.get(url, 0)
+        if tentativo >= TENTATIVI_PER_CLASSE.get(classe, 0):
+            self.tentativi.pop(url, None)
+            _registra_fallimento(url, self.tipo, classe, tentativo + 1, dettaglio)
+            return None
+        self.tentativi[url] = tentativo + 1
+        _statistiche["ritentati"] += 1
+        attesa = attesa_backoff(tentativo)
+        logger.info(f"🔁 {self.tipo} {url}: {classe} ({dettaglio}), tentativo {tentativo + 2} tra {round(attesa, 1)} sec")
+        return attesa
+
+    def rimanda(self, url, classe, dettaglio):
+        """Accoda un nuovo tentativo; False se la classe di errore ha esaurito i tentativi"""
+        attesa = self._prossimo_tentativo(url, classe, dettaglio)
+        if attesa is None:
+            return False
+        heapq.heappush(self.attesa, (time.monotonic() + attesa, url))
+        return True
+
+    def riuscito(self, url):
+        if self.tentativi.pop(url, 0):
+            _statistiche["recuperati"] += 1
+
+    def pronti(self):
+        """Estrae gli URL il cui backoff è scaduto"""
+        adesso = time.monotonic()
+        urls = []
+        while self.attesa and self.attesa[0][0] <= adesso:
+            urls.append(heapq.heappop(self.attesa)[1])
+        return urls
+
+    def secondi_al_prossimo(self):
+        return max(0.0, self.attesa[0][0] - time.monotonic()) if self.attesa else None
+
+    async def esegui(self, urls, operazione):
+        """
+        Esegue operazione(url) per ogni URL e genera (url, risultato) man mano che
+        riescono. operazione ritorna (risultato, classe_errore, dettaglio): con una
+        classe di errore l'URL torna in coda finché ha tentativi a disposizione.
+        """
+        in_corso = {asyncio.ensure_future(self._avvia(operazione, url)) for url in urls}
+        try:
+            while in_corso or self.attesa:
+                for url in self.pronti():
+                    in_corso.add(asyncio.ensure_future(self._avvia(operazione, url)))
+                if not in_corso:
+                    await asyncio.sleep(self.secondi_al_prossimo())
+                    continue
+
+                completati, in_corso = await asyncio.wait(
+                    in_corso, timeout=self.secondi_al_prossimo(), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in completati:
+                    url, (risultato, classe, dettaglio) = task.result()
+                    if classe is None:
+                        self.riuscito(url)
+                        yield url, risultato
+                    else:
+                        self.rimanda(url, classe, dettaglio)
+        finally:
+            for task in in_corso:
+                task.cancel()
+
+    async def riprova(self, url, operazione):
+        """Come esegue, ma per un solo URL e attendendo qui i backoff (navigazione sequenziale)"""
+        while True:
+            risultato, classe, dettaglio = await operazione(url)
+            if classe is None:
+                self.riuscito(url)
+                return risultato
+            attesa = self._prossimo_tentativo(url, classe, dettaglio)
+            if attesa is None:
+                return None
+            await asyncio.sleep(attesa)
+
+    @staticmethod
+    async def _avvia(operazione, url):
+        return url, await operazione(url)
+
+
+def scrivi_falliti(percorso=FILE_FALLITI):
+    """Scrive il file dead-letter (JSONL) con gli URL falliti definitivamente; None se non ce ne sono"""
+    if not _falliti:
+        return None
+    with open(percorso, "w", encoding="utf-8") as f:
+        for fallito in _falliti:
+            f.write(json.dumps(fallito, ensure_ascii=False) + "\n")
+    logger.warning(f"☠️ {len(_falliti)} URL falliti definitivamente salvati in {percorso}")
+    return percorso
+
+
+def unisci_falliti(cartelle, percorso=FILE_FALLITI):
+    """Riunisce in percorso i file dead-letter scritti da più processi nelle loro cartelle; None se non ce ne sono"""
+    righe = []
+    for cartella in cartelle:
+        try:
+            with open(os.path.join(cartella, FILE_FALLITI), encoding="utf-8") as f:
+                righe.extend(riga for riga in f if riga.strip())
+        except FileNotFoundError:
+            continue
+    if not righe:
+        return None
+    with open(percorso, "w", encoding="utf-8") as f:
+        f.writelines(righe)
+    logger.warning(f"☠️ {len(righe)} URL falliti definitivamente da {len(cartelle)} processi salvati in {percorso}")
+    return percorso
+
+
+def log_statistiche_tentativi():
+    s = _statistiche
+    logger.info(f"   - Nuovi tentativi: {s['ritentati']}, URL recuperati: {s['recuperati']}, falliti definitivamente: {s['falliti']}")
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Unione degli snapshot prodotti dagli shard di un crawl multiplo (vedi manifest_crawl.py)
+
+Ogni shard scrive il proprio file di annunci; qui vengono letti (CSV con ';', JSONL,
+Parquet o Arrow), concatenati e deduplicati per url: lo stesso annuncio può comparire
+in più ricerche (es. una zona inclusa in due ricerche diverse) e resta una sola volta.
+Il formato dell'output segue l'estensione del file finale.
+
+Uso: python unisci_shard.py <file_finale> <snapshot_shard> [<snapshot_shard> ...]
+"""
+
+import logging
+import os
+import sys
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def _formato(percorso):
+    return os.path.splitext(percorso)[1].lstrip(".").lower()
+
+
+def leggi_snapshot(percorso):
+    formato = _formato(percorso)
+    if formato == "csv":
+        try:
+            return pd.read_csv(percorso, sep=';', dtype=str, keep_default_na=False)
+        except pd.errors.EmptyDataError:
+            # Snapshot _EMPTY di uno shard senza annunci
+            return pd.DataFrame()
+    if formato == "jsonl":
+        return pd.read_json(percorso, lines=True, dtype=False)
+    if formato in ("parquet", "arrow"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if formato == "parquet":
+            tabella = pq.read_table(percorso)
+        else:
+            with pa.memory_map(percorso) as sorgente:
+                tabella = pa.ipc.open_file(sorgente).read_all()
+        # to_pylist mantiene tags come lista Python (to_pandas darebbe array numpy)
+        return pd.DataFrame(tabella.to_pylist())
+    raise ValueError(f"❌ Formato non supportato: {percorso}")
+
+
+def scrivi_snapshot(df, percorso, data_scraping=None):
+    """Scrive gli annunci nel formato indicato dall'estensione di percorso"""
+    formato = _formato(percorso)
+    if formato in ("parquet", "arrow"):
+        # Import qui: pyarrow serve solo per l'output colonnare
+        from output_colonnare import scrivi_colonnare, COMPRESSIONE
+        scrivi_colonnare([df], percorso, formato, COMPRESSIONE, data_scraping)
+    elif formato == "jsonl":
+        df.to_json(percorso, orient="records", lines=True, force_ascii=False)
+    else:
+        df.to_csv(percorso, index=False, sep=';', encoding='utf-8')
+
+
+def unisci_snapshot(percorsi, percorso_finale, data_scraping=None, ordina_per=None):
+    """Concatena gli snapshot degli shard, deduplica per url (e ordina per la colonna ordina_per) e ritorna gli annunci scritti"""
+    frammenti = [leggi_snapshot(p) for p in percorsi if os.path.getsize(p) > 0]
+    frammenti = [df for df in frammenti if len(df)]
+    df = pd.concat(frammenti, ignore_index=True) if frammenti else pd.DataFrame({"url": []})
+    totale = len(df)
+    df = df.drop_duplicates("url", keep="first").reset_index(drop=True)
+    if ordina_per is not None and ordina_per in df.columns:
+        df = df.sort_values(ordina_per, kind="stable", na_position="last").reset_index(drop=True)
+
+    scrivi_snapshot(df, percorso_finale, data_scraping)
+    logger.info(
+        f"🧩 Uniti {len(percorsi)} snapshot: {totale} righe, {totale - len(df)} duplicati rimossi, "
+        f"{len(df)} annunci in {percorso_finale}"
+    )
+    return len(df)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    unisci_snapshot(sys.argv[2:], sys.argv[1])